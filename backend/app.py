@@ -2,28 +2,67 @@ from flask import Flask, Blueprint
 from flask_migrate import Migrate
 from flask_cors import CORS
 from src.models import db
-from settings import DEBUG, DB_CONFIG
-from src.apis import root_blueprint, user_blueprint, organization_blueprint, requirement_blueprint
+from settings import DEBUG, DB_REPLICAS, STATS_REFRESH_INTERVAL, RATE_LIMITS
+from src.database import database_uri, engine_options, instrument_pool
+from src.routing import replicas
+from src.ratelimit import rate_limiter
+from src.metrics import metrics_blueprint
+from src.instrumentation import instrument_requests
+from src.progress import reconcile_progress_command
+from src.stats import stats_refresher, refresh_stats_command
+from src.ingestion import donation_writer
+from src.events import event_feed
+from src.embeddings import embedder
+from src.apis import root_blueprint, user_blueprint, organization_blueprint, requirement_blueprint, search_blueprint, donation_blueprint, feed_blueprint
 
+migrate = Migrate()
 
-## App Config ##
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = f"postgresql://{DB_CONFIG['user']}:{DB_CONFIG['password']}@{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}"
+def create_app(config=None):
+    """
+    Build the Flask app. `config` overrides the defaults derived from
+    settings, e.g. SQLALCHEMY_DATABASE_URI for a local database.
+    """
+    ## App Config ##
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri()
+    app.config['REPLICA_DATABASE_URIS'] = [database_uri(config=replica) for replica in DB_REPLICAS]
+    app.config['STATS_REFRESH_INTERVAL'] = STATS_REFRESH_INTERVAL
+    app.config['RATE_LIMITS'] = RATE_LIMITS
+    app.config.update(config or {})
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config['SQLALCHEMY_DATABASE_URI']))
 
-CORS(app) # Enable CORS
-db.init_app(app) # Initialize db
-migrate = Migrate(app, db) # Perform migrations
+    CORS(app) # Enable CORS
+    db.init_app(app) # Initialize db
+    migrate.init_app(app, db) # Perform migrations
+    with app.app_context():
+        instrument_pool(db.engine) # Export pool metrics
+    instrument_requests(app) # Export request latency and query metrics
+    replicas.init_app(app, app.config['REPLICA_DATABASE_URIS']) # Route read-only requests to replicas
+    rate_limiter.init_app(app, app.config['RATE_LIMITS']) # Per-client request limits
+    app.cli.add_command(reconcile_progress_command) # flask reconcile-progress
+    app.cli.add_command(refresh_stats_command) # flask refresh-stats
+    stats_refresher.init_app(app, app.config['STATS_REFRESH_INTERVAL']) # Refresh dashboard aggregates
+    donation_writer.init_app(app) # Write queued donations
+    event_feed.init_app(app) # Relay change events between workers
+    embedder.init_app(app) # Embed written requirements for semantic search
 
-## Blueprints ##
-api_v1 = Blueprint('api', __name__, url_prefix='/api/v1')
-api_v1.register_blueprint(root_blueprint)
-api_v1.register_blueprint(user_blueprint)
-api_v1.register_blueprint(organization_blueprint)
-api_v1.register_blueprint(requirement_blueprint)
+    ## Blueprints ##
+    api_v1 = Blueprint('api', __name__, url_prefix='/api/v1')
+    api_v1.register_blueprint(root_blueprint)
+    api_v1.register_blueprint(user_blueprint)
+    api_v1.register_blueprint(organization_blueprint)
+    api_v1.register_blueprint(requirement_blueprint)
+    api_v1.register_blueprint(search_blueprint)
+    api_v1.register_blueprint(donation_blueprint)
+    api_v1.register_blueprint(feed_blueprint)
 
-## Register Blueprints ##
-app.register_blueprint(api_v1)
+    ## Register Blueprints ##
+    app.register_blueprint(api_v1)
+    app.register_blueprint(metrics_blueprint)
+    return app
+
+app = create_app()
 
 
 if __name__ == '__main__':
-    app.run(debug=DEBUG)
\ No newline at end of file
+    app.run(debug=DEBUG)
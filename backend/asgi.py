@@ -0,0 +1,59 @@
+from quart import Quart, Blueprint, g, request
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.exceptions import HTTPException
+from app import app as wsgi_app
+from src.async_db import async_db
+from src.async_apis import organization_blueprint, requirement_blueprint, feed_blueprint, construct_response
+from src.ratelimit import rate_limiter
+
+## App Config ##
+# Serve with an ASGI server, e.g. `hypercorn asgi:application` or
+# `uvicorn asgi:application`. The read endpoints run on the async engine and
+# the event feed streams from the event loop, every other route is handed
+# to the WSGI app in app.py.
+async_app = Quart(__name__)
+
+@async_app.before_serving
+async def connect():
+    async_db.init(async_app.config.get('ASYNC_DATABASE_URI'))
+
+@async_app.after_serving
+async def disconnect():
+    await async_db.dispose()
+
+# Same limits and counters as the WSGI routes. The check is synchronous,
+# which is only a dictionary update with the memory backend and one round
+# trip with redis.
+@async_app.before_request
+async def limit_request():
+    allowed, g.rate_limit_headers = rate_limiter.check(request)
+    if not allowed:
+        return construct_response('Too many requests, try again shortly', 429, headers=g.rate_limit_headers)
+
+@async_app.after_request
+async def add_rate_limit_headers(response):
+    response.headers.update(g.get('rate_limit_headers', {}))
+    return response
+
+## Blueprints ##
+api_v1 = Blueprint('api', __name__, url_prefix='/api/v1')
+api_v1.register_blueprint(organization_blueprint)
+api_v1.register_blueprint(requirement_blueprint)
+api_v1.register_blueprint(feed_blueprint)
+async_app.register_blueprint(api_v1)
+
+## Dispatch ##
+fallback = WsgiToAsgi(wsgi_app)
+async_routes = async_app.url_map.bind('localhost')
+
+def is_async_route(scope):
+    try:
+        async_routes.match(scope['path'], scope['method'])
+        return True
+    except HTTPException:
+        return False
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and not is_async_route(scope):
+        return await fallback(scope, receive, send)
+    return await async_app(scope, receive, send)
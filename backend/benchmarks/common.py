@@ -0,0 +1,86 @@
+"""
+Shared helpers for the benchmark scripts. Run them from the backend
+directory, e.g. `python -m benchmarks.indexes --database sqlite:///bench.db`
+"""
+import random
+import time
+from datetime import datetime, timedelta
+from flask import Flask
+from src.models import db, User, Type, Status, Organization, Requirement, Donation
+
+TYPES = ['Food', 'Clothing', 'Blankets', 'Medicine', 'Books', 'Toys', 'Hygiene', 'Furniture']
+STATUSES = ['Open', 'In Progress', 'Fulfilled', 'Closed', 'Received', 'Delivered']
+WORDS = ['winter', 'blankets', 'rice', 'school', 'books', 'warm', 'jackets', 'medicine',
+         'children', 'shelter', 'water', 'soap', 'beds', 'toys', 'food', 'kits']
+
+def make_app(database_uri):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+    db.init_app(app)
+    return app
+
+def timed(fn, repeat=1):
+    """
+    Run `fn` `repeat` times and return the last result and the mean duration in milliseconds
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.perf_counter() - start) * 1000 / repeat
+
+def _insert(model, rows, chunk_size=5000):
+    for i in range(0, len(rows), chunk_size):
+        db.session.execute(db.insert(model), rows[i:i + chunk_size])
+    db.session.commit()
+
+def seed(users=100, organizations=500, requirements=50000, donations=50000, random_seed=42):
+    """
+    Fill an empty database with deterministic fake data using multi-row inserts
+    """
+    rng = random.Random(random_seed)
+    epoch = datetime(2024, 1, 1)
+
+    def moment():
+        return epoch + timedelta(seconds=rng.randrange(365 * 24 * 3600))
+
+    def text(words):
+        return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+    _insert(Type, [{'id': i + 1, 'name': name, 'description': name, 'created_at': epoch, 'updated_at': epoch}
+                   for i, name in enumerate(TYPES)])
+    _insert(Status, [{'id': i + 1, 'name': name, 'description': name, 'created_at': epoch, 'updated_at': epoch}
+                     for i, name in enumerate(STATUSES)])
+    _insert(User, [{'id': i + 1, 'name': f'user {i}', 'email': f'user{i}@example.com', 'password': 'password',
+                    'is_organization': True, 'created_at': epoch, 'updated_at': epoch}
+                   for i in range(users)])
+
+    rows = []
+    for i in range(organizations):
+        created_at = moment()
+        rows.append({'id': i + 1, 'name': f'organization {i}', 'description': text(8),
+                     'email': f'organization{i}@example.com', 'created_by': rng.randint(1, users),
+                     'created_at': created_at, 'updated_at': created_at})
+    _insert(Organization, rows)
+
+    rows = []
+    requirement_organizations = []
+    for i in range(requirements):
+        created_at = moment()
+        rows.append({'id': i + 1, 'organization_id': rng.randint(1, organizations),
+                     'type_id': rng.randint(1, len(TYPES)), 'status_id': rng.randint(1, len(STATUSES)),
+                     'title': text(3), 'description': text(20), 'quantity': rng.randint(1, 500),
+                     'deadline': created_at + timedelta(days=rng.randint(1, 90)), 'percent_complete': 0,
+                     'created_at': created_at, 'updated_at': created_at})
+        requirement_organizations.append(rows[-1]['organization_id'])
+    _insert(Requirement, rows)
+
+    rows = []
+    for i in range(donations):
+        created_at = moment()
+        requirement_id = rng.randint(1, requirements) if requirements else None
+        rows.append({'id': i + 1, 'requirement_id': requirement_id,
+                     'organization_id': requirement_organizations[requirement_id - 1] if requirement_id else rng.randint(1, organizations),
+                     'type_id': rng.randint(1, len(TYPES)), 'status_id': rng.randint(1, len(STATUSES)),
+                     'description': text(6), 'quantity': rng.randint(1, 50),
+                     'created_at': created_at, 'updated_at': created_at})
+    _insert(Donation, rows)
@@ -0,0 +1,98 @@
+"""
+Sustained donation ingestion. Concurrent clients submit donations through
+the API for --duration seconds while the background writer inserts them in
+batches. Reports the rate donations are acknowledged at, the rate they are
+written at (until the queue is drained) and the mean batch size, next to
+one ORM insert and commit per donation for comparison.
+
+    python -m benchmarks.donations --clients 16 --duration 10
+"""
+import time
+import argparse
+import threading
+from app import create_app
+from benchmarks.common import seed, STATUSES
+from src.models import db, Organization, Requirement, Donation
+from src.helpers import generate_access_token
+from src.ingestion import donation_writer, donation_batch_size
+
+def donation_bodies(owner_id):
+    received = STATUSES.index('Received') + 1
+    owned = Requirement.query.join(Organization).filter(Organization.created_by == owner_id).all()
+    return [{
+        'organization_id': requirement.organization_id, 'requirement_id': requirement.id, 'type_id': requirement.type_id,
+        'status_id': received, 'description': 'benchmark donation', 'quantity': 1
+    } for requirement in owned]
+
+def submit(app, token, bodies, clients, duration):
+    accepted, refused = [0] * clients, [0] * clients
+    deadline = time.perf_counter() + duration
+
+    def client(index):
+        test_client = app.test_client()
+        count = 0
+        while time.perf_counter() < deadline:
+            response = test_client.post('/api/v1/donation/', json=bodies[count % len(bodies)], headers={
+                'Authorization': f'Bearer {token}', 'Idempotency-Key': f'bench-{index}-{count}'
+            })
+            count += 1
+            if response.status_code == 202:
+                accepted[index] += 1
+            elif response.status_code == 503:
+                refused[index] += 1
+            else:
+                raise RuntimeError(f'Unexpected {response.status_code}: {response.get_json()}')
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(accepted), sum(refused)
+
+def mean_batch_size():
+    samples = {name: value for name, _, value in donation_batch_size.samples() if not name.endswith('_bucket')}
+    count = samples.get('donation_batch_size_count', 0)
+    return samples.get('donation_batch_size_sum', 0) / count if count else 0
+
+def orm_inserts(app, bodies, duration):
+    with app.app_context():
+        count, deadline = 0, time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            Donation(**bodies[count % len(bodies)]).save()
+            count += 1
+    return count / duration
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default='sqlite:////tmp/donation-bench-donations.db')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10)
+    args = parser.parse_args()
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': args.database, 'STATS_REFRESH_INTERVAL': 0, 'RATE_LIMITS': {}})
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed(users=10, organizations=50, requirements=2000, donations=0)
+        owner_id = db.session.get(Organization, 1).created_by
+        bodies = donation_bodies(owner_id)
+        token = generate_access_token(owner_id, is_organization=True, organizations=sorted({body['organization_id'] for body in bodies}))
+
+    started = time.perf_counter()
+    accepted, refused = submit(app, token, bodies, args.clients, args.duration)
+    acknowledged_in = time.perf_counter() - started
+    if not donation_writer.drain(timeout=300):
+        raise RuntimeError('The queue was not drained')
+    written_in = time.perf_counter() - started
+    with app.app_context():
+        written = Donation.query.count()
+    print(f'{args.clients} clients: {accepted / acknowledged_in:.0f} donations/s acknowledged, {refused} refused as the queue was full')
+    print(f'{written} written in {written_in:.1f}s: {written / written_in:.0f} donations/s sustained, {mean_batch_size():.1f} per batch')
+    if written != accepted:
+        raise RuntimeError(f'{accepted} donations acknowledged but {written} written')
+
+    print(f'one ORM insert and commit per donation: {orm_inserts(app, bodies, min(args.duration, 5)):.0f} donations/s')
+
+if __name__ == '__main__':
+    main()
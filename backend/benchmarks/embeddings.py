@@ -0,0 +1,80 @@
+"""
+Semantic search over --requirements requirements with the provider in
+EMBEDDINGS. Reports the time to embed them all, to embed them again when
+unchanged (only hashed), to build the index from the stored vectors, the
+latency of a top-10 query in the index next to the same scan in pure
+Python, and GET /search/?mode=semantic.
+
+    python -m benchmarks.embeddings --requirements 20000
+"""
+import time
+import random
+import itertools
+import argparse
+from app import create_app
+from benchmarks.common import seed, WORDS
+from benchmarks.load import percentile
+from src.models import db, Requirement
+from src.embeddings import get_provider, embed_requirements, build_index, embedding_indexes, normalize
+
+def latencies(fn, repeat):
+    samples = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn(i)
+        samples.append((time.perf_counter() - start) * 1e3)
+    return samples
+
+def report(name, samples):
+    print(f'{name}: p50 {percentile(samples, 0.5):.2f}ms, p99 {percentile(samples, 0.99):.2f}ms')
+
+def embed_all(provider, batch_size):
+    ids = [id for id, in db.session.execute(db.select(Requirement.id))]
+    start = time.perf_counter()
+    for offset in range(0, len(ids), batch_size):
+        embed_requirements(provider, ids[offset:offset + batch_size], batch_size)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default='sqlite:////tmp/donation-bench-embeddings.db')
+    parser.add_argument('--requirements', type=int, default=20000)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=200) # at most 560 distinct queries
+    args = parser.parse_args()
+    rng = random.Random(42)
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': args.database, 'STATS_REFRESH_INTERVAL': 0, 'RATE_LIMITS': {}})
+    # Distinct queries so that the response cache does not answer
+    combinations = list(itertools.combinations(WORDS, 3))
+    rng.shuffle(combinations)
+    queries = [' '.join(words) for words in combinations[:args.repeat]]
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed(users=10, organizations=100, requirements=args.requirements, donations=0)
+        provider = get_provider()
+        print(f'provider {provider.name}')
+        print(f'embedded {args.requirements} requirements in {embed_all(provider, args.batch_size):.1f}s')
+        print(f'unchanged, embedded again in {embed_all(provider, args.batch_size):.1f}s')
+
+        start = time.perf_counter()
+        index, stale = build_index(provider)
+        print(f'index of {len(index)} vectors built in {time.perf_counter() - start:.2f}s, {len(stale)} stale')
+        embedding_indexes.get() # the instance the endpoint reads
+
+        vectors = normalize(provider.embed(queries))
+        report('top 10 in the index', latencies(lambda i: index.nearest(vectors[i], 10), args.repeat))
+        rows = [(int(id), [float(x) for x in vector]) for id, vector in zip(index._ids[:len(index)], index._vectors[:len(index)])]
+        def scan(i):
+            query = [float(x) for x in vectors[i]]
+            return sorted(((sum(a * b for a, b in zip(vector, query)), id) for id, vector in rows), reverse=True)[:10]
+        report('same top 10 in pure Python', latencies(scan, max(args.repeat // 50, 3)))
+
+    client = app.test_client()
+    report('GET /search/?mode=semantic', latencies(
+        lambda i: client.get(f'/api/v1/search/?q={queries[i]}&mode=semantic&limit=10'), args.repeat
+    ))
+
+if __name__ == '__main__':
+    main()
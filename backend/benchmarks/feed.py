@@ -0,0 +1,123 @@
+"""
+Live feed fan-out. Registers --subscribers feed subscribers following one
+organization, one type or everything, publishes requirement changes and
+reports the cost of dispatching an event to all of them and the delay
+until threads waiting on --waiting of them receive it. For comparison,
+reports the load the same clients would put on the API by polling
+GET /requirement/?organization= every --poll-interval seconds.
+
+    python -m benchmarks.feed --subscribers 10000
+"""
+import time
+import random
+import argparse
+import threading
+from app import create_app
+from benchmarks.common import seed, TYPES
+from benchmarks.load import percentile
+from src.models import db
+from src.events import MemoryBroker, Subscriber, _message
+
+ORGANIZATIONS = 500
+
+def subscribers(count, rng):
+    for i in range(count):
+        # Mostly organizations following their own requirements
+        if i % 10 == 0:
+            yield Subscriber(max_pending=10**6)
+        elif i % 10 < 4:
+            yield Subscriber(type_id=rng.randint(1, len(TYPES)), max_pending=10**6)
+        else:
+            yield Subscriber(organization_id=rng.randint(1, ORGANIZATIONS), max_pending=10**6)
+
+def change(rng, id):
+    return _message('requirement', 'saved', {
+        'id': id, 'organization_id': rng.randint(1, ORGANIZATIONS), 'type_id': rng.randint(1, len(TYPES)),
+        'title': f'requirement {id}', 'description': 'benchmark requirement', 'quantity': 10,
+        'fulfilled_quantity': 0, 'percent_complete': 0, 'status_id': 1, 'deadline': None
+    })
+
+def dispatch_cost(broker, followers, rng, events):
+    samples = []
+    for id in range(events):
+        message = change(rng, id)
+        start = time.perf_counter()
+        broker.publish([message])
+        samples.append((time.perf_counter() - start) * 1e6)
+        # As the clients' streams would, so every delivery wakes its subscriber
+        for subscriber in followers:
+            subscriber._take()
+    return samples
+
+def delivery_delays(broker, rng, waiting, events):
+    """
+    Delay between publishing an event every 10ms and a waiting thread receiving it
+    """
+    sent, delays, lock = {}, [], threading.Lock()
+    followers = [Subscriber(max_pending=10**6) for _ in range(waiting)]
+    for subscriber in followers:
+        broker.subscribe(subscriber)
+
+    def wait(subscriber):
+        received = 0
+        while received < events:
+            frames = subscriber.take(1)
+            now = time.perf_counter()
+            for frame in frames.split(b'\n\n')[:-1]:
+                with lock:
+                    delays.append((now - sent[frame.split(b'\n')[0]]) * 1e3)
+                received += 1
+
+    threads = [threading.Thread(target=wait, args=(subscriber,)) for subscriber in followers]
+    for thread in threads:
+        thread.start()
+    for id in range(events):
+        message = change(rng, id)
+        sent[b'id: ' + message['id'].encode()] = time.perf_counter()
+        broker.publish([message])
+        time.sleep(0.01)
+    for thread in threads:
+        thread.join()
+    for subscriber in followers:
+        broker.unsubscribe(subscriber)
+    return delays
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default='sqlite:////tmp/donation-bench-feed.db')
+    parser.add_argument('--subscribers', type=int, default=10000)
+    parser.add_argument('--waiting', type=int, default=200)
+    parser.add_argument('--events', type=int, default=500)
+    parser.add_argument('--poll-interval', type=float, default=5)
+    args = parser.parse_args()
+    rng = random.Random(42)
+
+    broker = MemoryBroker(buffer_size=1000)
+    followers = list(subscribers(args.subscribers, rng))
+    for subscriber in followers:
+        broker.subscribe(subscriber)
+    samples = dispatch_cost(broker, followers, rng, args.events)
+    print(f'dispatch to {args.subscribers} subscribers: p50 {percentile(samples, 0.5):.1f}us, p99 {percentile(samples, 0.99):.1f}us per event')
+
+    delays = delivery_delays(broker, rng, args.waiting, 200)
+    print(f'{args.waiting} waiting threads: received after p50 {percentile(delays, 0.5):.2f}ms, p99 {percentile(delays, 0.99):.2f}ms')
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': args.database, 'STATS_REFRESH_INTERVAL': 0, 'RATE_LIMITS': {}})
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed(users=10, organizations=ORGANIZATIONS, requirements=50000, donations=0)
+    client = app.test_client()
+    polls = []
+    for _ in range(200):
+        start = time.perf_counter()
+        client.get(f'/api/v1/requirement/?organization={rng.randint(1, ORGANIZATIONS)}')
+        polls.append(time.perf_counter() - start)
+    rate = args.subscribers / args.poll_interval
+    print(
+        f'polling instead: {rate:.0f} requests/s at p50 {percentile(polls, 0.5) * 1e3:.2f}ms, '
+        f'{rate * sum(polls) / len(polls):.1f} cores busy serving them'
+    )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Closed-loop HTTP load generator: `concurrency` workers send GET requests
+over keep-alive connections for `duration` seconds. Give several --url
+values to compare servers, e.g. the WSGI and ASGI deployments on the same
+database:
+
+    gunicorn -w 1 --threads 8 -b 127.0.0.1:5000 app:app
+    hypercorn -w 1 -b 127.0.0.1:8000 asgi:application
+    python -m benchmarks.load --url http://127.0.0.1:5000 --url http://127.0.0.1:8000 \\
+        --path '/api/v1/requirement/?limit=50' --concurrency 200
+"""
+import time
+import argparse
+import threading
+import http.client
+from urllib.parse import urlsplit
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def run(url, paths, concurrency, duration, headers=None):
+    """
+    Drive `url` with `concurrency` threads cycling through `paths` and return
+    throughput, error count and latency percentiles (milliseconds)
+    """
+    target = urlsplit(url)
+    deadline = time.perf_counter() + duration
+    latencies, errors, lock = [], [0], threading.Lock()
+
+    def worker(offset):
+        connection = http.client.HTTPConnection(target.hostname, target.port, timeout=30)
+        local, failed, index = [], 0, offset
+        while time.perf_counter() < deadline:
+            path = paths[index % len(paths)]
+            index += 1
+            start = time.perf_counter()
+            try:
+                connection.request('GET', path, headers=headers or {})
+                response = connection.getresponse()
+                response.read()
+                if response.status >= 500:
+                    failed += 1
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                connection.close()
+                connection = http.client.HTTPConnection(target.hostname, target.port, timeout=30)
+                continue
+            local.append((time.perf_counter() - start) * 1000)
+        connection.close()
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'throughput': len(latencies) / elapsed,
+        'p50': percentile(latencies, 0.50),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', action='append', required=True)
+    parser.add_argument('--path', action='append', default=None)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=10)
+    args = parser.parse_args()
+
+    for url in args.url:
+        result = run(url, args.path or ['/api/v1/requirement/'], args.concurrency, args.duration)
+        print(f"{url}: {result['throughput']:.0f} req/s, {result['requests']} requests, {result['errors']} errors, "
+              f"p50 {result['p50']:.1f} ms, p95 {result['p95']:.1f} ms, p99 {result['p99']:.1f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Requirement matching over --requirements open requirements. Reports the
+time to build the in-memory index, the latency of a match in the index and
+through GET /requirement/match, the cost of keeping the index current, and
+the SQL query a match would otherwise run for comparison.
+
+    python -m benchmarks.matching --requirements 100000
+"""
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from app import create_app
+from benchmarks.common import seed, TYPES
+from benchmarks.load import percentile
+from src.models import db, Requirement
+from src.matching import match_indexes, build_index
+
+def future_requirements(count, organizations, rng):
+    now = datetime.utcnow()
+    for i in range(count):
+        yield {
+            'organization_id': rng.randint(1, organizations), 'type_id': rng.randint(1, len(TYPES)), 'status_id': 1,
+            'title': f'requirement {i}', 'description': 'benchmark requirement', 'quantity': rng.randint(1, 500),
+            'fulfilled_quantity': 0, 'percent_complete': 0, 'deadline': now + timedelta(minutes=rng.randrange(90 * 24 * 60)),
+            'created_at': now, 'updated_at': now
+        }
+
+def latencies(fn, repeat):
+    samples = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn(i)
+        samples.append((time.perf_counter() - start) * 1e6)
+    return samples
+
+def report(name, samples):
+    print(f'{name}: p50 {percentile(samples, 0.5):.1f}us, p99 {percentile(samples, 0.99):.1f}us')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default='sqlite:////tmp/donation-bench-matching.db')
+    parser.add_argument('--requirements', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5000)
+    args = parser.parse_args()
+    rng = random.Random(42)
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': args.database, 'STATS_REFRESH_INTERVAL': 0, 'RATE_LIMITS': {}})
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed(users=10, organizations=500, requirements=0, donations=0)
+        rows = future_requirements(args.requirements, 500, rng)
+        while True:
+            chunk = [row for _, row in zip(range(5000), rows)]
+            if not chunk:
+                break
+            db.session.execute(db.insert(Requirement), chunk)
+        db.session.commit()
+
+        start = time.perf_counter()
+        index = build_index()
+        print(f'index of {len(index)} open requirements built in {time.perf_counter() - start:.2f}s')
+        match_indexes.get() # the instance the endpoint reads
+
+        queries = [(rng.randint(1, len(TYPES)), rng.randint(1, 2000)) for _ in range(args.repeat)]
+        report('match in the index (10 allocations at most)', latencies(lambda i: index.match(*queries[i], limit=10), args.repeat))
+
+        ids = [rng.randint(1, args.requirements) for _ in range(args.repeat)]
+        report('donation progress update', latencies(lambda i: index.set_fulfilled(ids[i], rng.randint(0, 500)), args.repeat))
+
+        now = datetime.utcnow()
+        remaining = Requirement.quantity - Requirement.fulfilled_quantity
+        statement = lambda type_id: (
+            select(Requirement.id, Requirement.organization_id, remaining, Requirement.deadline)
+            .where(Requirement.type_id == type_id, Requirement.fulfilled_quantity < Requirement.quantity, Requirement.deadline >= now)
+            .order_by(Requirement.deadline, remaining, Requirement.id)
+            .limit(10)
+        )
+        sql_repeat = max(args.repeat // 50, 20)
+        report('same match as a SQL query', latencies(lambda i: db.session.execute(statement(queries[i][0])).all(), sql_repeat))
+
+    client = app.test_client()
+    report('GET /requirement/match', latencies(
+        lambda i: client.get(f'/api/v1/requirement/match?type_id={queries[i][0]}&quantity={queries[i][1]}&limit=10'), args.repeat // 5
+    ))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Login throughput with the configured password hashing. Measures the raw
+hash and verify rate of each installed scheme on one thread, then the
+login endpoint driven by concurrent clients, reported per hashing worker
+(each worker keeps at most one core busy).
+
+    python -m benchmarks.passwords --clients 16 --duration 5
+"""
+import os
+import time
+import argparse
+import threading
+from app import create_app
+from src.models import db, User
+from src.passwords import password_hasher, SCHEMES, AVAILABLE, PASSWORD_HASHING
+
+def scheme_rates(duration):
+    for name, cls in SCHEMES.items():
+        if not AVAILABLE[name]:
+            print(f'{name}: not installed')
+            continue
+        scheme = cls(**PASSWORD_HASHING.get(name, {}))
+        stored = scheme.hash('correct horse')
+        count, deadline = 0, time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            scheme.verify(stored, 'correct horse')
+            count += 1
+        print(f'{name} {PASSWORD_HASHING.get(name, {})}: {count / duration:.1f} verifications/s on one thread')
+
+def login_throughput(app, clients, duration):
+    counts, failures = [0] * clients, [0] * clients
+    deadline = time.perf_counter() + duration
+
+    def client(index):
+        test_client = app.test_client()
+        while time.perf_counter() < deadline:
+            response = test_client.post('/api/v1/user/login', json={'email': 'bench@example.com', 'password': 'correct horse'})
+            if response.status_code == 200:
+                counts[index] += 1
+            else:
+                failures[index] += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / duration, sum(failures)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default='sqlite:////tmp/donation-bench-passwords.db')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=5)
+    args = parser.parse_args()
+
+    scheme_rates(min(args.duration, 2))
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': args.database, 'STATS_REFRESH_INTERVAL': 0, 'RATE_LIMITS': {}})
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        user = User(name='bench', email='bench@example.com', is_organization=False)
+        user.set_password('correct horse')
+        user.save()
+
+    throughput, busy = login_throughput(app, args.clients, args.duration)
+    cores = min(password_hasher.workers, os.cpu_count() or 1)
+    print(f'login with {password_hasher.scheme.name}, {password_hasher.workers} workers, {args.clients} clients: '
+          f'{throughput:.1f} logins/s, {throughput / cores:.1f} per core, {busy} refused as busy')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Check that the compiled serializers produce exactly what marshmallow does
+and compare their speed on a large listing.
+
+    python -m benchmarks.serializers --requirements 20000
+"""
+import sys
+import json
+import argparse
+from benchmarks.common import make_app, seed, timed
+from src.models import db, Organization, Requirement
+from src.schemas import organizations_schema, requirements_schema, RequirementImportSchema
+from src.serializers import organization_serializer, requirement_serializer, requirement_import_serializer, encode_json
+
+def check_parity(rows, schema, serializer):
+    expected, actual = schema.dump(rows), serializer.dump(rows, many=True)
+    if expected != actual:
+        mismatch = next(i for i, (a, b) in enumerate(zip(expected, actual)) if a != b)
+        print(f'{type(schema).__name__}: mismatch at row {mismatch}: {expected[mismatch]} != {actual[mismatch]}')
+        return False
+    # Byte encoding must decode to the same document
+    return json.loads(encode_json(actual)) == expected
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default='sqlite:////tmp/donation-bench.db')
+    parser.add_argument('--requirements', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app = make_app(args.database)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed(organizations=2000, requirements=args.requirements, donations=0)
+        # Include rows with unset optional columns
+        db.session.add(Requirement(organization_id=1, type_id=1, status_id=1, title='t', description='d', quantity=1))
+        db.session.commit()
+        organizations, requirements = Organization.query.all(), Requirement.query.all()
+
+        cases = [
+            ('organizations', organizations, organizations_schema, organization_serializer),
+            ('requirements', requirements, requirements_schema, requirement_serializer),
+            ('requirement export', requirements, RequirementImportSchema(many=True), requirement_import_serializer),
+        ]
+        ok = True
+        for name, rows, schema, serializer in cases:
+            ok = check_parity(rows, schema, serializer) and ok
+            _, marshmallow_ms = timed(lambda: json.dumps(schema.dump(rows)), args.repeat)
+            _, compiled_ms = timed(lambda: serializer.dumps(rows, many=True), args.repeat)
+            print(f'{name} ({len(rows)} rows): marshmallow {marshmallow_ms:.1f} ms, '
+                  f'compiled {compiled_ms:.1f} ms ({marshmallow_ms / compiled_ms:.1f}x)')
+        print('parity: ok' if ok else 'parity: FAILED')
+        sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
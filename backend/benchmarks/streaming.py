@@ -0,0 +1,47 @@
+"""
+Compare peak memory and time of a large requirement listing serialized all
+at once (construct_response) and streamed (construct_streaming_response).
+
+    python -m benchmarks.streaming --requirements 100000
+"""
+import argparse
+import tracemalloc
+from benchmarks.common import make_app, seed, timed
+from src.models import db, Requirement
+from src.schemas import requirements_schema, requirement_schema
+from src.helpers import construct_response, construct_streaming_response
+from src.pagination import stream_all
+
+def buffered():
+    response, status, headers = construct_response('ok', 200, requirements_schema.dump(Requirement.query.all()))
+    return len(response.get_data())
+
+def streamed():
+    response = construct_streaming_response('ok', 200, stream_all(Requirement.query, Requirement), requirement_schema.dump)
+    return sum(len(chunk) for chunk in response.response)
+
+def measure(fn):
+    db.session.expunge_all()
+    tracemalloc.start()
+    size, elapsed = timed(fn)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return size, elapsed, peak
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default='sqlite:////tmp/donation-bench.db')
+    parser.add_argument('--requirements', type=int, default=100000)
+    args = parser.parse_args()
+
+    app = make_app(args.database)
+    with app.app_context(), app.test_request_context():
+        db.drop_all()
+        db.create_all()
+        seed(requirements=args.requirements, donations=0)
+        for name, fn in (('buffered', buffered), ('streamed', streamed)):
+            size, elapsed, peak = measure(fn)
+            print(f'{name}: {size / 2**20:.1f} MiB body, {elapsed:.0f} ms, peak {peak / 2**20:.1f} MiB')
+
+if __name__ == '__main__':
+    main()
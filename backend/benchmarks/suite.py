@@ -0,0 +1,298 @@
+"""
+End-to-end benchmark of every API route on a seeded database. Each route is
+driven through the in-process test client (latency, throughput and queries
+per request), then the read routes through a local HTTP server under
+concurrent load. Results are written as JSON, and compared against a
+previous run with --baseline, exiting with status 1 on a regression.
+Everything runs locally, no network access is needed.
+
+    python -m benchmarks.suite --output baseline.json
+    python -m benchmarks.suite --baseline baseline.json --output current.json
+"""
+import sys
+import json
+import time
+import argparse
+import platform
+import threading
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from werkzeug.serving import make_server, WSGIRequestHandler
+from benchmarks.common import seed, TYPES, STATUSES
+from benchmarks.load import run as run_load, percentile
+
+## Scenarios ##
+class Scenario:
+    """
+    One route under test. `request(i)` returns the path and the test client
+    keyword arguments of the i-th request, `prepare(count)` optionally
+    creates what the requests consume (e.g. rows to delete) beforehand.
+    """
+    def __init__(self, name, method, request, expected=(200,), prepare=None, http=False):
+        self.name = name
+        self.method = method
+        self.request = request
+        self.expected = expected
+        self.prepare = prepare
+        self.http = http and method == 'GET'
+
+def scenarios(context):
+    """
+    The scenarios covering the routes of src/apis.py. `context` holds the
+    seeded ids and the access token of an organization user.
+    """
+    from src.models import db, Requirement
+
+    auth = {'Authorization': f'Bearer {context["token"]}'}
+    organization_id = context['organization_id']
+    organizations, requirements = context['organizations'], context['requirements']
+    run = context['run']
+
+    def requirement_body(i):
+        return {
+            'title': f'bench requirement {i}', 'description': 'benchmark requirement', 'quantity': 10 + i % 50,
+            'status_id': 1 + i % len(STATUSES), 'type_id': 1 + i % len(TYPES), 'organization_id': organization_id
+        }
+
+    def owned_requirements(count):
+        rows = [Requirement(**requirement_body(i)) for i in range(count)]
+        db.session.add_all(rows)
+        db.session.commit()
+        return [row.id for row in rows]
+
+    def bulk_body(i):
+        lines = [json.dumps(requirement_body(i * 100 + n)) for n in range(100)]
+        return {'data': '\n'.join(lines), 'content_type': 'application/x-ndjson', 'headers': auth}
+
+    def donation_body(i):
+        return {
+            'organization_id': organization_id, 'requirement_id': context['owned_requirement'], 'type_id': 1 + i % len(TYPES),
+            'status_id': 1 + i % len(STATUSES), 'description': f'bench donation {i}', 'quantity': 1 + i % 5
+        }
+
+    to_delete = []
+    return [
+        Scenario('register', 'POST', lambda i: ('/api/v1/user/register', {'json': {
+            'name': f'bench {i}', 'email': f'bench-{run}-{i}@example.com', 'password': 'password', 'is_organization': True
+        }}), expected=(201,)),
+        Scenario('login', 'POST', lambda i: ('/api/v1/user/login', {'json': context['credentials']})),
+        Scenario('create organization', 'POST', lambda i: ('/api/v1/organization/', {'headers': auth, 'json': {
+            'name': f'bench {run} {i}', 'description': 'benchmark organization', 'email': f'org-{run}-{i}@example.com'
+        }}), expected=(201, 200)),
+        Scenario('list organizations', 'GET', lambda i: ('/api/v1/organization/', {}), http=True),
+        Scenario('list organizations by creator', 'GET',
+                 lambda i: (f'/api/v1/organization/?created_by={1 + i % context["users"]}', {}), http=True),
+        Scenario('stream organizations', 'GET', lambda i: ('/api/v1/organization/?stream=true', {}), http=True),
+        Scenario('get organization', 'GET', lambda i: (f'/api/v1/organization/{1 + i % organizations}', {}), http=True),
+        Scenario('organization stats', 'GET',
+                 lambda i: (f'/api/v1/organization/{1 + i % organizations}/stats', {}), http=True),
+        Scenario('update organization', 'PUT', lambda i: (f'/api/v1/organization/{organization_id}', {'headers': auth, 'json': {
+            'name': f'bench owner {run}', 'description': f'updated {i}', 'email': f'owner-{run}@example.com'
+        }})),
+        Scenario('create requirement', 'POST', lambda i: ('/api/v1/requirement/', {'headers': auth, 'json': requirement_body(i)}),
+                 expected=(201, 200)),
+        Scenario('list requirements', 'GET', lambda i: ('/api/v1/requirement/', {}), http=True),
+        Scenario('list requirements by organization', 'GET',
+                 lambda i: (f'/api/v1/requirement/?organization={1 + i % organizations}', {}), http=True),
+        Scenario('list requirements by type and status', 'GET',
+                 lambda i: (f'/api/v1/requirement/?type_id={1 + i % len(TYPES)}&status_id={1 + i % len(STATUSES)}', {}), http=True),
+        Scenario('match requirements', 'GET',
+                 lambda i: (f'/api/v1/requirement/match?type_id={1 + i % len(TYPES)}&quantity={1 + i % 200}', {}), http=True),
+        Scenario('get requirement', 'GET', lambda i: (f'/api/v1/requirement/{1 + i % requirements}', {}), http=True),
+        Scenario('update requirement', 'PUT', lambda i: (f'/api/v1/requirement/{context["owned_requirement"]}',
+                                                         {'headers': auth, 'json': requirement_body(i)})),
+        Scenario('delete requirement', 'DELETE', lambda i: (f'/api/v1/requirement/{to_delete[i]}', {'headers': auth}),
+                 prepare=lambda count: to_delete.extend(owned_requirements(count))),
+        Scenario('import requirements', 'POST', lambda i: ('/api/v1/requirement/bulk', bulk_body(i))),
+        Scenario('export requirements', 'GET',
+                 lambda i: (f'/api/v1/requirement/export?organization={1 + i % organizations}', {}), http=True),
+        Scenario('submit donation', 'POST', lambda i: ('/api/v1/donation/', {
+            'headers': {**auth, 'Idempotency-Key': f'bench-{run}-{i}'}, 'json': donation_body(i)
+        }), expected=(202, 200)),
+        Scenario('donation submission', 'GET', lambda i: (f'/api/v1/donation/submission/bench-{run}-{i % 10}', {'headers': auth})),
+        Scenario('search requirements', 'GET',
+                 lambda i: (f'/api/v1/search/?q=winter+blankets&page={1 + i % 3}', {}), http=True),
+        Scenario('semantic search requirements', 'GET',
+                 lambda i: (f'/api/v1/search/?q=warm+clothes+for+winter&mode=semantic&page={1 + i % 3}', {}), http=True),
+        Scenario('search organizations', 'GET',
+                 lambda i: ('/api/v1/search/?kind=organization&q=shelter+food', {}), http=True),
+    ]
+
+## In-process Runs ##
+class QueryCounter:
+    """
+    Counts the statements executed on any engine while installed
+    """
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(Engine, 'after_cursor_execute', self)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(Engine, 'after_cursor_execute', self)
+
+def run_in_process(app, scenario, count, warmup):
+    client = app.test_client()
+    if scenario.prepare:
+        with app.app_context():
+            scenario.prepare(count + warmup)
+
+    latencies, errors = [], 0
+    with QueryCounter() as queries:
+        started = time.perf_counter()
+        for i in range(count + warmup):
+            if i == warmup:
+                latencies, errors, queries.count = [], 0, 0
+                started = time.perf_counter()
+            path, kwargs = scenario.request(i)
+            start = time.perf_counter()
+            response = client.open(path, method=scenario.method, **kwargs)
+            response.get_data()
+            response.close()
+            latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code not in scenario.expected:
+                errors += 1
+        elapsed = time.perf_counter() - started
+    return {
+        'requests': count,
+        'errors': errors,
+        'throughput': count / elapsed,
+        'p50': percentile(latencies, 0.50),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+        'queries_per_request': queries.count / count,
+    }
+
+## HTTP Runs ##
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args):
+        pass
+
+def run_http(app, scenario, concurrency, duration):
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        paths = [scenario.request(i)[0] for i in range(100)]
+        with QueryCounter() as queries:
+            result = run_load(f'http://127.0.0.1:{server.server_port}', paths, concurrency, duration)
+        result['queries_per_request'] = queries.count / max(result['requests'], 1)
+        return result
+    finally:
+        server.shutdown()
+        thread.join()
+
+## Setup ##
+def build(args):
+    from app import create_app
+    from src.models import db, User, Organization, Requirement
+    from src.progress import reconcile_progress
+    from src.stats import refresh_all_stats
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': args.database, 'STATS_REFRESH_INTERVAL': 0, 'RATE_LIMITS': {}})
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed(args.users, args.organizations, args.requirements, args.donations)
+        reconcile_progress()
+        refresh_all_stats(rebuild=True)
+
+        organization = db.session.get(Organization, 1)
+        owner = db.session.get(User, organization.created_by)
+        context = {
+            'run': int(time.time()),
+            'users': args.users,
+            'organizations': args.organizations,
+            'requirements': args.requirements,
+            'organization_id': organization.id,
+            'owned_requirement': Requirement.query.filter_by(organization_id=organization.id).first().id,
+            'credentials': {'email': owner.email, 'password': 'password'},
+        }
+    response = app.test_client().post('/api/v1/user/login', json=context['credentials'])
+    context['token'] = response.get_json()['data']['access_token']
+    return app, context
+
+## Comparison ##
+def compare(current, baseline, tolerance):
+    """
+    Regressions of `current` against `baseline`: p95 latency up or
+    throughput down by more than `tolerance`, or more queries per request
+    """
+    regressions = []
+    for mode, results in current['results'].items():
+        for name, result in results.items():
+            base = baseline['results'].get(mode, {}).get(name)
+            if base is None:
+                continue
+            if result['p95'] > base['p95'] * (1 + tolerance):
+                regressions.append(f'{mode} {name}: p95 {base["p95"]:.2f} -> {result["p95"]:.2f} ms')
+            if result['throughput'] < base['throughput'] * (1 - tolerance):
+                regressions.append(f'{mode} {name}: throughput {base["throughput"]:.0f} -> {result["throughput"]:.0f} req/s')
+            if result['queries_per_request'] > base['queries_per_request'] + 0.5:
+                regressions.append(f'{mode} {name}: queries per request {base["queries_per_request"]:.1f} -> {result["queries_per_request"]:.1f}')
+            if result['errors'] > base['errors']:
+                regressions.append(f'{mode} {name}: errors {base["errors"]} -> {result["errors"]}')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default='sqlite:////tmp/donation-bench-suite.db')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--organizations', type=int, default=200)
+    parser.add_argument('--requirements', type=int, default=10000)
+    parser.add_argument('--donations', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per route in process')
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=2, help='seconds of HTTP load per read route, 0 skips it')
+    parser.add_argument('--only', action='append', help='run only the named routes')
+    parser.add_argument('--output', help='write the JSON results to this file instead of stdout')
+    parser.add_argument('--baseline', help='JSON results of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    app, context = build(args)
+    selected = [scenario for scenario in scenarios(context) if not args.only or scenario.name in args.only]
+    results = {'in_process': {}, 'http': {}}
+    for scenario in selected:
+        results['in_process'][scenario.name] = run_in_process(app, scenario, args.requests, args.warmup)
+        print(f'in process  {scenario.name}: {results["in_process"][scenario.name]["p95"]:.2f} ms p95', file=sys.stderr)
+    if args.duration:
+        for scenario in selected:
+            if scenario.http:
+                results['http'][scenario.name] = run_http(app, scenario, args.concurrency, args.duration)
+                print(f'http        {scenario.name}: {results["http"][scenario.name]["throughput"]:.0f} req/s', file=sys.stderr)
+
+    report = {
+        'meta': {
+            'database': app.config['SQLALCHEMY_DATABASE_URI'].split('://')[0],
+            'python': platform.python_version(),
+            'sizes': {name: getattr(args, name) for name in ('users', 'organizations', 'requirements', 'donations')},
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+        },
+        'results': results,
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(report, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
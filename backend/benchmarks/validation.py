@@ -0,0 +1,75 @@
+"""
+Request body validation cost on the write routes. Compares, per schema,
+validating and then loading a body (what the routes used to do) with
+loading it once, and profiles --requests POST /requirement/ calls to report
+the CPU per request and the share spent deserializing the body.
+
+    python -m benchmarks.validation --requests 2000
+"""
+import time
+import pstats
+import cProfile
+import argparse
+from app import create_app
+from benchmarks.common import seed
+from src.models import db, Organization
+from src.schemas import RegisterRequestSchema, organization_schema, requirement_schema, donation_schema
+from src.helpers import generate_access_token
+
+BODIES = [
+    ('register', RegisterRequestSchema(), {'name': 'bench user', 'email': 'bench@example.com', 'password': 'password', 'is_organization': True}),
+    ('organization', organization_schema, {'name': 'bench', 'description': 'benchmark organization', 'email': 'org@example.com', 'website': 'https://example.com'}),
+    ('requirement', requirement_schema, {'title': 'winter blankets', 'description': 'warm blankets', 'quantity': 10, 'status_id': 1, 'type_id': 1, 'organization_id': 1}),
+    ('donation', donation_schema, {'organization_id': 1, 'requirement_id': 1, 'type_id': 1, 'status_id': 1, 'description': 'blankets', 'quantity': 2}),
+]
+
+def cpu_per_call(fn, repeat):
+    # CPU of this thread only, background threads (e.g. the embedder) are not the request's
+    start = time.thread_time()
+    for _ in range(repeat):
+        fn()
+    return (time.thread_time() - start) * 1e6 / repeat
+
+def compare_schemas(repeat):
+    for name, schema, body in BODIES:
+        twice = cpu_per_call(lambda: (schema.validate(body), schema.load(body)), repeat)
+        once = cpu_per_call(lambda: schema.load(body), repeat)
+        print(f'{name}: validate + load {twice:.1f}us, load once {once:.1f}us, {twice - once:.1f}us saved per request')
+
+def profile_requests(app, token, organization_id, count):
+    client = app.test_client()
+    body = {**BODIES[2][2], 'organization_id': organization_id}
+    headers = {'Authorization': f'Bearer {token}'}
+    post = lambda: client.post('/api/v1/requirement/', json=body, headers=headers)
+    post() # warm up
+    print(f'POST /requirement/: {cpu_per_call(post, count):.0f}us CPU per request')
+
+    profiler = cProfile.Profile()
+    profiler.runcall(lambda: [post() for _ in range(count)])
+    stats = pstats.Stats(profiler).stats
+    total = sum(inline for _, _, inline, _, _ in stats.values())
+    for (filename, _, function), (_, calls, _, cumulative, _) in stats.items():
+        if function == '_do_load' and 'marshmallow' in filename:
+            print(f'  Schema._do_load: {calls / count:.0f} call(s), {cumulative * 1e6 / count:.0f}us per request ({cumulative / total:.1%} of profiled time)')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default='sqlite:////tmp/donation-bench-validation.db')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=20000)
+    args = parser.parse_args()
+
+    compare_schemas(args.repeat)
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': args.database, 'STATS_REFRESH_INTERVAL': 0, 'RATE_LIMITS': {}})
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed(users=10, organizations=10, requirements=100, donations=0)
+        organization = db.session.get(Organization, 1)
+        organization_id = organization.id
+        token = generate_access_token(organization.created_by, is_organization=True, organizations=[organization_id])
+    profile_requests(app, token, organization_id, args.requests)
+
+if __name__ == '__main__':
+    main()
@@ -51,6 +51,15 @@ def get_metadata():
     return target_db.metadata
 
 
+# Database-maintained search columns and indexes (see the add search
+# vectors revision) are not mapped on the models, autogenerate must not
+# drop them
+def include_object(object, name, type_, reflected, compare_to):
+    if reflected and compare_to is None and name:
+        return not ('search_vector' in name or name.endswith('_trgm'))
+    return True
+
+
 def run_migrations_offline():
     """Run migrations in 'offline' mode.
 
@@ -65,7 +74,8 @@ def run_migrations_offline():
     """
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=get_metadata(), literal_binds=True
+        url=url, target_metadata=get_metadata(), literal_binds=True,
+        include_object=include_object
     )
 
     with context.begin_transaction():
@@ -93,6 +103,7 @@ def run_migrations_online():
     conf_args = current_app.extensions['migrate'].configure_args
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
+    conf_args.setdefault("include_object", include_object)
 
     connectable = get_engine()
 
@@ -0,0 +1,49 @@
+"""Add lookup indexes
+
+Revision ID: 3f9a1c2e7b4d
+Revises: bd8d3297f85f
+Create Date: 2026-10-18 10:12:44.318205
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9a1c2e7b4d'
+down_revision = 'bd8d3297f85f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('organization', schema=None) as batch_op:
+        batch_op.create_index('ix_organization_created_at_id', ['created_at', 'id'], unique=False)
+        batch_op.create_index('ix_organization_created_by_created_at_id', ['created_by', 'created_at', 'id'], unique=False)
+        batch_op.create_index('ix_organization_email_name', ['email', 'name'], unique=False)
+
+    with op.batch_alter_table('requirement', schema=None) as batch_op:
+        batch_op.create_index('ix_requirement_created_at_id', ['created_at', 'id'], unique=False)
+        batch_op.create_index('ix_requirement_organization_id_created_at_id', ['organization_id', 'created_at', 'id'], unique=False)
+        batch_op.create_index('ix_requirement_type_id_created_at_id', ['type_id', 'created_at', 'id'], unique=False)
+        batch_op.create_index('ix_requirement_status_id_created_at_id', ['status_id', 'created_at', 'id'], unique=False)
+        batch_op.create_index('ix_requirement_deadline', ['deadline'], unique=False)
+
+    with op.batch_alter_table('donation', schema=None) as batch_op:
+        batch_op.create_index('ix_donation_organization_id_created_at', ['organization_id', 'created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('donation', schema=None) as batch_op:
+        batch_op.drop_index('ix_donation_organization_id_created_at')
+
+    with op.batch_alter_table('requirement', schema=None) as batch_op:
+        batch_op.drop_index('ix_requirement_deadline')
+        batch_op.drop_index('ix_requirement_status_id_created_at_id')
+        batch_op.drop_index('ix_requirement_type_id_created_at_id')
+        batch_op.drop_index('ix_requirement_organization_id_created_at_id')
+        batch_op.drop_index('ix_requirement_created_at_id')
+
+    with op.batch_alter_table('organization', schema=None) as batch_op:
+        batch_op.drop_index('ix_organization_email_name')
+        batch_op.drop_index('ix_organization_created_by_created_at_id')
+        batch_op.drop_index('ix_organization_created_at_id')
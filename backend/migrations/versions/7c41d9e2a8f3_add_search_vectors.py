@@ -0,0 +1,52 @@
+"""Add search vectors
+
+Revision ID: 7c41d9e2a8f3
+Revises: 3f9a1c2e7b4d
+Create Date: 2026-10-18 14:02:19.540871
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c41d9e2a8f3'
+down_revision = '3f9a1c2e7b4d'
+branch_labels = None
+depends_on = None
+
+# Searchable columns per table, weighted A and B. The vectors are generated
+# columns, so Postgres keeps them current on every insert and update and
+# they are not mapped on the models. Other databases search an in-process
+# index instead (see src/search.py).
+SEARCH_COLUMNS = {
+    'requirement': ('title', 'description'),
+    'organization': ('name', 'description'),
+}
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table, (name, description) in SEARCH_COLUMNS.items():
+        op.execute(
+            f"ALTER TABLE {table} ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+            f"setweight(to_tsvector('english', coalesce({name}, '')), 'A') || "
+            f"setweight(to_tsvector('english', coalesce({description}, '')), 'B')) STORED"
+        )
+        op.create_index(f'ix_{table}_search_vector', table, ['search_vector'], unique=False, postgresql_using='gin')
+        op.create_index(
+            f'ix_{table}_{name}_trgm', table, [sa.text(f'{name} gin_trgm_ops')], unique=False, postgresql_using='gin'
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    for table, (name, _) in SEARCH_COLUMNS.items():
+        op.drop_index(f'ix_{table}_{name}_trgm', table_name=table)
+        op.drop_index(f'ix_{table}_search_vector', table_name=table)
+        op.drop_column(table, 'search_vector')
@@ -0,0 +1,36 @@
+"""Add requirement progress counters
+
+Revision ID: a2d5e8f1c6b9
+Revises: 7c41d9e2a8f3
+Create Date: 2026-10-18 15:37:02.118604
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a2d5e8f1c6b9'
+down_revision = '7c41d9e2a8f3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('requirement', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('fulfilled_quantity', sa.Integer(), server_default='0', nullable=False))
+
+    with op.batch_alter_table('donation', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('requirement_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_donation_requirement_id_requirement', 'requirement', ['requirement_id'], ['id'])
+        batch_op.create_index('ix_donation_requirement_id_status_id', ['requirement_id', 'status_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('donation', schema=None) as batch_op:
+        batch_op.drop_index('ix_donation_requirement_id_status_id')
+        batch_op.drop_constraint('fk_donation_requirement_id_requirement', type_='foreignkey')
+        batch_op.drop_column('requirement_id')
+
+    with op.batch_alter_table('requirement', schema=None) as batch_op:
+        batch_op.drop_column('fulfilled_quantity')
@@ -0,0 +1,28 @@
+"""Add donation idempotency key
+
+Revision ID: b9f2c6d4e1a7
+Revises: e4b7a9c3f1d6
+Create Date: 2026-10-18 21:04:37.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b9f2c6d4e1a7'
+down_revision = 'e4b7a9c3f1d6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('donation', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('idempotency_key', sa.String(length=100), nullable=True))
+        batch_op.create_index('ix_donation_idempotency_key', ['idempotency_key'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('donation', schema=None) as batch_op:
+        batch_op.drop_index('ix_donation_idempotency_key')
+        batch_op.drop_column('idempotency_key')
@@ -0,0 +1,68 @@
+"""Add organization stats
+
+Revision ID: c8e3f0a7d2b5
+Revises: a2d5e8f1c6b9
+Create Date: 2026-10-18 17:08:41.652093
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c8e3f0a7d2b5'
+down_revision = 'a2d5e8f1c6b9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('organization_requirement_stats',
+    sa.Column('organization_id', sa.Integer(), nullable=False),
+    sa.Column('type_id', sa.Integer(), nullable=False),
+    sa.Column('status_id', sa.Integer(), nullable=False),
+    sa.Column('requirement_count', sa.Integer(), nullable=False),
+    sa.Column('open_count', sa.Integer(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('fulfilled_quantity', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['organization_id'], ['organization.id'], ),
+    sa.ForeignKeyConstraint(['status_id'], ['status.id'], ),
+    sa.ForeignKeyConstraint(['type_id'], ['type.id'], ),
+    sa.PrimaryKeyConstraint('organization_id', 'type_id', 'status_id')
+    )
+    op.create_table('organization_donation_stats',
+    sa.Column('organization_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('type_id', sa.Integer(), nullable=False),
+    sa.Column('status_id', sa.Integer(), nullable=False),
+    sa.Column('donation_count', sa.Integer(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['organization_id'], ['organization.id'], ),
+    sa.ForeignKeyConstraint(['status_id'], ['status.id'], ),
+    sa.ForeignKeyConstraint(['type_id'], ['type.id'], ),
+    sa.PrimaryKeyConstraint('organization_id', 'day', 'type_id', 'status_id')
+    )
+    op.create_table('stale_organization_stats',
+    sa.Column('organization_id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('marked_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['organization_id'], ['organization.id'], ),
+    sa.PrimaryKeyConstraint('organization_id')
+    )
+    with op.batch_alter_table('stale_organization_stats', schema=None) as batch_op:
+        batch_op.create_index('ix_stale_organization_stats_marked_at', ['marked_at'], unique=False)
+
+    # Every existing organization starts stale, the first refresh fills the tables
+    op.execute(
+        "INSERT INTO stale_organization_stats (organization_id, version, marked_at) "
+        "SELECT id, 1, CURRENT_TIMESTAMP FROM organization"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('stale_organization_stats', schema=None) as batch_op:
+        batch_op.drop_index('ix_stale_organization_stats_marked_at')
+
+    op.drop_table('stale_organization_stats')
+    op.drop_table('organization_donation_stats')
+    op.drop_table('organization_requirement_stats')
@@ -0,0 +1,36 @@
+"""Add requirement embeddings
+
+Revision ID: d3a8c5f2b7e9
+Revises: b9f2c6d4e1a7
+Create Date: 2026-10-18 22:41:09.307415
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3a8c5f2b7e9'
+down_revision = 'b9f2c6d4e1a7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled in the background when the semantic search index is first built
+    op.create_table('requirement_embedding',
+    sa.Column('requirement_id', sa.Integer(), nullable=False),
+    sa.Column('content_hash', sa.String(length=64), nullable=False),
+    sa.Column('vector', sa.LargeBinary(), nullable=False),
+    sa.ForeignKeyConstraint(['requirement_id'], ['requirement.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('requirement_id')
+    )
+    with op.batch_alter_table('requirement_embedding', schema=None) as batch_op:
+        batch_op.create_index('ix_requirement_embedding_content_hash', ['content_hash'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('requirement_embedding', schema=None) as batch_op:
+        batch_op.drop_index('ix_requirement_embedding_content_hash')
+
+    op.drop_table('requirement_embedding')
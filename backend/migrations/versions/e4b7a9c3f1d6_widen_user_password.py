@@ -0,0 +1,33 @@
+"""Widen user password for hashes
+
+Revision ID: e4b7a9c3f1d6
+Revises: c8e3f0a7d2b5
+Create Date: 2026-10-18 19:21:53.307446
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b7a9c3f1d6'
+down_revision = 'c8e3f0a7d2b5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing plaintext passwords are hashed at each user's next login
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.alter_column('password',
+               existing_type=sa.VARCHAR(length=80),
+               type_=sa.String(length=255),
+               existing_nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.alter_column('password',
+               existing_type=sa.String(length=255),
+               type_=sa.VARCHAR(length=80),
+               existing_nullable=False)
@@ -0,0 +1,28 @@
+"""Set donation requirement to NULL when the requirement is deleted
+
+Revision ID: f6c2a9d4b8e1
+Revises: d3a8c5f2b7e9
+Create Date: 2026-10-18 23:52:14.602931
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'f6c2a9d4b8e1'
+down_revision = 'd3a8c5f2b7e9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # a2d5e8f1c6b9 created the key without an ON DELETE action
+    with op.batch_alter_table('donation', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_donation_requirement_id_requirement', type_='foreignkey')
+        batch_op.create_foreign_key('fk_donation_requirement_id_requirement', 'requirement', ['requirement_id'], ['id'], ondelete='SET NULL')
+
+
+def downgrade():
+    with op.batch_alter_table('donation', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_donation_requirement_id_requirement', type_='foreignkey')
+        batch_op.create_foreign_key('fk_donation_requirement_id_requirement', 'requirement', ['requirement_id'], ['id'])
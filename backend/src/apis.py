@@ -1,47 +1,101 @@
-from flask import Blueprint, request
+import uuid
+from functools import partial
+from flask import Blueprint, Response, request, stream_with_context, url_for
 from datetime import datetime
-from src.models import User, Organization, Requirement
-from src.schemas import RegisterRequestSchema, LoginRequestSchema, organizations_schema, organization_schema, requirement_schema, requirements_schema
-from src.helpers import generate_access_token, construct_response, log
-from src.decorators import validate_marshmallow_schema, jwt_required
+from src.models import db, User, Organization, Requirement
+from src.schemas import RegisterRequestSchema, LoginRequestSchema, organization_schema, requirement_schema, donation_schema
+from src.serializers import organization_serializer, requirement_serializer
+from src.helpers import generate_access_token, construct_response, construct_streaming_response, log
+from src.decorators import load_marshmallow_schema, jwt_required, is_organization_user, owns_organization
+from src.pagination import paginate, stream_all, int_arg, limit_arg, bool_arg, InvalidQueryArgument
+from src.queries import filter_organizations, filter_requirements
+from src.conditional import Validators, not_modified_response
+from src.response_cache import cached_response
+from src.routing import read_only, use_primary
+from src.bulk import read_rows, import_requirements, export_requirements, UnsupportedContentType, InvalidImportFile
+from src.search import search
+from src.embeddings import semantic_search
+from src.matching import match_requirements
+from src.stats import organization_stats
+from src.passwords import password_hasher, PasswordHasherBusy
+from src.progress import counts_towards_progress
+from src.queues import QueueFull
+from src.events import event_feed, Subscriber, parse_subscription, last_event_id, stream, STREAM_HEADERS
+from src.ingestion import (
+    check_donation, submit_donation, donation_status, donations_refused,
+    InvalidDonation, IdempotencyKeyReused, MAX_IDEMPOTENCY_KEY_LENGTH
+)
 
 ## Blueprints ##
 root_blueprint = Blueprint('root', __name__)
 user_blueprint = Blueprint('users', __name__, url_prefix='/user')
 organization_blueprint = Blueprint('organization', __name__, url_prefix='/organization')
 requirement_blueprint = Blueprint('requirement', __name__, url_prefix='/requirement')
+search_blueprint = Blueprint('search', __name__, url_prefix='/search')
+donation_blueprint = Blueprint('donation', __name__, url_prefix='/donation')
+feed_blueprint = Blueprint('feed', __name__, url_prefix='/feed')
+
+## Cache Tags ##
+def organization_tags(id=None):
+    if id is not None:
+        return [f'organization:{id}']
+    created_by = request.args.get('created_by', type=int)
+    return [f'organization:created_by:{created_by}'] if created_by else ['organization']
+
+def organization_stats_tags(id):
+    return [f'organization:{id}:stats']
+
+def requirement_tags(id=None):
+    if id is not None:
+        return [f'requirement:{id}']
+    org_id = request.args.get('organization', type=int)
+    return [f'requirement:organization:{org_id}'] if org_id else ['requirement']
+
+def search_tags():
+    return [request.args.get('kind', 'requirement')]
 
 ## Routes ##
 @user_blueprint.route('/register', methods=['POST'])
-@validate_marshmallow_schema(RegisterRequestSchema())
-def register_user():
+@load_marshmallow_schema(RegisterRequestSchema)
+def register_user(data):
     try:
-        data = request.get_json()
         name, email, password, is_organization = data['name'], data['email'], data['password'], data.get('is_organization', False)
 
         # Check if user already exists
-        user = User(name=name, email=email, password=password, is_organization=is_organization)
+        user = User(name=name, email=email, is_organization=is_organization)
         if user.exists():
             return construct_response('User already exists', 400)
+        user.set_password(password)
         user.save()
         return construct_response('User registered successfully', 201, user.serialize())
+    except PasswordHasherBusy:
+        return construct_response('Too many requests, try again shortly', 503, headers={'Retry-After': '1'})
     except Exception as e:
         log(e)
         return construct_response("User registration failed", 500, e)
 
 @user_blueprint.route('/login', methods=['POST'])
-@validate_marshmallow_schema(LoginRequestSchema())
-def login_user():
+@read_only
+@load_marshmallow_schema(LoginRequestSchema)
+def login_user(data):
     try:
-        data = request.get_json()
         email, password = data['email'], data['password']
-        user = User.query.filter_by(email=email, password=password).first()
+        user = User.query.filter_by(email=email).first()
         if user is None:
+            password_hasher.verify(None, password) # as slow as a wrong password
+            return construct_response('Invalid email or password', 400)
+        if not user.check_password(password):
             return construct_response('Invalid email or password', 400)
         return construct_response('Login successful', 200, {
-            'access_token': generate_access_token(user.id),
+            'access_token': generate_access_token(
+                user.id,
+                is_organization=user.is_organization,
+                organizations=[id for id, in Organization.query.with_entities(Organization.id).filter_by(created_by=user.id)]
+            ),
             'user': user.serialize()
         })
+    except PasswordHasherBusy:
+        return construct_response('Too many requests, try again shortly', 503, headers={'Retry-After': '1'})
     except Exception as e:
         log(e)
         return construct_response("Login failed", 500, e)
@@ -49,14 +103,13 @@ def login_user():
 ### Orgnization Routes ###
 
 @organization_blueprint.route('/', methods=['POST'])
-@validate_marshmallow_schema(organization_schema)
+@load_marshmallow_schema(organization_schema)
 @jwt_required
-def create_organization(user_id):
+def create_organization(user_id, data):
     try:
         # check of user is an organization
-        if not User.query.get_or_404(user_id).is_organization:
+        if not is_organization_user(user_id):
             return construct_response('You are not authorized to create an organization', 401)
-        data = request.get_json()
         new_organization = Organization(
             name=data['name'],
             description=data['description'],
@@ -75,29 +128,65 @@ def create_organization(user_id):
         return construct_response("Organization creation failed", 500, e)
 
 @organization_blueprint.route('/', methods=['GET'])
+@cached_response(organization_tags)
 def get_organizations():
     try:
-        created_by = request.args.get('created_by')
-        if created_by:
-            organizations = Organization.query.filter_by(created_by=created_by).all()
-        else:
-            organizations = Organization.query.all()
-        return construct_response('Organizations retrieved successfully', 200, organizations_schema.dump(organizations))
+        query = filter_organizations(Organization.query)
+        validators = Validators.for_query(query, Organization)
+        if validators.not_modified():
+            return not_modified_response(validators)
+        if bool_arg('stream'):
+            # The whole filtered scope, streamed instead of paginated
+            return construct_streaming_response('Organizations retrieved successfully', 200, stream_all(query, Organization), organization_serializer.dump_one, headers=validators.headers())
+        organizations, next_cursor = paginate(query, Organization)
+        return construct_response('Organizations retrieved successfully', 200, organization_serializer.dump(organizations, many=True), headers=validators.headers(), next_cursor=next_cursor)
+    except InvalidQueryArgument as e:
+        return construct_response(str(e), 400)
+    except Exception as e:
+        log(e)
+        return construct_response("Organization retrieval failed", 500, e)
 
+@organization_blueprint.route('/<int:id>', methods=['GET'])
+@cached_response(organization_tags)
+def get_organization(id):
+    try:
+        organization = db.session.get(Organization, id)
+        if organization is None:
+            return construct_response('Organization not found', 404)
+        validators = Validators.for_row(organization)
+        if validators.not_modified():
+            return not_modified_response(validators)
+        return construct_response('Organization retrieved successfully', 200, organization_schema.dump(organization), headers=validators.headers())
     except Exception as e:
         log(e)
         return construct_response("Organization retrieval failed", 500, e)
 
+@organization_blueprint.route('/<int:id>/stats', methods=['GET'])
+@cached_response(organization_stats_tags)
+def get_organization_stats(id):
+    try:
+        days = int_arg('days')
+        days = 30 if days is None else days
+        if not 1 <= days <= 366:
+            raise InvalidQueryArgument("'days' must be between 1 and 366")
+        if db.session.get(Organization, id) is None:
+            return construct_response('Organization not found', 404)
+        return construct_response('Organization stats retrieved successfully', 200, organization_stats(id, days))
+    except InvalidQueryArgument as e:
+        return construct_response(str(e), 400)
+    except Exception as e:
+        log(e)
+        return construct_response("Organization stats retrieval failed", 500, e)
+
 @organization_blueprint.route('/<int:id>', methods=['PUT'])
-@validate_marshmallow_schema(organization_schema)
+@load_marshmallow_schema(organization_schema)
 @jwt_required
-def update_organization(user_id, id):
+def update_organization(user_id, id, data):
     try:
         organization = Organization.query.get_or_404(id)
         if organization.created_by != user_id:
             return construct_response('You are not authorized to update this organization', 401)
         
-        data = request.get_json()
         organization.description = data['description']
         organization.website = data.get('website')
         organization.phone = data.get('phone')
@@ -115,11 +204,12 @@ def update_organization(user_id, id):
 
 ### Requirement Routes ###
 @requirement_blueprint.route('/', methods=['POST'])
-@validate_marshmallow_schema(requirement_schema)
+@load_marshmallow_schema(requirement_schema)
 @jwt_required
-def create_requirement():
+def create_requirement(user_id, data):
     try:
-        data = requirement_schema.load(request.get_json())
+        if not owns_organization(user_id, data['organization_id']):
+            return construct_response('You are not authorized to create requirements for this organization', 401)
         new_requirement = Requirement(**data)
         new_requirement.save()
         return construct_response('Requirement created successfully', 201, requirement_schema.dump(new_requirement))
@@ -128,28 +218,97 @@ def create_requirement():
         return construct_response("Requirement creation failed", 500, e)
     
 @requirement_blueprint.route('/', methods=['GET'])
+@cached_response(requirement_tags)
 def get_requirements():
     try:
-        org_id = request.args.get('organization')
+        query = filter_requirements(Requirement.query)
+        validators = Validators.for_query(query, Requirement)
+        if validators.not_modified():
+            return not_modified_response(validators)
+        if bool_arg('stream'):
+            # The whole filtered scope, streamed instead of paginated
+            return construct_streaming_response('Requirements retrieved successfully', 200, stream_all(query, Requirement), requirement_serializer.dump_one, headers=validators.headers())
+        requirements, next_cursor = paginate(query, Requirement)
+        return construct_response('Requirements retrieved successfully', 200, requirement_serializer.dump(requirements, many=True), headers=validators.headers(), next_cursor=next_cursor)
+    except InvalidQueryArgument as e:
+        return construct_response(str(e), 400)
+    except Exception as e:
+        log(e)
+        return construct_response("Requirement retrieval failed", 500, e)
+
+@requirement_blueprint.route('/match', methods=['GET'])
+def match_requirements_to_donation():
+    try:
+        type_id, quantity = int_arg('type_id'), int_arg('quantity')
+        if type_id is None or quantity is None or quantity < 1:
+            raise InvalidQueryArgument("'type_id' and a positive 'quantity' are required")
+        limit = limit_arg()
+        status_ids = [int_arg('status_id', {'status_id': value}) for value in request.args.getlist('status_id')] or None
+        # Served from an in-memory index, not worth a response cache entry
+        allocations, unallocated = match_requirements(type_id, quantity, status_ids, limit)
+        return construct_response('Matches retrieved successfully', 200, allocations, unallocated=unallocated)
+    except InvalidQueryArgument as e:
+        return construct_response(str(e), 400)
+    except Exception as e:
+        log(e)
+        return construct_response("Requirement matching failed", 500, e)
+
+@requirement_blueprint.route('/bulk', methods=['POST'])
+@jwt_required
+def import_requirements_in_bulk(user_id):
+    try:
+        if not is_organization_user(user_id):
+            return construct_response('You are not authorized to import requirements', 401)
+        result = import_requirements(read_rows(request.stream, request.mimetype), user_id)
+        return construct_response('Requirements imported', 200, result)
+    except UnsupportedContentType as e:
+        return construct_response(str(e), 415)
+    except InvalidImportFile as e:
+        # Batches before the unreadable part are committed, report them with the error
+        return construct_response(str(e), 400, e.result)
+    except Exception as e:
+        log(e)
+        return construct_response("Requirement import failed", 500, e)
+
+@requirement_blueprint.route('/export', methods=['GET'])
+def export_requirements_in_bulk():
+    try:
+        query = Requirement.query
+        org_id = int_arg('organization')
         if org_id:
-            requirements = Requirement.query.filter_by(organization_id=org_id).all()
-        else:
-            requirements = Requirement.query.all()
-        return construct_response('Requirements retrieved successfully', 200, requirements_schema.dump(requirements))
+            query = query.filter_by(organization_id=org_id)
+        mimetype = 'text/csv' if request.args.get('format') == 'csv' else 'application/x-ndjson'
+        return Response(stream_with_context(export_requirements(query, mimetype)), mimetype=mimetype)
+    except InvalidQueryArgument as e:
+        return construct_response(str(e), 400)
+    except Exception as e:
+        log(e)
+        return construct_response("Requirement export failed", 500, e)
+
+@requirement_blueprint.route('/<int:id>', methods=['GET'])
+@cached_response(requirement_tags)
+def get_requirement(id):
+    try:
+        requirement = db.session.get(Requirement, id)
+        if requirement is None:
+            return construct_response('Requirement not found', 404)
+        validators = Validators.for_row(requirement)
+        if validators.not_modified():
+            return not_modified_response(validators)
+        return construct_response('Requirement retrieved successfully', 200, requirement_schema.dump(requirement), headers=validators.headers())
     except Exception as e:
         log(e)
         return construct_response("Requirement retrieval failed", 500, e)
     
 @requirement_blueprint.route('/<int:id>', methods=['PUT'])
-@validate_marshmallow_schema(requirement_schema)
+@load_marshmallow_schema(requirement_schema)
 @jwt_required
-def update_requirement(user_id, id):
+def update_requirement(user_id, id, data):
     try:
         requirement = Requirement.query.get_or_404(id)
-        if Organization.query.get_or_404(requirement.organization_id).created_by != user_id:
+        if not owns_organization(user_id, requirement.organization_id):
             return construct_response('You are not authorized to update this requirement', 401)
         
-        data = requirement_schema.load(request.get_json())
         requirement.description = data['description']
         requirement.quantity = data['quantity']
         requirement.updated_at = datetime.utcnow()
@@ -166,7 +325,7 @@ def update_requirement(user_id, id):
 def delete_requirement(user_id, id):
     try:
         requirement = Requirement.query.get_or_404(id)
-        if Organization.query.get_or_404(requirement.organization_id).created_by != user_id:
+        if not owns_organization(user_id, requirement.organization_id):
             return construct_response('You are not authorized to delete this requirement', 401)
         
         requirement.delete()
@@ -175,3 +334,100 @@ def delete_requirement(user_id, id):
         log(e)
         return construct_response("Requirement deletion failed", 500, e)
 
+### Donation Routes ###
+@donation_blueprint.route('/', methods=['POST'])
+@load_marshmallow_schema(donation_schema)
+@jwt_required
+def create_donation(user_id, data):
+    try:
+        key = request.headers.get('Idempotency-Key')
+        if key is not None and not 0 < len(key) <= MAX_IDEMPOTENCY_KEY_LENGTH:
+            return construct_response(f'Idempotency-Key must be 1 to {MAX_IDEMPOTENCY_KEY_LENGTH} characters', 400)
+        check_donation(data)
+        if counts_towards_progress(data['status_id']) and not owns_organization(user_id, data['organization_id']):
+            return construct_response('You are not authorized to record received donations for this organization', 401)
+
+        # Without a key from the client retries cannot be recognized, the key is only a receipt
+        new_key = key is None
+        key = uuid.uuid4().hex if new_key else key
+        status, donation = submit_donation(user_id, key, data, new_key=new_key)
+        if donation is not None:
+            return construct_response('Donation recorded', 200, {'idempotency_key': key, 'status': status, 'donation': donation_schema.dump(donation)})
+        location = url_for('api.donation.get_donation_submission', key=key)
+        return construct_response('Donation accepted', 202, {'idempotency_key': key, 'status': status}, headers={'Location': location})
+    except InvalidDonation as e:
+        return construct_response(str(e), 400)
+    except IdempotencyKeyReused as e:
+        return construct_response(str(e), 422)
+    except QueueFull:
+        donations_refused.inc()
+        return construct_response('Too many donations waiting, try again shortly', 503, headers={'Retry-After': '1'})
+    except Exception as e:
+        log(e)
+        return construct_response("Donation submission failed", 500, e)
+
+@donation_blueprint.route('/submission/<key>', methods=['GET'])
+@use_primary # written by the background writer, a replica may not have it yet
+@jwt_required
+def get_donation_submission(user_id, key):
+    try:
+        status, result = donation_status(user_id, key)
+        if status is None:
+            return construct_response('Donation submission not found', 404)
+        data = {'idempotency_key': key, 'status': status}
+        if status == 'written':
+            data['donation'] = donation_schema.dump(result)
+        elif status == 'failed':
+            data['errors'] = result
+        return construct_response('Donation submission retrieved successfully', 200, data)
+    except Exception as e:
+        log(e)
+        return construct_response("Donation submission retrieval failed", 500, e)
+
+## Search ##
+SEARCHABLE = {
+    'requirement': (Requirement, filter_requirements, requirement_serializer),
+    'organization': (Organization, filter_organizations, organization_serializer),
+}
+
+@search_blueprint.route('/', methods=['GET'])
+@cached_response(search_tags)
+def search_records():
+    try:
+        text = request.args.get('q', '').strip()
+        if not text:
+            return construct_response("'q' is required", 400)
+        kind = request.args.get('kind', 'requirement')
+        if kind not in SEARCHABLE:
+            return construct_response(f"'kind' must be one of {', '.join(SEARCHABLE)}", 400)
+        model, apply_filters, serializer = SEARCHABLE[kind]
+        mode = request.args.get('mode', 'text')
+        if mode not in ('text', 'semantic') or (mode == 'semantic' and model is not Requirement):
+            return construct_response("'mode' must be 'text', or 'semantic' for requirements", 400)
+
+        limit = limit_arg()
+        page = int_arg('page')
+        page = 1 if page is None else page
+        if page < 1:
+            raise InvalidQueryArgument("'page' must be positive")
+        # Ranked results have no stable keyset, so pages are addressed by number
+        rows, has_more = (semantic_search if mode == 'semantic' else partial(search, model))(text, apply_filters(model.query), (page - 1) * limit, limit)
+        return construct_response('Search results retrieved successfully', 200, serializer.dump(rows, many=True), next_page=page + 1 if has_more else None)
+    except InvalidQueryArgument as e:
+        return construct_response(str(e), 400)
+    except Exception as e:
+        log(e)
+        return construct_response("Search failed", 500, e)
+
+@feed_blueprint.route('/', methods=['GET'])
+def stream_events():
+    try:
+        subscriber = Subscriber(**parse_subscription(request.args), max_pending=event_feed.max_pending)
+        backlog = event_feed.subscribe(subscriber, last_event_id(request))
+        # Not wrapped in stream_with_context: the stream holds no app context or session while it waits
+        return Response(stream(subscriber, backlog), 200, STREAM_HEADERS, mimetype='text/event-stream')
+    except InvalidQueryArgument as e:
+        return construct_response(str(e), 400)
+    except Exception as e:
+        log(e)
+        return construct_response("Event feed failed", 500, e)
@@ -0,0 +1,116 @@
+from quart import Blueprint, Response, request
+from sqlalchemy import select
+from src.models import Organization, Requirement
+from src.async_db import async_db
+from src.conditional import Validators
+from src.helpers import log
+from src.pagination import page_query, page_result, bool_arg, STREAM_BATCH_SIZE, InvalidQueryArgument
+from src.queries import filter_organizations, filter_requirements
+from src.serializers import organization_serializer, requirement_serializer, encode_json
+from src.events import event_feed, AsyncSubscriber, parse_subscription, last_event_id, stream_async, STREAM_HEADERS
+
+# Async counterparts of the read handlers in apis.py, served by asgi.py.
+# Routes not defined here fall through to the WSGI app.
+
+## Blueprints ##
+organization_blueprint = Blueprint('organization', __name__, url_prefix='/organization')
+requirement_blueprint = Blueprint('requirement', __name__, url_prefix='/requirement')
+feed_blueprint = Blueprint('feed', __name__, url_prefix='/feed')
+
+def construct_response(message, status_code, data=[], headers=None, **extra):
+    body = encode_json({'data': data, 'message': message, **extra})
+    return Response(body, status_code, {'Cache-Control': 'no-store', **(headers or {})}, mimetype='application/json')
+
+def not_modified_response(validators):
+    return Response('', 304, validators.headers())
+
+async def construct_streaming_response(message, query, serializer, headers):
+    async def generate():
+        # Keys in the same order as jsonify, which sorts them
+        yield b'{"data":['
+        async with async_db.session() as session:
+            rows = await session.stream_scalars(query.execution_options(yield_per=STREAM_BATCH_SIZE))
+            first = True
+            async for partition in rows.partitions():
+                yield (b'' if first else b',') + b','.join(encode_json(serializer.dump_one(row)) for row in partition)
+                first = False
+        yield b'],"message":%s}\n' % encode_json(message)
+    return Response(generate(), 200, {'Cache-Control': 'no-store', **headers}, mimetype='application/json')
+
+async def list_response(message, query, model, serializer):
+    async with async_db.session() as session:
+        scope = query.with_only_columns(*Validators.scope_columns(model)).order_by(None)
+        last_modified, count = (await session.execute(scope)).one()
+        validators = Validators.for_scope(last_modified, count, request)
+        if validators.not_modified():
+            return not_modified_response(validators)
+        if bool_arg('stream', request.args):
+            ordered = query.order_by(model.created_at, model.id)
+            return await construct_streaming_response(message, ordered, serializer, validators.headers())
+        page, limit = page_query(query, model, request.args)
+        items, next_cursor = page_result((await session.scalars(page)).all(), limit)
+        return construct_response(message, 200, serializer.dump(items, many=True), headers=validators.headers(), next_cursor=next_cursor)
+
+async def detail_response(message, model, id, serializer):
+    async with async_db.session() as session:
+        row = await session.get(model, id)
+    if row is None:
+        return construct_response(f'{model.__name__} not found', 404)
+    validators = Validators.for_row(row, request)
+    if validators.not_modified():
+        return not_modified_response(validators)
+    return construct_response(message, 200, serializer.dump(row, many=False), headers=validators.headers())
+
+## Routes ##
+@organization_blueprint.route('/', methods=['GET'])
+async def get_organizations():
+    try:
+        query = filter_organizations(select(Organization), request.args)
+        return await list_response('Organizations retrieved successfully', query, Organization, organization_serializer)
+    except InvalidQueryArgument as e:
+        return construct_response(str(e), 400)
+    except Exception as e:
+        log(e)
+        return construct_response("Organization retrieval failed", 500)
+
+@organization_blueprint.route('/<int:id>', methods=['GET'])
+async def get_organization(id):
+    try:
+        return await detail_response('Organization retrieved successfully', Organization, id, organization_serializer)
+    except Exception as e:
+        log(e)
+        return construct_response("Organization retrieval failed", 500)
+
+@requirement_blueprint.route('/', methods=['GET'])
+async def get_requirements():
+    try:
+        query = filter_requirements(select(Requirement), request.args)
+        return await list_response('Requirements retrieved successfully', query, Requirement, requirement_serializer)
+    except InvalidQueryArgument as e:
+        return construct_response(str(e), 400)
+    except Exception as e:
+        log(e)
+        return construct_response("Requirement retrieval failed", 500)
+
+@requirement_blueprint.route('/<int:id>', methods=['GET'])
+async def get_requirement(id):
+    try:
+        return await detail_response('Requirement retrieved successfully', Requirement, id, requirement_serializer)
+    except Exception as e:
+        log(e)
+        return construct_response("Requirement retrieval failed", 500)
+
+@feed_blueprint.route('/', methods=['GET'])
+async def stream_events():
+    # An open stream is a coroutine waiting on its queue rather than a worker thread
+    try:
+        subscriber = AsyncSubscriber(**parse_subscription(request.args), max_pending=event_feed.max_pending)
+        backlog = event_feed.subscribe(subscriber, last_event_id(request))
+        response = Response(stream_async(subscriber, backlog), 200, STREAM_HEADERS, mimetype='text/event-stream')
+        response.timeout = None # open until the client leaves
+        return response
+    except InvalidQueryArgument as e:
+        return construct_response(str(e), 400)
+    except Exception as e:
+        log(e)
+        return construct_response("Event feed failed", 500)
@@ -0,0 +1,30 @@
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from settings import ASYNC_DB_POOL, DB_STATEMENT_TIMEOUT
+from src.database import database_uri
+
+class AsyncDatabase:
+    """
+    Async engine and session factory for the ASGI app. The pool options come
+    from ASYNC_DB_POOL and are ignored for SQLite, which does not pool the
+    same way. The statement timeout from settings applies to Postgres.
+    """
+    def __init__(self):
+        self.engine = None
+        self.sessions = None
+
+    def init(self, uri=None, **pool_options):
+        uri = uri or database_uri('asyncpg')
+        options = {} if uri.startswith('sqlite') else {**ASYNC_DB_POOL, **pool_options}
+        if DB_STATEMENT_TIMEOUT and uri.startswith('postgresql+asyncpg'):
+            options['connect_args'] = {'server_settings': {'statement_timeout': str(int(DB_STATEMENT_TIMEOUT))}}
+        self.engine = create_async_engine(uri, **options)
+        self.sessions = async_sessionmaker(self.engine, class_=AsyncSession, expire_on_commit=False)
+
+    async def dispose(self):
+        if self.engine is not None:
+            await self.engine.dispose()
+
+    def session(self):
+        return self.sessions()
+
+async_db = AsyncDatabase()
@@ -0,0 +1,176 @@
+import io
+import csv
+import json
+from itertools import islice
+from marshmallow import ValidationError
+from sqlalchemy.exc import IntegrityError
+from src.models import db, Organization, Requirement, Type, Status, lookups, models_bulk_saved
+from src.schemas import requirement_import_schema
+from src.serializers import requirement_import_serializer, encode_json
+from src.response_cache import response_cache
+from src.progress import refresh_percent_complete
+from src.stats import mark_stale
+
+BATCH_SIZE = 500
+EXPORT_FIELDS = list(requirement_import_schema.dump_fields)
+NDJSON_TYPES = ('application/x-ndjson', 'application/jsonl', 'application/json-seq')
+CSV_TYPES = ('text/csv',)
+
+class UnsupportedContentType(Exception):
+    pass
+
+class InvalidImportFile(Exception):
+    """
+    The body could not be read any further, `result` holds what was imported before
+    """
+    result = None
+
+def read_rows(stream, mimetype):
+    """
+    Lazily parse an NDJSON or CSV body into (line number, row) pairs, rows that
+    cannot be parsed are yielded as (line number, error message)
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    if mimetype in CSV_TYPES:
+        return _read_csv(text)
+    if mimetype in NDJSON_TYPES:
+        return _read_ndjson(text)
+    raise UnsupportedContentType(f'Unsupported content type {mimetype!r}, expected NDJSON or CSV')
+
+def _read_csv(text):
+    reader = csv.DictReader(text)
+    try:
+        for row in reader:
+            # Empty CSV cells mean "not provided"
+            yield reader.line_num, {key: value for key, value in row.items() if key and value not in ('', None)}
+    except UnicodeDecodeError:
+        raise InvalidImportFile('Request body is not valid UTF-8')
+    except csv.Error as e:
+        raise InvalidImportFile(f'Invalid CSV on line {reader.line_num}: {e}')
+
+def _read_ndjson(text):
+    try:
+        for line_number, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield line_number, 'Invalid JSON'
+                continue
+            yield line_number, row if isinstance(row, dict) else 'Expected a JSON object'
+    except UnicodeDecodeError:
+        raise InvalidImportFile('Request body is not valid UTF-8')
+
+def import_requirements(rows, user_id):
+    """
+    Create or update requirements from (line number, row) pairs in batches of
+    BATCH_SIZE, one transaction per batch. New rows are written with one
+    multi-row INSERT and rows carrying an id with one executemany UPDATE.
+    Rows are checked before writing so that one bad row does not fail its
+    batch, batches already committed stay committed. Returns the
+    created/updated counts and the per-row errors.
+    """
+    owned = {id for id, in Organization.query.with_entities(Organization.id).filter_by(created_by=user_id)}
+    result = {'created': 0, 'updated': 0, 'errors': []}
+    rows = iter(rows)
+    while True:
+        try:
+            batch = list(islice(rows, BATCH_SIZE))
+        except InvalidImportFile as e:
+            e.result = result
+            raise
+        if not batch:
+            return result
+        _import_batch(batch, owned, result)
+
+def check_row(data, owned):
+    """
+    Error message for a row whose INSERT or UPDATE would fail, None if it can be written
+    """
+    if data['organization_id'] not in owned:
+        return 'You are not authorized to manage requirements for this organization'
+    if lookups.get(Type, data['type_id']) is None:
+        return 'Type not found'
+    if lookups.get(Status, data['status_id']) is None:
+        return 'Status not found'
+
+def _import_batch(batch, owned, result):
+    errors = result['errors']
+    inserts, updates = {}, {}
+    for line_number, row in batch:
+        if isinstance(row, str):
+            errors.append({'line': line_number, 'errors': row})
+            continue
+        try:
+            data = requirement_import_schema.load(row)
+        except ValidationError as e:
+            errors.append({'line': line_number, 'errors': e.messages})
+            continue
+        error = check_row(data, owned)
+        if error:
+            errors.append({'line': line_number, 'errors': error})
+        elif 'id' in data:
+            updates[data['id']] = (line_number, data)
+        else:
+            inserts[line_number] = data
+
+    if updates:
+        # Only requirements of the caller's organizations may be updated
+        existing = dict(db.session.query(Requirement.id, Requirement.organization_id)
+                        .filter(Requirement.id.in_(updates), Requirement.organization_id.in_(owned)))
+        for id in set(updates) - set(existing):
+            errors.append({'line': updates.pop(id)[0], 'errors': 'Requirement not found'})
+
+    tags = {'requirement'}
+    tags.update(f'requirement:organization:{data["organization_id"]}' for data in inserts.values())
+    for id, (_, data) in updates.items():
+        tags.update((
+            f'requirement:{id}',
+            f'requirement:organization:{data["organization_id"]}',
+            f'requirement:organization:{existing[id]}'
+        ))
+    try:
+        ids = list(updates)
+        if inserts:
+            ids += db.session.scalars(db.insert(Requirement).returning(Requirement.id), list(inserts.values())).all()
+        if updates:
+            db.session.execute(db.update(Requirement), [data for _, data in updates.values()])
+            refresh_percent_complete(list(updates))
+        mark_stale(db.session.connection(), [data['organization_id'] for data in inserts.values()] + [
+            organization_id for id, (_, data) in updates.items() for organization_id in (data['organization_id'], existing[id])
+        ])
+        db.session.commit()
+    except IntegrityError:
+        # e.g. a type or status deleted since the lookups were cached, earlier batches stay committed
+        db.session.rollback()
+        errors.extend({'line': line_number, 'errors': 'Rejected with its batch, a row conflicts with the database'}
+                      for line_number in sorted([*inserts, *(line_number for line_number, _ in updates.values())]))
+        return
+    except Exception:
+        db.session.rollback()
+        raise
+    response_cache.invalidate(*tags)
+    models_bulk_saved.send(Requirement, ids=ids)
+    result['created'] += len(inserts)
+    result['updated'] += len(updates)
+
+def export_requirements(query, mimetype):
+    """
+    Stream the requirements of `query` as NDJSON or CSV without loading the
+    whole result set, rows are fetched from the database in batches
+    """
+    rows = query.order_by(Requirement.created_at, Requirement.id).yield_per(BATCH_SIZE)
+    if mimetype in CSV_TYPES:
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
+        for requirement in rows:
+            writer.writerow(requirement_import_serializer.dump_one(requirement))
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+    else:
+        for requirement in rows:
+            yield encode_json(requirement_import_serializer.dump_one(requirement)) + b'\n'
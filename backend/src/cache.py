@@ -0,0 +1,173 @@
+import time
+import pickle
+import fnmatch
+import threading
+from collections import OrderedDict
+from settings import CACHE_CONFIG
+
+class MemoryCache:
+    """
+    Process-local LRU cache with per-entry TTL
+    """
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def incr(self, key, ttl):
+        """
+        Atomically increment an integer counter, created at 0 with `ttl`
+        """
+        now = time.monotonic()
+        with self._lock:
+            value, expires_at = self._entries.get(key, (0, None))
+            if expires_at is not None and expires_at <= now:
+                value, expires_at = 0, None
+            value += 1
+            self._entries[key] = (value, expires_at or now + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return value
+
+    def counter(self, key):
+        return self.get(key) or 0
+
+
+class RedisCache:
+    """
+    Shared cache backed by a redis-py compatible client, values are pickled
+    """
+    def __init__(self, client, prefix='donation:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else pickle.loads(value)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=ttl)
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*(self.prefix + key for key in keys))
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+    # Counters are stored as plain integers so that INCR can update them
+    def incr(self, key, ttl):
+        value = self.client.incr(self.prefix + key)
+        if value == 1:
+            self.client.expire(self.prefix + key, ttl)
+        return value
+
+    def counter(self, key):
+        value = self.client.get(self.prefix + key)
+        return 0 if value is None else int(value)
+
+
+class LocalRedis:
+    """
+    In-process stand-in for a redis-py client implementing the subset of
+    commands the shared backends use. Lets the shared code paths run in
+    development and tests without a Redis server.
+    """
+    def __init__(self):
+        self._data = {}
+        self._expiry = {}
+        self._lock = threading.RLock()
+
+    def _alive(self, name):
+        expires_at = self._expiry.get(name)
+        if expires_at is not None and expires_at <= time.monotonic():
+            self._data.pop(name, None)
+            self._expiry.pop(name, None)
+        return name in self._data
+
+    def get(self, name):
+        with self._lock:
+            return self._data[name] if self._alive(name) else None
+
+    def set(self, name, value, ex=None):
+        with self._lock:
+            self._data[name] = value
+            self._expiry.pop(name, None)
+            if ex:
+                self._expiry[name] = time.monotonic() + ex
+            return True
+
+    def delete(self, *names):
+        with self._lock:
+            removed = 0
+            for name in names:
+                if self._alive(name):
+                    removed += 1
+                self._data.pop(name, None)
+                self._expiry.pop(name, None)
+            return removed
+
+    def incr(self, name):
+        with self._lock:
+            value = int(self._data[name]) + 1 if self._alive(name) else 1
+            self._data[name] = str(value).encode()
+            return value
+
+    def expire(self, name, time_):
+        with self._lock:
+            if not self._alive(name):
+                return False
+            self._expiry[name] = time.monotonic() + time_
+            return True
+
+    def scan_iter(self, match='*'):
+        with self._lock:
+            names = [name for name in list(self._data) if self._alive(name)]
+        return iter([name for name in names if fnmatch.fnmatchcase(name, match)])
+
+
+def create_cache(config=CACHE_CONFIG):
+    """
+    Build the cache backend selected in settings: 'memory', 'redis' or 'local-redis'
+    """
+    backend = config.get('backend', 'memory')
+    if backend == 'memory':
+        return MemoryCache(config.get('max_entries', 10000))
+    if backend == 'redis':
+        import redis
+        return RedisCache(redis.Redis.from_url(config['url']))
+    if backend == 'local-redis':
+        return RedisCache(LocalRedis())
+    raise ValueError(f'Unknown cache backend {backend!r}')
@@ -0,0 +1,63 @@
+import hashlib
+from datetime import timezone
+from flask import request, Response
+from sqlalchemy import func
+from settings import HTTP_CACHE_MAX_AGE
+
+class Validators:
+    """
+    ETag / Last-Modified validators of a response, computed from cheap
+    aggregates instead of the serialized payload
+    """
+    def __init__(self, fingerprint, last_modified, check_modified_since, req=None):
+        # `req` allows passing a non-Flask (e.g. Quart) request object
+        self.request = request if req is None else req
+        self.etag = hashlib.sha1(f'{self.request.full_path}|{fingerprint}'.encode()).hexdigest()
+        self.last_modified = last_modified.replace(tzinfo=timezone.utc) if last_modified else None
+        self.check_modified_since = check_modified_since
+
+    @staticmethod
+    def scope_columns(model):
+        return func.max(model.updated_at), func.count(model.id)
+
+    @classmethod
+    def for_scope(cls, last_modified, count, req=None):
+        """
+        Validators of a listing: the newest updated_at and the row count of
+        the filtered scope change on every insert, update and delete in it.
+        """
+        # A delete does not move max(updated_at), so If-Modified-Since alone
+        # cannot prove a listing is unchanged; only the ETag is trusted here.
+        return cls(f'{last_modified}|{count}', last_modified, False, req)
+
+    @classmethod
+    def for_query(cls, query, model):
+        last_modified, count = query.order_by(None).with_entities(*cls.scope_columns(model)).one()
+        return cls.for_scope(last_modified, count)
+
+    @classmethod
+    def for_row(cls, row, req=None):
+        return cls(f'{row.id}|{row.updated_at}', row.updated_at, True, req)
+
+    def not_modified(self):
+        """
+        Whether the client's cached copy is still current. If-None-Match
+        takes precedence over If-Modified-Since as in RFC 9110.
+        """
+        if self.request.if_none_match:
+            return self.request.if_none_match.contains_weak(self.etag)
+        if self.check_modified_since and self.request.if_modified_since and self.last_modified:
+            return self.last_modified.replace(microsecond=0) <= self.request.if_modified_since
+        return False
+
+    def headers(self):
+        headers = {
+            'ETag': f'"{self.etag}"',
+            'Cache-Control': f'public, max-age={HTTP_CACHE_MAX_AGE}, must-revalidate'
+        }
+        if self.last_modified:
+            headers['Last-Modified'] = self.last_modified.strftime('%a, %d %b %Y %H:%M:%S GMT')
+        return headers
+
+def not_modified_response(validators):
+    return Response(status=304, headers=validators.headers())
@@ -0,0 +1,76 @@
+from time import perf_counter
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+from settings import DB_CONFIG, DB_POOL, DB_STATEMENT_TIMEOUT
+from src.metrics import registry
+
+## Pool Metrics ##
+checkout_wait = registry.histogram('db_pool_checkout_wait_seconds', 'Time spent waiting for a pooled connection', ['pool'],
+                                   buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30))
+checkouts = registry.counter('db_pool_checkouts_total', 'Connections checked out of the pool', ['pool'])
+checkout_timeouts = registry.counter('db_pool_checkout_timeouts_total', 'Checkouts that gave up waiting for a connection', ['pool'])
+connections_opened = registry.counter('db_pool_connections_opened_total', 'New database connections opened', ['pool'])
+connections_in_use = registry.gauge('db_pool_connections_in_use', 'Connections currently checked out', ['pool'])
+pool_size = registry.gauge('db_pool_size', 'Configured number of pooled connections', ['pool'])
+pool_overflow = registry.gauge('db_pool_overflow', 'Connections open beyond the pool size', ['pool'])
+
+def database_uri(driver=None, config=DB_CONFIG):
+    scheme = f'postgresql+{driver}' if driver else 'postgresql'
+    return f"{scheme}://{config['user']}:{config['password']}@{config['host']}:{config['port']}/{config['database']}"
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    QueuePool recording how long each checkout waited for a connection
+    """
+    metrics_name = 'primary'
+
+    def connect(self):
+        start = perf_counter()
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            checkout_timeouts.inc(pool=self.metrics_name)
+            raise
+        finally:
+            checkout_wait.observe(perf_counter() - start, pool=self.metrics_name)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics_name = self.metrics_name
+        return pool
+
+def engine_options(uri, pool=DB_POOL, statement_timeout=DB_STATEMENT_TIMEOUT):
+    """
+    create_engine options for `uri`: the pool settings with the instrumented
+    pool and, on Postgres, a per-statement timeout in milliseconds. SQLite
+    keeps SQLAlchemy's defaults.
+    """
+    if uri.startswith('sqlite'):
+        return {}
+    options = {**pool, 'poolclass': InstrumentedQueuePool}
+    if statement_timeout and uri.startswith('postgresql'):
+        options['connect_args'] = {'options': f'-c statement_timeout={int(statement_timeout)}'}
+    return options
+
+def instrument_pool(engine, name='primary'):
+    """
+    Export checkout counts and pool occupancy of `engine` under the `name` label
+    """
+    engine.pool.metrics_name = name
+
+    @event.listens_for(engine, 'checkout')
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        checkouts.inc(pool=name)
+
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        connections_opened.inc(pool=name)
+
+    def gauge(read):
+        # engine.pool is looked up on every scrape since dispose() replaces it
+        return lambda: {(name,): read(engine.pool)} if isinstance(engine.pool, QueuePool) else {}
+
+    connections_in_use.add_callback(gauge(lambda pool: pool.checkedout()))
+    pool_size.add_callback(gauge(lambda pool: pool.size()))
+    pool_overflow.add_callback(gauge(lambda pool: max(pool.overflow(), 0)))
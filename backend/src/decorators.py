@@ -1,7 +1,10 @@
 import jwt
 from functools import wraps
-from flask import request, jsonify
-from settings import SECRET_KEY
+from flask import request, jsonify, g
+from marshmallow import ValidationError
+from src.models import db, User, Organization
+from src.tokens import decode_token
+from src.helpers import construct_response
 
 def jwt_required(fn):
     """
@@ -14,8 +17,8 @@ def jwt_required(fn):
             if auth_header:
                 try:
                     token = auth_header.split()[1]
-                    payload = jwt.decode(token, SECRET_KEY , algorithms=['HS256'])
-                    current_user_id = payload['identity']
+                    g.jwt_claims = decode_token(token)
+                    current_user_id = g.jwt_claims['identity']
 
                     return fn(current_user_id, *args, **kwargs)
                 except jwt.ExpiredSignatureError:
@@ -28,20 +31,46 @@ def jwt_required(fn):
     except Exception as e:
         return jsonify({'message': str(e)}), 500
 
-def validate_marshmallow_schema(schema):
+def is_organization_user(user_id):
     """
-    Decorator to validate incoming JSON data against a Marshmallow schema
+    Whether the authenticated user is an organization, from the token claims
+    when present (tokens issued before the claim existed fall back to the database)
     """
-    try:
-        def decorator(fn):
-            @wraps(fn)
-            def wrapper(*args, **kwargs):
-                data = request.get_json()
-                errors = schema.validate(data)
-                if errors:
-                    return jsonify(errors), 400
-                return fn(*args, **kwargs)
-            return wrapper
-        return decorator
-    except Exception as e:
-        return jsonify({'message': str(e)}), 500
\ No newline at end of file
+    claim = g.jwt_claims.get('is_organization')
+    if claim is not None:
+        return claim
+    user = db.session.get(User, user_id)
+    return user is not None and user.is_organization
+
+def owns_organization(user_id, organization_id):
+    """
+    Whether the authenticated user created the organization. Organizations
+    created after the token was issued are not in its claims, so a miss is
+    confirmed against the database.
+    """
+    if organization_id in g.jwt_claims.get('organizations', ()):
+        return True
+    organization = db.session.get(Organization, organization_id)
+    return organization is not None and organization.created_by == user_id
+
+def load_marshmallow_schema(schema):
+    """
+    Decorator to deserialize the JSON body with a Marshmallow schema and pass
+    the result to the view as `data`, so the body is validated and loaded
+    once. A schema class is instantiated once for the route. Invalid or
+    missing bodies get a 400 with the messages by field in `errors`.
+    """
+    if isinstance(schema, type):
+        schema = schema()
+
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            try:
+                data = schema.load(request.get_json(silent=True))
+            except ValidationError as e:
+                return construct_response('Invalid request body', 400, errors=e.messages)
+            return fn(*args, data=data, **kwargs)
+        wrapper.schema = schema
+        return wrapper
+    return decorator
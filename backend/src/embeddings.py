@@ -0,0 +1,443 @@
+import time
+import hashlib
+import importlib
+import threading
+import weakref
+from collections import defaultdict
+from functools import lru_cache
+import numpy as np
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from settings import EMBEDDINGS
+from src.models import db, Requirement, RequirementEmbedding, model_saved, model_deleted, models_bulk_saved
+from src.queues import MemoryQueue, QueueFull
+from src.cache import MemoryCache
+from src.response_cache import response_cache
+from src.search import analyze
+from src.metrics import registry
+from src.helpers import log
+
+try:
+    import openai
+except ImportError: # only needed by the openai provider
+    openai = None
+
+embeddings_computed = registry.counter('embeddings_computed_total', 'Texts embedded by the provider')
+embeddings_reused = registry.counter('embeddings_reused_total', 'Requirements given the stored vector of an identical text')
+
+## Providers ##
+# A provider has a `name` identifying its vectors (stored vectors are only
+# reused for the same name), `dimensions`, and embed(texts) returning one
+# row per text.
+class LocalEmbeddings:
+    """
+    Deterministic stand-in for development and tests, without any network
+    call: the analyzed terms of a text (see search.analyze) and their
+    character trigrams, hashed into `dimensions` signed buckets. Texts with
+    similar wording get similar vectors, meaning is not captured.
+    """
+    def __init__(self, config):
+        self.dimensions = config.get('dimensions', 256)
+        self.name = f'local:{self.dimensions}'
+
+    @lru_cache(maxsize=100000)
+    def _bucket(self, feature):
+        digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+        return int.from_bytes(digest[:4], 'little') % self.dimensions, 1.0 if digest[4] & 1 else -1.0
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dimensions), np.float32)
+        for row, text in enumerate(texts):
+            for term in analyze(text):
+                bucket, sign = self._bucket(term)
+                vectors[row, bucket] += sign
+                padded = f'#{term}#'
+                for start in range(len(padded) - 2):
+                    bucket, sign = self._bucket(padded[start:start + 3])
+                    vectors[row, bucket] += 0.3 * sign
+        return vectors
+
+class OpenAIEmbeddings:
+    """
+    OpenAI embeddings API, with the API key from OPENAI_API_KEY
+    """
+    def __init__(self, config):
+        if openai is None:
+            raise RuntimeError('The openai embeddings provider needs the openai package')
+        self.client = openai.OpenAI()
+        self.model = config.get('model', 'text-embedding-3-small')
+        self.dimensions = config.get('dimensions', 256)
+        self.name = f'openai:{self.model}:{self.dimensions}'
+
+    def embed(self, texts):
+        response = self.client.embeddings.create(model=self.model, input=texts, dimensions=self.dimensions)
+        return np.array([item.embedding for item in sorted(response.data, key=lambda item: item.index)], np.float32)
+
+PROVIDERS = {'local': LocalEmbeddings, 'openai': OpenAIEmbeddings}
+
+def create_provider(config=EMBEDDINGS):
+    """
+    Build the provider selected in settings: 'local', 'openai' or the
+    'module:Class' path of a custom one
+    """
+    name = config.get('provider', 'local')
+    if name in PROVIDERS:
+        return PROVIDERS[name](config)
+    if ':' in name:
+        module, attribute = name.split(':', 1)
+        return getattr(importlib.import_module(module), attribute)(config)
+    raise ValueError(f'Unknown embeddings provider {name!r}')
+
+_provider = None
+
+def get_provider():
+    # Built on first use, so that the app starts without the provider's credentials
+    global _provider
+    if _provider is None:
+        _provider = create_provider(EMBEDDINGS)
+    return _provider
+
+def requirement_text(title, description):
+    return f'{title}\n{description}'
+
+def content_hash(provider, text):
+    return hashlib.sha256(f'{provider.name}\n{text}'.encode()).hexdigest()
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+## Index ##
+class EmbeddingIndex:
+    """
+    Normalized vectors of the requirements in the rows of one float32
+    matrix, with their ids in a parallel array. A search is one
+    matrix-vector product and a partial sort. The matrix grows by doubling
+    and a removed row is replaced by the last one.
+    While the index is rebuilt (see EmbeddingIndexes) the changes it
+    receives are recorded to be replayed on its replacement.
+    """
+    def __init__(self, dimensions):
+        self.dimensions = dimensions
+        self.built_at = time.monotonic()
+        self.replay = None
+        self.successor = None
+        self._vectors = np.zeros((0, dimensions), np.float32)
+        self._ids = np.zeros(0, np.int64)
+        self._rows = {} # id -> row in _vectors
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def load(self, ids, vectors):
+        """
+        Fill an empty index in one copy
+        """
+        with self._lock:
+            self._ids = np.array(ids, np.int64)
+            self._vectors = np.array(vectors, np.float32).reshape(len(ids), self.dimensions)
+            self._rows = {id: row for row, id in enumerate(ids)}
+
+    def _set(self, id, vector):
+        row = self._rows.get(id)
+        if row is None:
+            row = len(self._rows)
+            if row == len(self._ids):
+                capacity = max(1024, 2 * row)
+                self._ids = np.resize(self._ids, capacity)
+                self._vectors = np.resize(self._vectors, (capacity, self.dimensions))
+            self._ids[row] = id
+            self._rows[id] = row
+        self._vectors[row] = vector
+
+    def _remove(self, id):
+        row = self._rows.pop(id, None)
+        last = len(self._rows)
+        if row is not None and row != last:
+            self._ids[row] = self._ids[last]
+            self._vectors[row] = self._vectors[last]
+            self._rows[int(self._ids[row])] = row
+
+    def _apply(self, operation, *args):
+        with self._lock:
+            if self.successor is not None:
+                # Swapped out while the change was on its way
+                return self.successor._apply(operation, *args)
+            if self.replay is not None:
+                self.replay.append((operation, args))
+            if operation == 'set':
+                self._set(*args)
+            else:
+                self._remove(*args)
+
+    def set(self, id, vector):
+        self._apply('set', id, vector)
+
+    def remove(self, id):
+        self._apply('remove', id)
+
+    def nearest(self, vector, k, min_similarity=-1.0):
+        """
+        Up to `k` (id, cosine similarity) pairs most similar to the normalized `vector`, best first
+        """
+        with self._lock:
+            size = len(self._rows)
+            if not size or k < 1:
+                return []
+            scores = self._vectors[:size] @ vector
+            k = min(k, size)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind='stable')]
+            ids = self._ids[top]
+        return [(int(id), float(score)) for id, score in zip(ids, scores[top]) if score >= min_similarity]
+
+def build_index(provider):
+    """
+    Index of the stored vectors, and the ids of the requirements whose
+    vector is missing or was computed from another text or provider (those
+    still indexed with their previous vector until embedded again)
+    """
+    index = EmbeddingIndex(provider.dimensions)
+    size = provider.dimensions * 4
+    ids, vectors, stale = [], [], []
+    rows = db.session.execute(
+        select(Requirement.id, Requirement.title, Requirement.description, RequirementEmbedding.content_hash, RequirementEmbedding.vector)
+        .outerjoin(RequirementEmbedding, RequirementEmbedding.requirement_id == Requirement.id)
+        .execution_options(yield_per=5000)
+    )
+    for id, title, description, digest, vector in rows:
+        if vector is not None and len(vector) == size:
+            ids.append(id)
+            vectors.append(vector)
+        if digest != content_hash(provider, requirement_text(title, description)):
+            stale.append(id)
+    index.load(ids, np.frombuffer(b''.join(vectors), np.float32))
+    return index, stale
+
+class EmbeddingIndexes:
+    """
+    One EmbeddingIndex per engine, built on first use and kept current by
+    the embedder. The rows embedded by other processes are picked up by
+    rebuilding an index older than `max_age` seconds in a background
+    thread, replaying the changes received meanwhile on the replacement.
+    """
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self._indexes = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def get(self, build=True):
+        engine = db.engine
+        with self._lock:
+            index = self._indexes.get(engine)
+            if index is None:
+                if build:
+                    # Built while holding the lock so concurrent first searches do not both scan the table
+                    index, stale = build_index(get_provider())
+                    self._indexes[engine] = index
+                    embedder.enqueue(stale)
+                return index
+            if build and self.max_age and index.replay is None and time.monotonic() - index.built_at > self.max_age:
+                index.replay = []
+                app = current_app._get_current_object()
+                threading.Thread(target=self._rebuild, args=(app, engine, index), name='embedding-index', daemon=True).start()
+            return index
+
+    def _rebuild(self, app, engine, index):
+        try:
+            with app.app_context():
+                fresh, stale = build_index(get_provider())
+        except Exception as e:
+            log(e)
+            with index._lock:
+                index.replay = None
+                index.built_at = time.monotonic() # retried after another max_age
+            return
+        with self._lock, index._lock:
+            for operation, args in index.replay:
+                fresh._apply(operation, *args)
+            index.replay = None
+            index.successor = fresh
+            self._indexes[engine] = fresh
+        embedder.enqueue(stale)
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+embedding_indexes = EmbeddingIndexes(EMBEDDINGS.get('max_age', 300))
+
+## Embedding ##
+def embed_requirements(provider, ids, batch_size=100):
+    """
+    Store up to date vectors for the requirements `ids`. Texts already
+    embedded, for these rows or for others, are not sent to the provider
+    again; the others are, `batch_size` per call. Returns the new vectors
+    by requirement id.
+    """
+    rows = db.session.execute(
+        select(Requirement.id, Requirement.title, Requirement.description, RequirementEmbedding.content_hash)
+        .outerjoin(RequirementEmbedding, RequirementEmbedding.requirement_id == Requirement.id)
+        .where(Requirement.id.in_(ids))
+    ).all()
+    changed, texts = defaultdict(list), {}
+    for id, title, description, previous in rows:
+        text = requirement_text(title, description)
+        digest = content_hash(provider, text)
+        if digest != previous:
+            changed[digest].append(id)
+            texts[digest] = text
+    if not changed:
+        return {}
+
+    known = dict(db.session.execute(
+        select(RequirementEmbedding.content_hash, RequirementEmbedding.vector).where(RequirementEmbedding.content_hash.in_(list(changed)))
+    ).all())
+    embeddings_reused.inc(sum(len(changed[digest]) for digest in known))
+    missing = [digest for digest in changed if digest not in known]
+    for start in range(0, len(missing), batch_size):
+        chunk = missing[start:start + batch_size]
+        vectors = normalize(provider.embed([texts[digest] for digest in chunk]))
+        known.update(zip(chunk, (vector.tobytes() for vector in vectors)))
+        embeddings_computed.inc(len(chunk))
+
+    connection = db.session.connection()
+    insert = (postgresql if connection.dialect.name == 'postgresql' else sqlite).insert
+    statement = insert(RequirementEmbedding).values([
+        {'requirement_id': id, 'content_hash': digest, 'vector': known[digest]}
+        for digest, requirement_ids in changed.items() for id in requirement_ids
+    ])
+    connection.execute(statement.on_conflict_do_update(
+        index_elements=[RequirementEmbedding.requirement_id],
+        set_={'content_hash': statement.excluded.content_hash, 'vector': statement.excluded.vector}
+    ))
+    db.session.commit()
+    return {
+        id: np.frombuffer(known[digest], np.float32)
+        for digest, requirement_ids in changed.items() for id in requirement_ids
+    }
+
+class Embedder:
+    """
+    Background thread embedding the requirements written by this process,
+    and those an index build found without an up to date vector, up to
+    `batch_size` per batch so that provider calls are batched too. Writes
+    never wait for the provider. A failed batch is retried after
+    `retry_interval` seconds. Starts with the first request the app serves,
+    like the donation writer.
+    """
+    def __init__(self, batch_size=100, retry_interval=5, max_pending=100000):
+        self.batch_size = batch_size
+        self.retry_interval = retry_interval
+        self.queue = MemoryQueue(max_pending)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def init_app(self, app):
+        app.before_request(lambda: self.start(app))
+
+    def start(self, app):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, args=(app,), name='embedder', daemon=True)
+                    self._thread.start()
+
+    def enqueue(self, ids):
+        try:
+            for id in ids:
+                self.queue.add(id, None)
+        except QueueFull:
+            # The next index build finds the others without a vector
+            pass
+
+    def _run(self, app):
+        while not self._stop.is_set():
+            batch = self.queue.claim(self.batch_size, timeout=1)
+            if not batch:
+                continue
+            ids = [id for id, _ in batch]
+            try:
+                with app.app_context():
+                    self.embed(ids)
+                self.queue.ack(ids)
+            except Exception as e:
+                log(e)
+                self.queue.release(ids)
+                self._stop.wait(self.retry_interval)
+
+    def embed(self, ids):
+        vectors = embed_requirements(get_provider(), ids, self.batch_size)
+        index = embedding_indexes.get(build=False)
+        if index is not None:
+            for id, vector in vectors.items():
+                index.set(id, vector)
+        if vectors:
+            # Search responses are cached under the kind searched
+            response_cache.invalidate('requirement')
+
+    def drain(self, timeout=10):
+        """
+        Wait up to `timeout` seconds for the queue to be embedded, returns whether it was
+        """
+        deadline = time.monotonic() + timeout
+        while len(self.queue) and time.monotonic() < deadline and self._thread is not None and self._thread.is_alive():
+            time.sleep(0.05)
+        return not len(self.queue)
+
+embedder = Embedder(EMBEDDINGS.get('batch_size', 100))
+
+## Index Maintenance ##
+@model_saved.connect_via(Requirement)
+def _embed_saved(model, instance):
+    embedder.enqueue([instance.id])
+
+@models_bulk_saved.connect_via(Requirement)
+def _embed_bulk_saved(model, ids):
+    embedder.enqueue(ids)
+
+@model_deleted.connect_via(Requirement)
+def _unindex_deleted(model, instance):
+    index = embedding_indexes.get(build=False)
+    if index is not None:
+        index.remove(instance.id)
+
+## Search ##
+# Query vectors by content hash, repeated queries are not embedded again
+query_vectors = MemoryCache(10000)
+
+def embed_query(text):
+    provider = get_provider()
+    digest = content_hash(provider, text)
+    vector = query_vectors.get(digest)
+    if vector is None:
+        vector = normalize(provider.embed([text]))[0]
+        query_vectors.set(digest, vector)
+    return vector
+
+def semantic_search(text, query, offset, limit):
+    """
+    Requirements of `query` (a filtered Query of Requirement) most similar
+    to `text`, best first. Returns the rows in [offset, offset + limit) and
+    whether more follow. Candidates come from the index and are filtered
+    by the query, asking the index for more while filters drop too many.
+    """
+    index = embedding_indexes.get()
+    vector = embed_query(text)
+    min_similarity = EMBEDDINGS.get('min_similarity', 0.1)
+    wanted = offset + limit + 1
+    k = 2 * wanted
+    while True:
+        ranked = index.nearest(vector, k, min_similarity)
+        ids = [id for id, _ in ranked]
+        found = {row.id: row for row in query.filter(Requirement.id.in_(ids))} if ids else {}
+        rows = [found[id] for id in ids if id in found]
+        if len(rows) >= wanted or len(ranked) < k:
+            break
+        k *= 4
+    rows = rows[offset:offset + limit + 1]
+    return rows[:limit], len(rows) > limit
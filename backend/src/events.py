@@ -0,0 +1,387 @@
+import json
+import time
+import select
+import asyncio
+import secrets
+import threading
+from itertools import chain
+from collections import defaultdict, deque
+from sqlalchemy import text
+from settings import EVENT_FEED
+from src.models import db, Organization, Requirement, model_saved, model_deleted, models_bulk_saved, progress_changed
+from src.serializers import organization_serializer, requirement_serializer, encode_json
+from src.pagination import int_arg, InvalidQueryArgument
+from src.metrics import registry
+from src.helpers import log
+
+KINDS = {'organization': organization_serializer, 'requirement': requirement_serializer}
+RESET_FRAME = b'event: reset\ndata: {}\n\n'
+KEEP_ALIVE_FRAME = b': keep-alive\n\n'
+
+events_published = registry.counter('feed_events_published_total', 'Change events published to the live feed', ['event'])
+subscribers_dropped = registry.counter('feed_subscribers_dropped_total', 'Feed subscribers disconnected for falling behind')
+
+class Event:
+    """
+    A change received by the feed, encoded once as a Server-Sent Events
+    frame for all the subscribers it goes to
+    """
+    __slots__ = ('id', 'kind', 'organization_id', 'type_id', 'frame')
+
+    def __init__(self, id, event, organization_id, type_id, data):
+        self.id = id
+        self.kind = event.split('.')[0]
+        self.organization_id = organization_id
+        self.type_id = type_id
+        self.frame = b'id: %s\nevent: %s\ndata: %s\n\n' % (id.encode(), event.encode(), encode_json(data))
+
+class Subscriber:
+    """
+    Frames not sent yet to one client, limited to the events of one
+    organization, type and/or kind when those are set. Holds at most
+    `max_pending` frames: a client that slow is disconnected instead of
+    buffering without bound, and resumes from its last event when it
+    reconnects.
+    """
+    def __init__(self, organization_id=None, type_id=None, kind=None, max_pending=100):
+        self.organization_id = organization_id
+        self.type_id = type_id
+        self.kind = kind
+        self.max_pending = max_pending
+        self.closed = False
+        self._frames = deque()
+        self._lock = threading.Lock()
+        self._woken = threading.Event()
+
+    def wants(self, event):
+        return (
+            (self.organization_id is None or event.organization_id == self.organization_id)
+            and (self.type_id is None or event.type_id == self.type_id)
+            and (self.kind is None or event.kind == self.kind)
+        )
+
+    def deliver(self, frame):
+        """
+        Queue `frame`, returns False when the subscriber is too far behind to take it
+        """
+        with self._lock:
+            if len(self._frames) >= self.max_pending:
+                return False
+            self._frames.append(frame)
+            woken = len(self._frames) > 1 # already woken for the frames before
+        if not woken:
+            self._wake()
+        return True
+
+    def close(self):
+        self.closed = True
+        self._wake()
+
+    def _wake(self):
+        self._woken.set()
+
+    def _take(self):
+        with self._lock:
+            frames, self._frames = self._frames, deque()
+        return b''.join(frames)
+
+    def take(self, timeout):
+        """
+        The frames queued so far, waiting up to `timeout` seconds for one
+        (b'' when none came), or None once closed
+        """
+        self._woken.wait(timeout)
+        self._woken.clear()
+        return None if self.closed else self._take()
+
+class AsyncSubscriber(Subscriber):
+    """
+    Subscriber read from an event loop, delivered to from other threads
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._loop = asyncio.get_running_loop()
+        self._woken = asyncio.Event()
+
+    def _wake(self):
+        self._loop.call_soon_threadsafe(self._woken.set)
+
+    async def take(self, timeout):
+        try:
+            await asyncio.wait_for(self._woken.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._woken.clear()
+        return None if self.closed else self._take()
+
+class MemoryBroker:
+    """
+    Fans the events published in this process out to the subscribers that
+    want them. Subscribers are indexed by the organization or type they
+    follow, so an event only visits its candidates, and each gets the
+    frame encoded once. The last `buffer_size` events are kept to resume a
+    client from its Last-Event-ID.
+    """
+    def __init__(self, buffer_size=1000, max_pending=100):
+        self.max_pending = max_pending
+        self._buffer = deque(maxlen=buffer_size)
+        self._everyone = set()
+        self._by_organization = defaultdict(set)
+        self._by_type = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        pass
+
+    def publish(self, messages):
+        self._dispatch([Event(**message) for message in messages])
+
+    def _dispatch(self, events):
+        dropped = set()
+        with self._lock:
+            for event in events:
+                self._buffer.append(event)
+                candidates = chain(self._everyone, self._by_organization.get(event.organization_id, ()), self._by_type.get(event.type_id, ()))
+                for subscriber in candidates:
+                    if subscriber.wants(event) and subscriber not in dropped and not subscriber.deliver(event.frame):
+                        dropped.add(subscriber)
+            for subscriber in dropped:
+                self._remove(subscriber)
+        for subscriber in dropped:
+            subscriber.close()
+        subscribers_dropped.inc(len(dropped))
+
+    def _registry(self, subscriber):
+        # Registered under their most selective filter, the others are checked by wants()
+        if subscriber.organization_id is not None:
+            return self._by_organization[subscriber.organization_id]
+        if subscriber.type_id is not None:
+            return self._by_type[subscriber.type_id]
+        return self._everyone
+
+    def _remove(self, subscriber):
+        self._registry(subscriber).discard(subscriber)
+        for index, key in ((self._by_organization, subscriber.organization_id), (self._by_type, subscriber.type_id)):
+            if key in index and not index[key]:
+                del index[key]
+
+    def subscribe(self, subscriber, last_event_id=None):
+        """
+        Register `subscriber` and return the frames it missed since
+        `last_event_id`, or RESET_FRAME when that event is no longer (or
+        was never) buffered and the client has to reload instead
+        """
+        with self._lock:
+            backlog = b''
+            if last_event_id:
+                events = list(self._buffer)
+                position = next((i for i, event in enumerate(events) if event.id == last_event_id), None)
+                if position is None:
+                    backlog = RESET_FRAME
+                else:
+                    backlog = b''.join(event.frame for event in events[position + 1:] if subscriber.wants(event))
+            self._registry(subscriber).add(subscriber)
+        return backlog
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._remove(subscriber)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._everyone) + sum(map(len, self._by_organization.values())) + sum(map(len, self._by_type.values()))
+
+    def reset(self):
+        """
+        Tell every subscriber to reload, after events may have been missed
+        """
+        with self._lock:
+            self._buffer.clear()
+            subscribers = list(chain(self._everyone, *self._by_organization.values(), *self._by_type.values()))
+        for subscriber in subscribers:
+            if not subscriber.deliver(RESET_FRAME):
+                subscriber.close()
+
+
+class PostgresBroker(MemoryBroker):
+    """
+    Publishes through Postgres NOTIFY on `channel`, and dispatches what a
+    listener thread receives from LISTEN, so that every process gets the
+    changes of all of them. Postgres delivers notifications to every
+    listener in commit order, so the buffered events are in the same order
+    in each process and a client can resume on any of them. The listener
+    starts with the first request the app serves and reconnects when its
+    connection is lost, telling the subscribers to reload as notifications
+    sent meanwhile are lost.
+    """
+    def __init__(self, channel='donation_events', buffer_size=1000, max_pending=100, poll_interval=5):
+        super().__init__(buffer_size, max_pending)
+        self.channel = channel
+        self.poll_interval = poll_interval
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def init_app(self, app):
+        app.before_request(lambda: self.start(app))
+
+    def start(self, app):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._listen, args=(app,), name='event-feed', daemon=True)
+                    self._thread.start()
+
+    def publish(self, messages):
+        # One statement for all the events of a write, delivered when it commits
+        with db.engine.connect() as connection:
+            connection.execute(
+                text('SELECT pg_notify(:channel, payload) FROM unnest(CAST(:payloads AS text[])) AS payload'),
+                {'channel': self.channel, 'payloads': [encode_json(message).decode() for message in messages]}
+            )
+            connection.commit()
+
+    def _listen(self, app):
+        with app.app_context():
+            engine = db.engine
+        listened = False
+        while True:
+            try:
+                connection = engine.raw_connection()
+                try:
+                    driver = connection.driver_connection
+                    driver.autocommit = True
+                    driver.cursor().execute(f'LISTEN "{self.channel}"')
+                    if listened:
+                        self.reset()
+                    listened = True
+                    while True:
+                        if not select.select([driver], [], [], self.poll_interval)[0]:
+                            continue
+                        driver.poll()
+                        events = []
+                        while driver.notifies:
+                            events.append(Event(**json.loads(driver.notifies.pop(0).payload)))
+                        self._dispatch(events)
+                finally:
+                    # Not returned to the pool while listening
+                    connection.invalidate()
+            except Exception as e:
+                log(e)
+                time.sleep(1)
+
+
+def create_broker(config=EVENT_FEED):
+    """
+    Build the feed backend selected in settings: 'memory' or 'postgres'
+    """
+    backend = config.get('backend', 'memory')
+    buffer_size, max_pending = config.get('buffer_size', 1000), config.get('max_pending', 100)
+    if backend == 'memory':
+        return MemoryBroker(buffer_size, max_pending)
+    if backend == 'postgres':
+        return PostgresBroker(config.get('channel', 'donation_events'), buffer_size, max_pending)
+    raise ValueError(f'Unknown feed backend {backend!r}')
+
+event_feed = create_broker(EVENT_FEED)
+registry.gauge('feed_subscribers', 'Clients connected to the live feed of this process', callback=lambda: {(): event_feed.subscriber_count()})
+
+## Publishing ##
+def _kind(model):
+    return 'organization' if model is Organization else 'requirement' if model is Requirement else None
+
+def _message(kind, action, data):
+    if kind == 'organization':
+        organization_id, type_id = data['id'], None
+    else:
+        organization_id, type_id = data['organization_id'], data['type_id']
+    return {'id': secrets.token_hex(8), 'event': f'{kind}.{action}', 'organization_id': organization_id, 'type_id': type_id, 'data': data}
+
+def publish(kind, action, items):
+    messages = [_message(kind, action, data) for data in items]
+    if messages:
+        event_feed.publish(messages)
+        events_published.inc(len(messages), event=f'{kind}.{action}')
+
+# Sent after the write committed: a feed failure is logged, not reported as a failed write
+@model_saved.connect
+def _publish_saved(model, instance):
+    kind = _kind(model)
+    if kind is not None:
+        try:
+            publish(kind, 'saved', [KINDS[kind].dump_one(instance)])
+        except Exception as e:
+            log(e)
+
+@model_deleted.connect
+def _publish_deleted(model, instance):
+    kind = _kind(model)
+    if kind is not None:
+        try:
+            data = {'id': instance.id}
+            if kind == 'requirement':
+                data.update(organization_id=instance.organization_id, type_id=instance.type_id)
+            publish(kind, 'deleted', [data])
+        except Exception as e:
+            log(e)
+
+@models_bulk_saved.connect
+def _publish_bulk_saved(model, ids):
+    kind = _kind(model)
+    if kind is not None and ids:
+        try:
+            publish(kind, 'saved', [KINDS[kind].dump_one(row) for row in model.query.filter(model.id.in_(ids))])
+        except Exception as e:
+            log(e)
+
+@progress_changed.connect_via(Requirement)
+def _publish_progress(model, progress):
+    try:
+        publish('requirement', 'progress', [{'id': id, **values} for id, values in progress.items()])
+    except Exception as e:
+        log(e)
+
+## Streaming ##
+def parse_subscription(args):
+    """
+    Subscriber filters from the query arguments: organization, type_id and kind
+    """
+    kind = args.get('kind') or None
+    if kind is not None and kind not in KINDS:
+        raise InvalidQueryArgument(f"'kind' must be one of {', '.join(KINDS)}")
+    return {'organization_id': int_arg('organization', args), 'type_id': int_arg('type_id', args), 'kind': kind}
+
+def last_event_id(request):
+    # EventSource sends the header when reconnecting, the argument resumes a new EventSource
+    return request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+
+def stream(subscriber, backlog, heartbeat=EVENT_FEED.get('heartbeat', 15)):
+    """
+    Frames for a WSGI response: the backlog, then events as they come.
+    Ends when the subscriber is dropped, or when the client disconnects
+    (noticed at the next write, at most `heartbeat` seconds later).
+    """
+    try:
+        yield backlog or KEEP_ALIVE_FRAME
+        while True:
+            frames = subscriber.take(heartbeat)
+            if frames is None:
+                return
+            yield frames or KEEP_ALIVE_FRAME
+    finally:
+        event_feed.unsubscribe(subscriber)
+
+async def stream_async(subscriber, backlog, heartbeat=EVENT_FEED.get('heartbeat', 15)):
+    """
+    Same as stream, for an ASGI response
+    """
+    try:
+        yield backlog or KEEP_ALIVE_FRAME
+        while True:
+            frames = await subscriber.take(heartbeat)
+            if frames is None:
+                return
+            yield frames or KEEP_ALIVE_FRAME
+    finally:
+        event_feed.unsubscribe(subscriber)
+
+STREAM_HEADERS = {'Cache-Control': 'no-store', 'X-Accel-Buffering': 'no'} # no proxy buffering either
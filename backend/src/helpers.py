@@ -1,29 +1,66 @@
-import jwt
-from flask import jsonify
+from flask import jsonify, stream_with_context, current_app, Response
 from datetime import datetime, timedelta
-from settings import SECRET_KEY, DEBUG
+from settings import DEBUG
+from src.tokens import encode_token
+from src.serializers import encode_json
+from src.metrics import registry
+
+handled_exceptions = registry.counter('handled_exceptions_total', 'Exceptions caught and logged by the handlers', ['type'])
 
 def log (message):
+    if isinstance(message, BaseException):
+        handled_exceptions.inc(type=type(message).__name__)
     if DEBUG:
         print(message)
     
 
-def generate_access_token(user_id):
+def generate_access_token(user_id, **claims):
+    """
+    Signed access token for `user_id`. Extra claims (e.g. is_organization,
+    organizations) let handlers authorize without querying the database.
+    """
     validity_period = timedelta(hours=24)
     expiry_time = datetime.utcnow() + validity_period
     payload = {
+        **claims,
         'identity': user_id,
         'exp': expiry_time
     }
-    access_token = jwt.encode(payload, SECRET_KEY, algorithm='HS256')
+    access_token = encode_token(payload)
     return access_token
 
-def construct_response(message, status_code, data=[]):
+def construct_response(message, status_code, data=[], headers=None, **extra):
     try:
         response = {
             'message': message,
-            'data': data 
+            'data': data,
+            **extra
         }
-        return jsonify(response), status_code
+        # Same document as jsonify, sorted keys and dates converted by the app's JSON provider
+        body = encode_json(response, default=current_app.json.default, sort_keys=current_app.json.sort_keys)
+        # Responses are not cacheable unless the caller provides validators
+        return Response(body + b'\n', mimetype='application/json'), status_code, {'Cache-Control': 'no-store', **(headers or {})}
     except Exception as e:
-        return jsonify({'message': str(e)}), 500
\ No newline at end of file
+        return jsonify({'message': str(e)}), 500
+
+def construct_streaming_response(message, status_code, items, dump, headers=None, chunk_size=65536):
+    """
+    Same envelope as construct_response, but `items` is consumed lazily and
+    each item is serialized with `dump` as it is written. Output is flushed
+    in chunks of about `chunk_size` bytes, so memory stays bounded
+    whatever the number of items.
+    """
+    def generate():
+        # Keys in the same order as jsonify, which sorts them
+        buffer, size = [b'{"data":['], 0
+        for index, item in enumerate(items):
+            chunk = encode_json(dump(item))
+            buffer.append(b',' + chunk if index else chunk)
+            size += len(chunk)
+            if size >= chunk_size:
+                yield b''.join(buffer)
+                buffer, size = [], 0
+        buffer.append(b'],"message":%s}\n' % encode_json(message))
+        yield b''.join(buffer)
+
+    return Response(stream_with_context(generate()), status_code, {'Cache-Control': 'no-store', **(headers or {})}, mimetype='application/json')
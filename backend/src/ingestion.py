@@ -0,0 +1,207 @@
+import atexit
+import time
+import threading
+from datetime import datetime
+from sqlalchemy import exists
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError, DataError
+from settings import DONATION_QUEUE
+from src.models import db, Organization, Requirement, Donation, Type, Status, lookups
+from src.queues import create_queue
+from src.cache import create_cache
+from src.progress import add_donations
+from src.stats import mark_stale
+from src.metrics import registry
+from src.helpers import log
+
+DONATION_FIELDS = ('organization_id', 'requirement_id', 'type_id', 'status_id', 'description', 'quantity')
+MAX_IDEMPOTENCY_KEY_LENGTH = 64
+BATCH_SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+donation_queue = create_queue(DONATION_QUEUE)
+# Why donations that could not be written failed, by idempotency key
+donation_failures = create_cache()
+
+registry.gauge('donation_queue_depth', 'Donations acknowledged but not written yet', callback=lambda: {(): len(donation_queue)})
+donations_written = registry.counter('donations_written_total', 'Queued donations written to the database')
+donations_failed = registry.counter('donations_failed_total', 'Queued donations that could not be written')
+donations_refused = registry.counter('donations_refused_total', 'Donations refused because the queue was full')
+donation_batch_size = registry.histogram('donation_batch_size', 'Donations per batch written', buckets=BATCH_SIZE_BUCKETS)
+
+class InvalidDonation(Exception):
+    """
+    Raised when a donation refers to rows that do not exist
+    """
+
+class IdempotencyKeyReused(Exception):
+    """
+    Raised when an idempotency key already used for a donation comes with a different one
+    """
+
+## Submission ##
+def check_donation(data):
+    """
+    Reject donations whose batched INSERT would fail, before acknowledging them
+    """
+    if lookups.get(Type, data['type_id']) is None:
+        raise InvalidDonation('Type not found')
+    if lookups.get(Status, data['status_id']) is None:
+        raise InvalidDonation('Status not found')
+    if data.get('requirement_id') is not None:
+        organization_id = db.session.query(Requirement.organization_id).filter_by(id=data['requirement_id']).scalar()
+        if organization_id != data['organization_id']:
+            raise InvalidDonation('Requirement not found in this organization')
+    elif not db.session.query(exists().where(Organization.id == data['organization_id'])).scalar():
+        raise InvalidDonation('Organization not found')
+
+def _scoped(user_id, key):
+    # Keys only need to be unique per user
+    return f'{user_id}:{key}'
+
+def _check_same(key, item, other):
+    if any(item[field] != other[field] for field in DONATION_FIELDS):
+        raise IdempotencyKeyReused(f'Idempotency key {key!r} was already used for another donation')
+
+def submit_donation(user_id, key, data, new_key=False):
+    """
+    Queue a checked donation under the user's idempotency key and return
+    'queued', or 'written' with the Donation when that key was already
+    written. Resubmitting a pending key does not queue it twice. `new_key`
+    skips looking for a donation written with a key generated for this call.
+    Raises QueueFull when the queue is full.
+    """
+    scoped_key = _scoped(user_id, key)
+    item = {field: data.get(field) for field in DONATION_FIELDS}
+    item['created_at'] = datetime.utcnow().isoformat()
+    pending = donation_queue.add(scoped_key, item)
+    if pending is not None:
+        _check_same(key, item, pending)
+        return 'queued', None
+    if not new_key:
+        # Looked up once queued: a donation acknowledged by the writer
+        # before that is written, one acknowledged after was still pending
+        donation = Donation.query.filter_by(idempotency_key=scoped_key).first()
+        if donation is not None:
+            donation_queue.ack([scoped_key])
+            _check_same(key, item, {field: getattr(donation, field) for field in DONATION_FIELDS})
+            return 'written', donation
+    return 'queued', None
+
+def donation_status(user_id, key):
+    """
+    ('written', Donation), ('queued', None), ('failed', reason) or (None, None)
+    for an unknown key
+    """
+    scoped_key = _scoped(user_id, key)
+    donation = Donation.query.filter_by(idempotency_key=scoped_key).first()
+    if donation is not None:
+        return 'written', donation
+    if donation_queue.pending(scoped_key) is not None:
+        return 'queued', None
+    reason = donation_failures.get(scoped_key)
+    if reason is not None:
+        return 'failed', reason
+    return None, None
+
+## Writes ##
+def write_donations(batch):
+    """
+    Insert queued (key, donation) pairs with one multi-row INSERT in one
+    transaction, along with their requirement progress and the stale marks of
+    their organizations. Keys already written are skipped, which makes a
+    batch safe to write again (e.g. when the process died before
+    acknowledging it). Returns the number of donations inserted.
+    """
+    connection = db.session.connection()
+    insert = (postgresql if connection.dialect.name == 'postgresql' else sqlite).insert
+    rows = []
+    for key, item in batch:
+        created_at = datetime.fromisoformat(item['created_at'])
+        rows.append({**item, 'idempotency_key': key, 'created_at': created_at, 'updated_at': created_at})
+    try:
+        # Only the rows actually inserted are returned, and counted
+        written = connection.execute(
+            insert(Donation).values(rows)
+            .on_conflict_do_nothing(index_elements=[Donation.idempotency_key])
+            .returning(Donation.organization_id, Donation.requirement_id, Donation.status_id, Donation.quantity)
+        ).all()
+        add_donations(connection, db.session, written)
+        mark_stale(connection, [row.organization_id for row in written])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(written)
+
+class DonationWriter:
+    """
+    Background thread writing queued donations in batches of up to
+    `batch_size`. Donations keep arriving while a batch is written, so
+    batches grow with the submission rate and the number of transactions
+    stays bounded. Batches the database refuses are retried row by row so
+    that one bad donation does not hold back the others; when the database
+    is unreachable the batch is released and retried after
+    `retry_interval` seconds. Starts with the first request the app serves,
+    like the stats refresher, and writes what is left when the process exits.
+    """
+    def __init__(self, queue, batch_size=500, failure_ttl=86400, retry_interval=1):
+        self.queue = queue
+        self.batch_size = batch_size
+        self.failure_ttl = failure_ttl
+        self.retry_interval = retry_interval
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def init_app(self, app):
+        app.before_request(lambda: self.start(app))
+
+    def start(self, app):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, args=(app,), name='donation-writer', daemon=True)
+                    self._thread.start()
+                    atexit.register(self.drain)
+
+    def _run(self, app):
+        while not self._stop.is_set():
+            batch = self.queue.claim(self.batch_size, timeout=1)
+            if not batch:
+                continue
+            try:
+                with app.app_context():
+                    self.write(batch)
+            except Exception as e:
+                log(e)
+                self.queue.release([key for key, _ in batch])
+                self._stop.wait(self.retry_interval)
+
+    def write(self, batch):
+        try:
+            written = write_donations(batch)
+        except (IntegrityError, DataError) as e:
+            log(e)
+            written = 0
+            for key, item in batch:
+                try:
+                    written += write_donations([(key, item)])
+                except (IntegrityError, DataError) as e:
+                    # e.g. the organization or requirement was deleted since the donation was checked
+                    log(e)
+                    donation_failures.set(key, 'The donation could not be recorded', self.failure_ttl)
+                    donations_failed.inc()
+        self.queue.ack([key for key, _ in batch])
+        donation_batch_size.observe(len(batch))
+        donations_written.inc(written)
+
+    def drain(self, timeout=10):
+        """
+        Wait up to `timeout` seconds for the queue to be written, returns whether it was
+        """
+        deadline = time.monotonic() + timeout
+        while len(self.queue) and time.monotonic() < deadline and self._thread is not None and self._thread.is_alive():
+            time.sleep(0.05)
+        return not len(self.queue)
+
+donation_writer = DonationWriter(donation_queue, DONATION_QUEUE.get('batch_size', 500), DONATION_QUEUE.get('failure_ttl', 86400))
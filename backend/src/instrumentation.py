@@ -0,0 +1,121 @@
+import logging
+from time import perf_counter
+from collections import Counter
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from settings import SLOW_REQUEST_SECONDS, N_PLUS_ONE_THRESHOLD
+from src.metrics import registry
+
+ROUTE_LABELS = ['method', 'blueprint', 'route']
+SIZE_BUCKETS = (128, 512, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+request_duration = registry.histogram('http_request_duration_seconds', 'Time to serve a request, streamed bodies included', ROUTE_LABELS)
+requests_total = registry.counter('http_requests_total', 'Requests served', ROUTE_LABELS + ['status'])
+request_size = registry.histogram('http_request_size_bytes', 'Request body size', ROUTE_LABELS, SIZE_BUCKETS)
+response_size = registry.histogram('http_response_size_bytes', 'Response body size', ROUTE_LABELS, SIZE_BUCKETS)
+request_queries = registry.histogram('http_request_db_queries', 'Database queries per request', ROUTE_LABELS, QUERY_COUNT_BUCKETS)
+request_db_time = registry.histogram('http_request_db_duration_seconds', 'Database time per request', ROUTE_LABELS)
+n_plus_one = registry.counter('http_request_n_plus_one_total', 'Requests repeating one statement at least N_PLUS_ONE_THRESHOLD times', ROUTE_LABELS)
+slow_requests = registry.counter('http_slow_requests_total', 'Requests slower than SLOW_REQUEST_SECONDS', ROUTE_LABELS)
+queries_total = registry.counter('db_queries_total', 'Statements executed, inside requests or not')
+query_duration = registry.histogram('db_query_duration_seconds', 'Statement execution time')
+
+logger = logging.getLogger('donation.requests')
+
+class RequestMetrics:
+    """
+    Measurements of one request, kept on `g` and closed when the response
+    body has been sent
+    """
+    def __init__(self):
+        self.started = perf_counter()
+        self.request_size = request.content_length
+        self.response_size = None
+        self.query_count = 0
+        self.query_time = 0.0
+        self.statements = Counter()
+        self.long_lived = False
+
+    def labels(self):
+        rule = request.url_rule
+        return {
+            'method': request.method,
+            'blueprint': request.blueprint or '',
+            'route': rule.rule if rule is not None else 'unmatched'
+        }
+
+## SQLAlchemy Hooks ##
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    connection.info.setdefault('query_started', []).append(perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    elapsed = perf_counter() - connection.info['query_started'].pop()
+    queries_total.inc()
+    query_duration.observe(elapsed)
+    metrics = g.get('request_metrics') if has_request_context() else None
+    if metrics is not None:
+        metrics.query_count += 1
+        metrics.query_time += elapsed
+        # Statements are parameterized, so the same text is the same query shape
+        metrics.statements[statement] += 1
+
+## Request Hooks ##
+def start_request():
+    g.request_metrics = RequestMetrics()
+
+def finish_request(response):
+    metrics = g.get('request_metrics')
+    if metrics is None:
+        return response
+    labels = metrics.labels()
+    status = response.status_code
+    if response.is_streamed:
+        # Streamed bodies are still being produced here, measure them as they are sent
+        metrics.response_size = 0
+        metrics.long_lived = response.mimetype == 'text/event-stream'
+        response.response = _counted(response.response, metrics)
+    else:
+        metrics.response_size = response.calculate_content_length()
+    response.call_on_close(lambda: record(metrics, labels, status))
+    return response
+
+def _counted(chunks, metrics):
+    try:
+        for chunk in chunks:
+            metrics.response_size += len(chunk)
+            yield chunk
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+def record(metrics, labels, status):
+    duration = perf_counter() - metrics.started
+    request_duration.observe(duration, **labels)
+    requests_total.inc(status=status, **labels)
+    if metrics.response_size is not None:
+        response_size.observe(metrics.response_size, **labels)
+    if metrics.request_size is not None:
+        request_size.observe(metrics.request_size, **labels)
+    request_queries.observe(metrics.query_count, **labels)
+    request_db_time.observe(metrics.query_time, **labels)
+
+    statement, repeats = metrics.statements.most_common(1)[0] if metrics.statements else (None, 0)
+    if repeats >= N_PLUS_ONE_THRESHOLD:
+        n_plus_one.inc(**labels)
+        logger.warning('Possible N+1 on %s %s: %d executions of %s', labels['method'], labels['route'], repeats, ' '.join(statement.split()))
+    # Event streams stay open by design, their duration is not a slow request
+    if duration >= SLOW_REQUEST_SECONDS and not metrics.long_lived:
+        slow_requests.inc(**labels)
+        logger.warning(
+            'Slow request %s %s: %d in %.3fs, %d queries in %.3fs',
+            labels['method'], labels['route'], status, duration, metrics.query_count, metrics.query_time
+        )
+
+def instrument_requests(app):
+    # Registered first, so that the time spent in the other hooks is measured
+    app.before_request_funcs.setdefault(None, []).insert(0, start_request)
+    app.after_request(finish_request)
@@ -0,0 +1,236 @@
+import time
+import heapq
+import threading
+import weakref
+from bisect import bisect_left, insort
+from collections import defaultdict
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import select
+from settings import MATCH_INDEX_MAX_AGE, CLOSED_REQUIREMENT_STATUSES
+from src.models import db, Requirement, Status, lookups, model_saved, model_deleted, models_bulk_saved, progress_changed
+from src.helpers import log
+
+EPOCH = datetime(1970, 1, 1)
+NO_DEADLINE = float('inf')
+COLUMNS = (
+    Requirement.id, Requirement.organization_id, Requirement.type_id, Requirement.status_id,
+    Requirement.deadline, Requirement.quantity, Requirement.fulfilled_quantity
+)
+
+def _deadline_key(deadline):
+    return NO_DEADLINE if deadline is None else (deadline - EPOCH).total_seconds()
+
+def _run(bucket, start):
+    return (bucket[position] for position in range(start, len(bucket)))
+
+class MatchIndex:
+    """
+    Every requirement by id, and the ones with a quantity left in one sorted
+    list per (type, status) ordered by deadline (none last), remaining
+    quantity and id. Entries move by bisection, and a match merges the lists
+    of a type from the first deadline not passed yet, so it only reads the
+    requirements it allocates to.
+    While the index is rebuilt (see MatchIndexes) the changes it receives
+    are recorded to be replayed on its replacement.
+    """
+    def __init__(self, closed_statuses=()):
+        self.closed_statuses = set(closed_statuses)
+        self.built_at = time.monotonic()
+        self.replay = None
+        self.successor = None
+        self._entries = {} # id -> (organization id, type id, status id, deadline, quantity, fulfilled, sort key)
+        self._buckets = {} # (type id, status id) -> sorted [(deadline key, remaining, id)]
+        self._statuses = defaultdict(set) # type id -> status ids with a bucket
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _unplace(self, id):
+        entry = self._entries.pop(id, None)
+        if entry is None or entry[6] is None:
+            return entry
+        key = (entry[1], entry[2])
+        bucket = self._buckets[key]
+        del bucket[bisect_left(bucket, entry[6])]
+        if not bucket:
+            del self._buckets[key]
+            self._statuses[key[0]].discard(key[1])
+        return entry
+
+    def _place(self, id, organization_id, type_id, status_id, deadline, quantity, fulfilled):
+        self._unplace(id)
+        remaining = quantity - fulfilled
+        sort_key = None
+        if remaining > 0 and status_id not in self.closed_statuses:
+            sort_key = (_deadline_key(deadline), remaining, id)
+            insort(self._buckets.setdefault((type_id, status_id), []), sort_key)
+            self._statuses[type_id].add(status_id)
+        self._entries[id] = (organization_id, type_id, status_id, deadline, quantity, fulfilled, sort_key)
+
+    def load(self, rows):
+        """
+        Fill an empty index, sorting each list once instead of inserting row by row
+        """
+        with self._lock:
+            for id, organization_id, type_id, status_id, deadline, quantity, fulfilled in rows:
+                remaining = quantity - fulfilled
+                sort_key = None
+                if remaining > 0 and status_id not in self.closed_statuses:
+                    sort_key = (_deadline_key(deadline), remaining, id)
+                    self._buckets.setdefault((type_id, status_id), []).append(sort_key)
+                    self._statuses[type_id].add(status_id)
+                self._entries[id] = (organization_id, type_id, status_id, deadline, quantity, fulfilled, sort_key)
+            for bucket in self._buckets.values():
+                bucket.sort()
+
+    def _apply(self, operation, *args):
+        with self._lock:
+            if self.successor is not None:
+                # Swapped out while the change was on its way
+                return self.successor._apply(operation, *args)
+            if self.replay is not None:
+                self.replay.append((operation, args))
+            if operation == 'place':
+                self._place(*args)
+            elif operation == 'remove':
+                self._unplace(*args)
+            else:
+                entry = self._entries.get(args[0])
+                if entry is not None:
+                    self._place(args[0], *entry[:5], args[1])
+
+    def place(self, row):
+        self._apply('place', row.id, row.organization_id, row.type_id, row.status_id, row.deadline, row.quantity, row.fulfilled_quantity)
+
+    def remove(self, id):
+        self._apply('remove', id)
+
+    def set_fulfilled(self, id, fulfilled):
+        self._apply('fulfilled', id, fulfilled)
+
+    def match(self, type_id, quantity, status_ids=None, limit=10, now=None):
+        """
+        Allocate `quantity` to the requirements of `type_id` (in `status_ids`
+        when given) with a quantity left: earliest deadline first and, among
+        equal deadlines, the closest to completion first. Requirements whose
+        deadline has passed are skipped. Returns up to `limit` allocations as
+        (requirement id, organization id, allocated, remaining, deadline)
+        and the quantity left unallocated.
+        """
+        start = (_deadline_key(now or datetime.utcnow()),)
+        with self._lock:
+            runs = []
+            for status_id in self._statuses.get(type_id, ()) if status_ids is None else status_ids:
+                bucket = self._buckets.get((type_id, status_id))
+                if bucket:
+                    runs.append(_run(bucket, bisect_left(bucket, start)))
+            allocations, left = [], quantity
+            for _, remaining, id in heapq.merge(*runs):
+                if not left or len(allocations) == limit:
+                    break
+                allocated = min(remaining, left)
+                allocations.append((id, self._entries[id][0], allocated, remaining, self._entries[id][3]))
+                left -= allocated
+        return allocations, left
+
+def build_index():
+    closed = [name.lower() for name in CLOSED_REQUIREMENT_STATUSES]
+    index = MatchIndex(id for id, status in lookups.table(Status).items() if status['name'].lower() in closed)
+    index.load(db.session.execute(select(*COLUMNS).execution_options(yield_per=5000)))
+    return index
+
+class MatchIndexes:
+    """
+    One MatchIndex per engine, built on first use and then kept current from
+    the model signals. Those only carry the writes of this process, so an
+    index older than `max_age` seconds keeps answering while a replacement
+    is built in a background thread, then the changes received meanwhile
+    are replayed on the replacement and it is swapped in.
+    """
+    def __init__(self, max_age=MATCH_INDEX_MAX_AGE):
+        self.max_age = max_age
+        self._indexes = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def get(self, build=True):
+        engine = db.engine
+        with self._lock:
+            index = self._indexes.get(engine)
+            if index is None:
+                if build:
+                    # Built while holding the lock so concurrent first matches do not both scan the table
+                    index = self._indexes[engine] = build_index()
+                return index
+            if build and self.max_age and index.replay is None and time.monotonic() - index.built_at > self.max_age:
+                index.replay = []
+                app = current_app._get_current_object()
+                threading.Thread(target=self._rebuild, args=(app, engine, index), name='match-index', daemon=True).start()
+            return index
+
+    def _rebuild(self, app, engine, index):
+        try:
+            with app.app_context():
+                fresh = build_index()
+        except Exception as e:
+            log(e)
+            with index._lock:
+                index.replay = None
+                index.built_at = time.monotonic() # retried after another max_age
+            return
+        with self._lock, index._lock:
+            for operation, args in index.replay:
+                fresh._apply(operation, *args)
+            index.replay = None
+            index.successor = fresh
+            self._indexes[engine] = fresh
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+match_indexes = MatchIndexes()
+
+## Index Maintenance ##
+# Only indexes already built need updating, the others read the table when built
+@model_saved.connect_via(Requirement)
+def _requirement_saved(model, instance):
+    index = match_indexes.get(build=False)
+    if index is not None:
+        index.place(instance)
+
+@model_deleted.connect_via(Requirement)
+def _requirement_deleted(model, instance):
+    index = match_indexes.get(build=False)
+    if index is not None:
+        index.remove(instance.id)
+
+@models_bulk_saved.connect_via(Requirement)
+def _requirements_bulk_saved(model, ids):
+    index = match_indexes.get(build=False)
+    if index is not None and ids:
+        for row in db.session.execute(select(*COLUMNS).where(Requirement.id.in_(ids))):
+            index.place(row)
+
+@progress_changed.connect_via(Requirement)
+def _progress_changed(model, progress):
+    index = match_indexes.get(build=False)
+    if index is not None:
+        for id, values in progress.items():
+            index.set_fulfilled(id, values['fulfilled_quantity'])
+
+## Matching ##
+def match_requirements(type_id, quantity, status_ids=None, limit=10):
+    """
+    Best allocations of a donation of `quantity` items of `type_id`, see
+    MatchIndex.match. Returns them serialized, and the quantity left.
+    """
+    allocations, left = match_indexes.get().match(type_id, quantity, status_ids, limit)
+    return [{
+        'requirement_id': id,
+        'organization_id': organization_id,
+        'quantity': allocated,
+        'remaining': remaining,
+        'deadline': deadline.isoformat() if deadline else None
+    } for id, organization_id, allocated, remaining, deadline in allocations], left
@@ -1,22 +1,65 @@
+from blinker import Namespace
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session, column_property
+from sqlalchemy.orm.attributes import set_committed_value
 from datetime import datetime
+from settings import LOOKUP_CACHE_TTL
+from src.cache import create_cache
+from src.response_cache import response_cache
+from src.routing import RoutingSession
+from src.passwords import password_hasher
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+## Signals ##
+# Sent by save() / delete() once the change is committed, with the model
+# class as sender and the row as `instance`. Writes that bypass the ORM
+# (bulk imports) send `models_bulk_saved` with the affected `ids` instead.
+signals = Namespace()
+model_saved = signals.signal('model-saved')
+model_deleted = signals.signal('model-deleted')
+models_bulk_saved = signals.signal('models-bulk-saved')
+# Sent once committed when donations moved the progress of requirements,
+# with `progress` mapping their ids to their organization_id, type_id and
+# new fulfilled_quantity and percent_complete
+progress_changed = signals.signal('progress-changed')
+
+def preload(items, relationship):
+    """
+    Load the many-to-one `relationship` (e.g. Requirement.organization) of
+    all `items` with a single IN query and set it on each of them, so that
+    serializing the items does not issue one query per related row.
+    """
+    prop = relationship.property
+    (column, _), = prop.local_remote_pairs
+    model = prop.mapper.class_
+    ids = {getattr(item, column.key) for item in items} - {None}
+    rows = {row.id: row for row in model.query.filter(model.id.in_(ids))} if ids else {}
+    for item in items:
+        set_committed_value(item, prop.key, rows.get(getattr(item, column.key)))
+
+def changed_values(instance, attribute):
+    """
+    Current and, if modified but not yet flushed, previous values of an attribute
+    """
+    history = inspect(instance).attrs[attribute].load_history()
+    values = set(history.added) | set(history.unchanged) | set(history.deleted)
+    return {value for value in values if value is not None}
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(80), nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password = db.Column(db.String(80), nullable=False)
+    password = db.Column(db.String(255), nullable=False) # hash, see src/passwords.py
     is_organization = db.Column(db.Boolean, nullable=False, default=False)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def __repr__(self):
         return '<User %r>' % self.name
     
     def save(self):
-        # TODO: Hash password before saving
         db.session.add(self)
         db.session.commit()
 
@@ -24,6 +67,20 @@ class User(db.Model):
         db.session.delete(self)
         db.session.commit()
 
+    def set_password(self, password):
+        self.password = password_hasher.hash(password)
+
+    def check_password(self, password):
+        """
+        Whether `password` is correct, storing an upgraded hash if the
+        current one was made with other hashing parameters
+        """
+        valid, new_hash = password_hasher.verify(self.password, password)
+        if new_hash is not None:
+            self.password = new_hash
+            self.save()
+        return valid
+
     def exists(self):
         return User.query.filter_by(email=self.email).first() is not None
     
@@ -41,7 +98,7 @@ class Type (db.Model):
     name = db.Column(db.String(80), unique=True, nullable=False)
     description = db.Column(db.String(255), nullable=False)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def __repr__(self):
         return '<Donation_type %r>' % self.name
@@ -58,7 +115,7 @@ class Status (db.Model):
     name = db.Column(db.String(80), unique=True, nullable=False)
     description = db.Column(db.String(255), nullable=False)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def __repr__(self):
         return '<Status %r>' % self.name
@@ -69,6 +126,57 @@ class Status (db.Model):
             'name': self.name,
             'description': self.description
         }
+
+
+class LookupCache:
+    """
+    Read-through cache of the small reference tables (Type, Status). Each
+    table is loaded with a single query and served as an id -> row dict
+    until the TTL expires or a committed change invalidates it.
+    """
+    def __init__(self, backend, ttl):
+        self.backend = backend
+        self.ttl = ttl
+
+    def _key(self, model):
+        return f'lookup:{model.__tablename__}'
+
+    def table(self, model):
+        rows = self.backend.get(self._key(model))
+        if rows is None:
+            rows = {row.id: row.serialize() for row in model.query.all()}
+            self.backend.set(self._key(model), rows, self.ttl)
+        return rows
+
+    def get(self, model, id):
+        return self.table(model).get(id)
+
+    def name(self, model, id):
+        row = self.get(model, id)
+        return row['name'] if row else None
+
+    def invalidate(self, *models):
+        self.backend.delete(*(self._key(model) for model in models))
+
+lookups = LookupCache(create_cache(), LOOKUP_CACHE_TTL)
+
+def _mark_lookup_changed(mapper, connection, target):
+    object_session(target).info.setdefault('changed_lookups', set()).add(mapper.class_)
+
+for model in (Type, Status):
+    for event_name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(model, event_name, _mark_lookup_changed)
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed_lookups(session):
+    # Invalidate only once the change is visible to other sessions
+    changed = session.info.pop('changed_lookups', None)
+    if changed:
+        lookups.invalidate(*changed)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed_lookups(session):
+    session.info.pop('changed_lookups', None)
     
 class Organization(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -80,18 +188,44 @@ class Organization(db.Model):
     logo = db.Column(db.String(255))
     created_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    creator = db.relationship('User')
+
+    __table_args__ = (
+        db.Index('ix_organization_created_at_id', 'created_at', 'id'),
+        db.Index('ix_organization_created_by_created_at_id', 'created_by', 'created_at', 'id'),
+        db.Index('ix_organization_email_name', 'email', 'name'),
+    )
 
     def __repr__(self):
         return '<Organization %r>' % self.name
     
     def save(self):
+        tags = self.cache_tags()
         db.session.add(self)
         db.session.commit()
+        response_cache.invalidate(*tags)
+        model_saved.send(type(self), instance=self)
 
     def delete(self):
+        tags = self.cache_tags()
         db.session.delete(self)
         db.session.commit()
+        response_cache.invalidate(*tags)
+        model_deleted.send(type(self), instance=self)
+
+    def cache_tags(self):
+        """
+        Response cache tags affected by a change to this organization,
+        including the listing of its previous owner
+        """
+        tags = {'organization'}
+        if self.id is not None:
+            tags.add(f'organization:{self.id}')
+        for created_by in changed_values(self, 'created_by'):
+            tags.add(f'organization:created_by:{created_by}')
+        return tags
 
     def exists(self):
         return Organization.query.filter_by(email=self.email, name=self.name).first() is not None
@@ -107,11 +241,16 @@ class Organization(db.Model):
             'logo': self.logo,
             'created_by': {
                 'id': self.created_by,
-                'name': User.query.get(self.created_by).name
+                'name': self.creator.name
             },
             'created_at': self.created_at,
             'updated_at': self.updated_at
         }
+
+    @classmethod
+    def serialize_many(cls, organizations):
+        preload(organizations, cls.creator)
+        return [organization.serialize() for organization in organizations]
     
 class Requirement(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -122,53 +261,111 @@ class Requirement(db.Model):
     description = db.Column(db.String(1000), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
     deadline = db.Column(db.DateTime)
+    fulfilled_quantity = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     percent_complete = db.Column(db.Integer, nullable=False, default=0)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    organization = db.relationship('Organization')
+    type = db.relationship('Type')
+    status = db.relationship('Status')
+
+    __table_args__ = (
+        db.Index('ix_requirement_created_at_id', 'created_at', 'id'),
+        db.Index('ix_requirement_organization_id_created_at_id', 'organization_id', 'created_at', 'id'),
+        db.Index('ix_requirement_type_id_created_at_id', 'type_id', 'created_at', 'id'),
+        db.Index('ix_requirement_status_id_created_at_id', 'status_id', 'created_at', 'id'),
+        db.Index('ix_requirement_deadline', 'deadline'),
+    )
 
     def __repr__(self):
         return '<Requirement %r>' % self.description
 
     def save(self):
+        tags = self.cache_tags()
         db.session.add(self)
         db.session.commit()
+        response_cache.invalidate(*tags)
+        model_saved.send(type(self), instance=self)
 
     def delete(self):
+        tags = self.cache_tags()
+        # Donations to it are kept without a requirement, as ON DELETE SET NULL does where
+        # foreign keys are enforced. A bulk UPDATE, so the progress hooks leave it alone.
+        db.session.execute(db.update(Donation).where(Donation.requirement_id == self.id).values(requirement_id=None))
         db.session.delete(self)
         db.session.commit()
+        response_cache.invalidate(*tags)
+        model_deleted.send(type(self), instance=self)
+
+    def cache_tags(self):
+        """
+        Response cache tags affected by a change to this requirement,
+        including the listing of its previous organization
+        """
+        tags = {'requirement'}
+        if self.id is not None:
+            tags.add(f'requirement:{self.id}')
+        for organization_id in changed_values(self, 'organization_id'):
+            tags.add(f'requirement:organization:{organization_id}')
+        return tags
 
     def serialize(self):
         return {
             'id': self.id,
             'organization': {
                 'id': self.organization_id,
-                'name': Organization.query.get(self.organization_id).name
+                'name': self.organization.name
             },
             'type': {
                 'id': self.type_id,
-                'name': Type.query.get(self.type_id).name
+                'name': lookups.name(Type, self.type_id)
             },
             'status': {
                 'id': self.status_id,
-                'name': Status.query.get(self.status_id).name
+                'name': lookups.name(Status, self.status_id)
             },
             'title': self.title,
             'description': self.description,
             'quantity': self.quantity,
+            'fulfilled_quantity': self.fulfilled_quantity,
+            'percent_complete': self.percent_complete,
             'created_at': self.created_at,
             'updated_at': self.updated_at
         }
+
+    @classmethod
+    def serialize_many(cls, items):
+        # Types and statuses come from the lookup cache
+        preload(items, cls.organization)
+        return [item.serialize() for item in items]
     
 
 class Donation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     organization_id = db.Column(db.Integer, db.ForeignKey('organization.id'), nullable=False)
+    # Columns feeding the requirement progress counters (see src/progress.py)
+    # load their previous value when changed, to subtract the old contribution
+    requirement_id = column_property(db.Column(db.Integer, db.ForeignKey('requirement.id', ondelete='SET NULL')), active_history=True)
     type_id = db.Column(db.Integer, db.ForeignKey('type.id'), nullable=False)
-    status_id = db.Column(db.Integer, db.ForeignKey('status.id'), nullable=False)
+    status_id = column_property(db.Column(db.Integer, db.ForeignKey('status.id'), nullable=False), active_history=True)
     description = db.Column(db.String(255), nullable=False)
-    quantity = db.Column(db.Integer, nullable=False)
+    quantity = column_property(db.Column(db.Integer, nullable=False), active_history=True)
+    # '<user id>:<key>' of donations submitted through the queue (see src/ingestion.py)
+    idempotency_key = db.Column(db.String(100))
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    organization = db.relationship('Organization')
+    requirement = db.relationship('Requirement')
+    type = db.relationship('Type')
+    status = db.relationship('Status')
+
+    __table_args__ = (
+        db.Index('ix_donation_organization_id_created_at', 'organization_id', 'created_at'),
+        db.Index('ix_donation_requirement_id_status_id', 'requirement_id', 'status_id'),
+        db.Index('ix_donation_idempotency_key', 'idempotency_key', unique=True),
+    )
 
     def __repr__(self):
         return '<Donation %r>' % self.description
@@ -186,19 +383,66 @@ class Donation(db.Model):
             'id': self.id,
             'organization': {
                 'id': self.organization_id,
-                'name': Organization.query.get(self.organization_id).name
+                'name': self.organization.name
             },
+            'requirement_id': self.requirement_id,
             'type': {
                 'id': self.type_id,
-                'name': Type.query.get(self.type_id).name
+                'name': lookups.name(Type, self.type_id)
             },
             'status': {
                 'id': self.status_id,
-                'name': Status.query.get(self.status_id).name
+                'name': lookups.name(Status, self.status_id)
             },
             'description': self.description,
             'quantity': self.quantity,
             'created_at': self.created_at,
             'updated_at': self.updated_at
         }
-    
+
+    @classmethod
+    def serialize_many(cls, items):
+        preload(items, cls.organization)
+        return [item.serialize() for item in items]
+
+
+## Dashboard Aggregates ##
+# Summary tables maintained by src/stats.py, recomputed per organization
+# from the rows above when marked stale.
+class OrganizationRequirementStats(db.Model):
+    organization_id = db.Column(db.Integer, db.ForeignKey('organization.id'), primary_key=True)
+    type_id = db.Column(db.Integer, db.ForeignKey('type.id'), primary_key=True)
+    status_id = db.Column(db.Integer, db.ForeignKey('status.id'), primary_key=True)
+    requirement_count = db.Column(db.Integer, nullable=False)
+    open_count = db.Column(db.Integer, nullable=False) # requirements under 100% complete
+    quantity = db.Column(db.Integer, nullable=False)
+    fulfilled_quantity = db.Column(db.Integer, nullable=False)
+
+class OrganizationDonationStats(db.Model):
+    organization_id = db.Column(db.Integer, db.ForeignKey('organization.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    type_id = db.Column(db.Integer, db.ForeignKey('type.id'), primary_key=True)
+    status_id = db.Column(db.Integer, db.ForeignKey('status.id'), primary_key=True)
+    donation_count = db.Column(db.Integer, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+
+class StaleOrganizationStats(db.Model):
+    organization_id = db.Column(db.Integer, db.ForeignKey('organization.id'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1) # bumped on every change since the last refresh
+    marked_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_stale_organization_stats_marked_at', 'marked_at'),
+    )
+
+## Semantic Search ##
+# Maintained by src/embeddings.py. `content_hash` identifies the provider and
+# text the vector was computed from, so unchanged rows are not embedded again.
+class RequirementEmbedding(db.Model):
+    requirement_id = db.Column(db.Integer, db.ForeignKey('requirement.id', ondelete='CASCADE'), primary_key=True)
+    content_hash = db.Column(db.String(64), nullable=False)
+    vector = db.Column(db.LargeBinary, nullable=False) # normalized float32
+
+    __table_args__ = (
+        db.Index('ix_requirement_embedding_content_hash', 'content_hash'),
+    )
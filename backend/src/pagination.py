@@ -0,0 +1,98 @@
+import json
+import base64
+import binascii
+from datetime import datetime
+from flask import request
+from sqlalchemy import tuple_
+
+DEFAULT_LIMIT = 25
+MAX_LIMIT = 100
+STREAM_BATCH_SIZE = 1000
+
+class InvalidQueryArgument(ValueError):
+    pass
+
+def int_arg(name, args=None):
+    """
+    Read an optional integer query argument, rejecting malformed values
+    """
+    value = (request.args if args is None else args).get(name)
+    if value is None or value == '':
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise InvalidQueryArgument(f"'{name}' must be an integer")
+
+def limit_arg(args=None):
+    """
+    Read the page size, DEFAULT_LIMIT when absent and at most MAX_LIMIT
+    """
+    limit = int_arg('limit', args)
+    if limit is None:
+        return DEFAULT_LIMIT
+    if limit < 1:
+        raise InvalidQueryArgument("'limit' must be positive")
+    return min(limit, MAX_LIMIT)
+
+def datetime_arg(name, args=None):
+    """
+    Read an optional ISO 8601 datetime query argument
+    """
+    value = (request.args if args is None else args).get(name)
+    if value is None or value == '':
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise InvalidQueryArgument(f"'{name}' must be an ISO 8601 datetime")
+
+def bool_arg(name, args=None):
+    return (request.args if args is None else args).get(name, '').lower() in ('1', 'true', 'yes')
+
+def encode_cursor(created_at, id):
+    raw = json.dumps([created_at.isoformat(), id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(id)
+    except (binascii.Error, ValueError, TypeError):
+        raise InvalidQueryArgument("'cursor' is invalid")
+
+def page_query(query, model, args=None):
+    """
+    Apply keyset pagination on (created_at, id) driven by the `limit` and
+    `cursor` query arguments to a Query or select(). Returns the query and
+    the page size to pass to page_result once it has been executed.
+    """
+    limit = limit_arg(args)
+
+    cursor = (request.args if args is None else args).get('cursor')
+    if cursor:
+        query = query.filter(tuple_(model.created_at, model.id) > decode_cursor(cursor))
+
+    # Fetch one extra row to know whether another page exists
+    return query.order_by(model.created_at, model.id).limit(limit + 1), limit
+
+def page_result(items, limit):
+    """
+    The page items and the cursor of the next page, which is None on the last page
+    """
+    if len(items) <= limit:
+        return items, None
+    items = items[:limit]
+    return items, encode_cursor(items[-1].created_at, items[-1].id)
+
+def paginate(query, model):
+    query, limit = page_query(query, model)
+    return page_result(query.all(), limit)
+
+def stream_all(query, model):
+    """
+    Every row of `query` in page order, fetched from the database in batches
+    (a server-side cursor on Postgres) instead of all at once
+    """
+    return query.order_by(model.created_at, model.id).yield_per(STREAM_BATCH_SIZE)
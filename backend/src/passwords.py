@@ -0,0 +1,182 @@
+import hmac
+import base64
+import hashlib
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from settings import PASSWORD_HASHING
+
+try:
+    import argon2
+except ImportError: # argon2-cffi is optional
+    argon2 = None
+
+try:
+    import bcrypt
+except ImportError: # bcrypt is optional
+    bcrypt = None
+
+class PasswordHasherBusy(Exception):
+    """
+    Raised when the hashing pool already has as many jobs as it may queue
+    """
+
+## Schemes ##
+# Each scheme produces self-describing hashes, so that hashes made with other
+# parameters, or by another scheme, still verify and can be detected as
+# needing a rehash.
+class Argon2Scheme:
+    name = 'argon2'
+    prefix = '$argon2'
+
+    def __init__(self, time_cost=3, memory_cost=65536, parallelism=1):
+        self.hasher = argon2.PasswordHasher(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+
+    def hash(self, password):
+        return self.hasher.hash(password)
+
+    def verify(self, stored, password):
+        try:
+            return self.hasher.verify(stored, password)
+        except (argon2.exceptions.VerificationError, argon2.exceptions.InvalidHashError):
+            return False
+
+    def needs_rehash(self, stored):
+        return self.hasher.check_needs_rehash(stored)
+
+class BcryptScheme:
+    name = 'bcrypt'
+    prefix = '$2'
+
+    def __init__(self, rounds=12):
+        self.rounds = rounds
+
+    def hash(self, password):
+        return bcrypt.hashpw(password.encode(), bcrypt.gensalt(self.rounds)).decode()
+
+    def verify(self, stored, password):
+        # bcrypt only reads the first 72 bytes of a password
+        try:
+            return bcrypt.checkpw(password.encode(), stored.encode())
+        except ValueError:
+            return False
+
+    def needs_rehash(self, stored):
+        return int(stored.split('$')[2]) != self.rounds
+
+class ScryptScheme:
+    """
+    hashlib.scrypt, always available. Hashes look like
+    $scrypt$ln=15,r=8,p=1$<salt>$<key>
+    """
+    name = 'scrypt'
+    prefix = '$scrypt$'
+
+    def __init__(self, log_n=15, r=8, p=1):
+        self.log_n, self.r, self.p = log_n, r, p
+
+    @staticmethod
+    def _derive(password, salt, log_n, r, p):
+        # 128 * r * n bytes are needed, leave room for the default parameters
+        return hashlib.scrypt(password.encode(), salt=salt, n=2 ** log_n, r=r, p=p, maxmem=256 * r * 2 ** log_n, dklen=32)
+
+    @staticmethod
+    def _encode(raw):
+        return base64.b64encode(raw).decode().rstrip('=')
+
+    @staticmethod
+    def _decode(text):
+        return base64.b64decode(text + '=' * (-len(text) % 4))
+
+    def _parse(self, stored):
+        _, _, params, salt, key = stored.split('$')
+        values = dict(param.split('=') for param in params.split(','))
+        return int(values['ln']), int(values['r']), int(values['p']), self._decode(salt), self._decode(key)
+
+    def hash(self, password):
+        salt = secrets.token_bytes(16)
+        key = self._derive(password, salt, self.log_n, self.r, self.p)
+        return f'$scrypt$ln={self.log_n},r={self.r},p={self.p}${self._encode(salt)}${self._encode(key)}'
+
+    def verify(self, stored, password):
+        try:
+            log_n, r, p, salt, key = self._parse(stored)
+        except (ValueError, KeyError):
+            return False
+        return hmac.compare_digest(self._derive(password, salt, log_n, r, p), key)
+
+    def needs_rehash(self, stored):
+        log_n, r, p, _, _ = self._parse(stored)
+        return (log_n, r, p) != (self.log_n, self.r, self.p)
+
+SCHEMES = {'argon2': Argon2Scheme, 'bcrypt': BcryptScheme, 'scrypt': ScryptScheme}
+AVAILABLE = {'argon2': argon2 is not None, 'bcrypt': bcrypt is not None, 'scrypt': True}
+
+## Hasher ##
+class PasswordHasher:
+    """
+    Hashes with the configured scheme and verifies hashes of any available
+    scheme on a bounded thread pool. The KDFs release the GIL, so the pool
+    size caps how many cores logins may use while the request threads stay
+    free for other work; once `max_pending` jobs are waiting new ones are
+    refused with PasswordHasherBusy instead of piling up.
+    Passwords stored before hashing was introduced (plaintext) still verify
+    once and are reported as needing a rehash.
+    """
+    def __init__(self, config):
+        scheme = config['scheme'] if AVAILABLE[config['scheme']] else 'scrypt'
+        self.schemes = {
+            name: cls(**config.get(name, {})) for name, cls in SCHEMES.items() if AVAILABLE[name]
+        }
+        self.scheme = self.schemes[scheme]
+        self.workers = config.get('workers', 2)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hasher')
+        self._slots = threading.BoundedSemaphore(self.workers + config.get('max_pending', 32))
+        # Verified when the user does not exist, so that unknown emails take as long as wrong passwords
+        self._dummy_hash = None
+
+    def _submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHasherBusy()
+        try:
+            future = self._pool.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+    def _scheme_of(self, stored):
+        for scheme in self.schemes.values():
+            if stored.startswith(scheme.prefix):
+                return scheme
+        return None
+
+    def _verify(self, stored, password):
+        scheme = self._scheme_of(stored)
+        if scheme is None:
+            if stored.startswith('$'):
+                return False, False # a scheme that is not installed
+            return hmac.compare_digest(stored.encode(), password.encode()), True
+        return scheme.verify(stored, password), scheme is not self.scheme or scheme.needs_rehash(stored)
+
+    def hash(self, password):
+        return self._submit(self.scheme.hash, password)
+
+    def verify(self, stored, password):
+        """
+        Check `password` against the stored hash, or against a dummy hash
+        when `stored` is None. Returns whether it matches and, when it does
+        and the hash is outdated, a new hash to store.
+        """
+        if stored is None:
+            if self._dummy_hash is None:
+                self._dummy_hash = self.hash(secrets.token_hex(16))
+            self._submit(self._verify, self._dummy_hash, password)
+            return False, None
+        valid, outdated = self._submit(self._verify, stored, password)
+        if valid and outdated:
+            return True, self.hash(password)
+        return valid, None
+
+password_hasher = PasswordHasher(PASSWORD_HASHING)
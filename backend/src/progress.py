@@ -0,0 +1,181 @@
+import click
+from collections import Counter
+from flask.cli import with_appcontext
+from sqlalchemy import event, exists, func, case, or_, select, update, inspect
+from sqlalchemy.orm import Session, object_session
+from settings import PROGRESS_STATUSES
+from src.models import db, Requirement, Donation, Status, lookups, progress_changed
+from src.response_cache import response_cache
+from src.stats import mark_stale
+
+RECONCILE_BATCH_SIZE = 1000
+# Returned by the statements changing progress, for the progress_changed signal
+PROGRESS_COLUMNS = (Requirement.organization_id, Requirement.type_id, Requirement.fulfilled_quantity, Requirement.percent_complete)
+
+def percent_complete(fulfilled, quantity):
+    """
+    SQL expression of the progress of a requirement, as a whole percentage
+    capped at 100
+    """
+    return case(
+        (fulfilled >= quantity, 100),
+        (fulfilled <= 0, 0),
+        else_=fulfilled * 100 // quantity
+    )
+
+def counted_status(status_id):
+    """
+    Whether donations in this status count towards their requirement
+    """
+    return exists().where(Status.id == status_id, func.lower(Status.name).in_([name.lower() for name in PROGRESS_STATUSES]))
+
+def counts_towards_progress(status_id):
+    """
+    Python side of counted_status, from the cached status names
+    """
+    name = lookups.name(Status, status_id)
+    return name is not None and name.lower() in [name.lower() for name in PROGRESS_STATUSES]
+
+## Incremental Updates ##
+def _adjust(connection, session, requirement_id, status_id, delta):
+    """
+    Add `delta` to the fulfilled quantity of a requirement if the status
+    counts. A single atomic UPDATE, so concurrent donations to the same
+    requirement serialize on its row instead of overwriting each other.
+    """
+    if requirement_id is None or not delta:
+        return
+    fulfilled = Requirement.fulfilled_quantity + delta
+    row = connection.execute(
+        update(Requirement)
+        .where(Requirement.id == requirement_id, counted_status(status_id))
+        .values(fulfilled_quantity=fulfilled, percent_complete=percent_complete(fulfilled, Requirement.quantity))
+        .returning(*PROGRESS_COLUMNS)
+    ).first()
+    if row is not None:
+        session.info.setdefault('changed_progress', set()).update((
+            'requirement', f'requirement:{requirement_id}', f'requirement:organization:{row.organization_id}'
+        ))
+        session.info.setdefault('changed_fulfilled', {})[requirement_id] = row._asdict()
+
+def _contribution(target, committed):
+    """
+    (requirement_id, status_id, quantity) of a donation as last flushed, or as it is now
+    """
+    state = inspect(target)
+    values = []
+    for attribute in ('requirement_id', 'status_id', 'quantity'):
+        history = state.attrs[attribute].history
+        # These columns keep active history, so a changed value always has its previous one
+        values.append(history.deleted[0] if committed and history.deleted else getattr(target, attribute))
+    return tuple(values)
+
+@event.listens_for(Donation, 'after_insert')
+def _donation_inserted(mapper, connection, target):
+    requirement_id, status_id, quantity = _contribution(target, committed=False)
+    _adjust(connection, object_session(target), requirement_id, status_id, quantity)
+
+@event.listens_for(Donation, 'after_update')
+def _donation_updated(mapper, connection, target):
+    old, new = _contribution(target, committed=True), _contribution(target, committed=False)
+    if old != new:
+        _adjust(connection, object_session(target), old[0], old[1], -old[2])
+        _adjust(connection, object_session(target), *new)
+
+@event.listens_for(Donation, 'after_delete')
+def _donation_deleted(mapper, connection, target):
+    requirement_id, status_id, quantity = _contribution(target, committed=True)
+    _adjust(connection, object_session(target), requirement_id, status_id, -quantity)
+
+@event.listens_for(Requirement, 'before_update')
+def _requirement_quantity_changed(mapper, connection, target):
+    if inspect(target).attrs.quantity.history.has_changes():
+        # Evaluated by the UPDATE against the stored fulfilled quantity
+        target.percent_complete = percent_complete(Requirement.fulfilled_quantity, target.quantity)
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed_progress(session):
+    tags = session.info.pop('changed_progress', None)
+    if tags:
+        response_cache.invalidate(*tags)
+    progress = session.info.pop('changed_fulfilled', None)
+    if progress:
+        progress_changed.send(Requirement, progress=progress)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed_progress(session):
+    session.info.pop('changed_progress', None)
+    session.info.pop('changed_fulfilled', None)
+
+def add_donations(connection, session, donations):
+    """
+    Count donations written with a Core INSERT, which bypasses the mapper
+    events. Donations are summed per requirement and status first, so a
+    batch costs one UPDATE per requirement rather than one per donation.
+    """
+    totals = Counter()
+    for donation in donations:
+        if donation.requirement_id is not None:
+            totals[donation.requirement_id, donation.status_id] += donation.quantity
+    for (requirement_id, status_id), quantity in sorted(totals.items()): # fixed lock order
+        _adjust(connection, session, requirement_id, status_id, quantity)
+
+def refresh_percent_complete(ids):
+    """
+    Recompute percent_complete of requirements whose quantity was changed
+    by a bulk UPDATE, which bypasses the before_update event
+    """
+    db.session.execute(
+        update(Requirement)
+        .where(Requirement.id.in_(ids))
+        .values(percent_complete=percent_complete(Requirement.fulfilled_quantity, Requirement.quantity)),
+        execution_options={'synchronize_session': False}
+    )
+
+## Reconciliation ##
+def reconcile_progress(batch_size=RECONCILE_BATCH_SIZE):
+    """
+    Recompute every requirement's counters from its donations, repairing
+    drift (e.g. from writes made outside the ORM). Runs one UPDATE per range
+    of ids, committed separately so that row locks are held briefly, and
+    only touches rows whose counters are wrong. Returns how many were fixed.
+    """
+    donated = (
+        select(func.coalesce(func.sum(Donation.quantity), 0))
+        .where(Donation.requirement_id == Requirement.id, counted_status(Donation.status_id))
+        .scalar_subquery()
+    )
+    expected_percent = percent_complete(donated, Requirement.quantity)
+    lowest, highest = db.session.query(func.min(Requirement.id), func.max(Requirement.id)).one()
+    if lowest is None:
+        return 0
+
+    fixed = 0
+    for start in range(lowest, highest + 1, batch_size):
+        rows = db.session.execute(
+            update(Requirement)
+            .where(
+                Requirement.id >= start, Requirement.id < start + batch_size,
+                or_(Requirement.fulfilled_quantity != donated, Requirement.percent_complete != expected_percent)
+            )
+            .values(fulfilled_quantity=donated, percent_complete=expected_percent)
+            .returning(Requirement.id, *PROGRESS_COLUMNS),
+            execution_options={'synchronize_session': False}
+        ).all()
+        mark_stale(db.session.connection(), (row.organization_id for row in rows))
+        db.session.commit()
+        if rows:
+            tags = {'requirement'}
+            for row in rows:
+                tags.update((f'requirement:{row.id}', f'requirement:organization:{row.organization_id}'))
+            response_cache.invalidate(*tags)
+            progress_changed.send(Requirement, progress={row.id: row._asdict() for row in rows})
+            fixed += len(rows)
+    return fixed
+
+@click.command('reconcile-progress')
+@click.option('--batch-size', default=RECONCILE_BATCH_SIZE, show_default=True)
+@with_appcontext
+def reconcile_progress_command(batch_size):
+    """Recompute requirement progress counters from donations."""
+    click.echo(f'{reconcile_progress(batch_size)} requirements fixed')
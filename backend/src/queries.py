@@ -0,0 +1,32 @@
+from src.models import Organization, Requirement
+from src.pagination import int_arg, datetime_arg
+
+def filter_organizations(query, args=None):
+    """
+    Apply the organization listing filters from the query arguments to a Query or select()
+    """
+    created_by = int_arg('created_by', args)
+    if created_by:
+        query = query.filter(Organization.created_by == created_by)
+    return query
+
+def filter_requirements(query, args=None):
+    """
+    Apply the requirement listing filters from the query arguments to a Query or select()
+    """
+    org_id = int_arg('organization', args)
+    if org_id:
+        query = query.filter(Requirement.organization_id == org_id)
+    type_id = int_arg('type_id', args)
+    if type_id:
+        query = query.filter(Requirement.type_id == type_id)
+    status_id = int_arg('status_id', args)
+    if status_id:
+        query = query.filter(Requirement.status_id == status_id)
+    deadline_from = datetime_arg('deadline_from', args)
+    if deadline_from:
+        query = query.filter(Requirement.deadline >= deadline_from)
+    deadline_to = datetime_arg('deadline_to', args)
+    if deadline_to:
+        query = query.filter(Requirement.deadline <= deadline_to)
+    return query
@@ -0,0 +1,171 @@
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+from settings import DONATION_QUEUE
+
+class QueueFull(Exception):
+    """
+    Raised when a queue already holds `max_pending` items
+    """
+
+class MemoryQueue:
+    """
+    Keyed FIFO queue in the process, its items are lost if it exits.
+    Consumers claim batches and acknowledge them once processed, or release
+    them to be claimed again.
+    """
+    def __init__(self, max_pending=10000):
+        self.max_pending = max_pending
+        self._items = OrderedDict()
+        self._claimed = set()
+        self._ready = threading.Condition()
+
+    def add(self, key, item):
+        """
+        Queue `item` under `key` unless that key is already pending. Returns
+        the pending item of the key, or None when `item` was queued.
+        """
+        with self._ready:
+            if key in self._items:
+                return self._items[key]
+            if len(self._items) >= self.max_pending:
+                raise QueueFull()
+            self._items[key] = item
+            self._ready.notify()
+            return None
+
+    def pending(self, key):
+        with self._ready:
+            return self._items.get(key)
+
+    def claim(self, limit, timeout):
+        """
+        Up to `limit` of the oldest unclaimed (key, item) pairs, waiting up to
+        `timeout` seconds for the first one
+        """
+        with self._ready:
+            self._ready.wait_for(lambda: len(self._items) > len(self._claimed), timeout)
+            batch = []
+            for key, item in self._items.items():
+                if len(batch) == limit:
+                    break
+                if key not in self._claimed:
+                    batch.append((key, item))
+            self._claimed.update(key for key, _ in batch)
+            return batch
+
+    def ack(self, keys):
+        with self._ready:
+            for key in keys:
+                self._items.pop(key, None)
+                self._claimed.discard(key)
+
+    def release(self, keys):
+        with self._ready:
+            self._claimed.difference_update(keys)
+            self._ready.notify()
+
+    def __len__(self):
+        with self._ready:
+            return len(self._items)
+
+
+class SqliteQueue:
+    """
+    Same interface as MemoryQueue, kept in a local SQLite file so that items
+    survive a crash or restart. The processes of one host may share the
+    file: a claim is a lease, and a batch whose consumer died before
+    acknowledging it can be claimed again once the lease has expired.
+    Items are stored as JSON.
+    """
+    def __init__(self, path, max_pending=10000, lease=60, poll_interval=0.05):
+        self.path = path
+        self.max_pending = max_pending
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        self._added = threading.Event()
+        with self._transaction() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS pending ('
+                'seq INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL UNIQUE, item TEXT NOT NULL, claimed_until REAL)'
+            )
+
+    def _connection(self):
+        # sqlite3 connections may not be shared between threads
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=FULL') # an acknowledged item must survive power loss
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def add(self, key, item):
+        with self._transaction() as connection:
+            row = connection.execute('SELECT item FROM pending WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                return json.loads(row[0])
+            if connection.execute('SELECT count(*) FROM pending').fetchone()[0] >= self.max_pending:
+                raise QueueFull()
+            connection.execute('INSERT INTO pending (key, item) VALUES (?, ?)', (key, json.dumps(item)))
+        self._added.set()
+        return None
+
+    def pending(self, key):
+        row = self._connection().execute('SELECT item FROM pending WHERE key = ?', (key,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def claim(self, limit, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            self._added.clear()
+            now = time.time()
+            with self._transaction() as connection:
+                rows = connection.execute(
+                    'SELECT key, item FROM pending WHERE claimed_until IS NULL OR claimed_until < ? ORDER BY seq LIMIT ?',
+                    (now, limit)
+                ).fetchall()
+                connection.executemany('UPDATE pending SET claimed_until = ? WHERE key = ?', [(now + self.lease, key) for key, _ in rows])
+            remaining = deadline - time.monotonic()
+            if rows or remaining <= 0:
+                return [(key, json.loads(item)) for key, item in rows]
+            # Woken early by additions from this process, others are polled
+            self._added.wait(min(self.poll_interval, remaining))
+
+    def ack(self, keys):
+        with self._transaction() as connection:
+            connection.executemany('DELETE FROM pending WHERE key = ?', [(key,) for key in keys])
+
+    def release(self, keys):
+        with self._transaction() as connection:
+            connection.executemany('UPDATE pending SET claimed_until = NULL WHERE key = ?', [(key,) for key in keys])
+        self._added.set()
+
+    def __len__(self):
+        return self._connection().execute('SELECT count(*) FROM pending').fetchone()[0]
+
+
+def create_queue(config=DONATION_QUEUE):
+    """
+    Build the queue backend selected in settings: 'memory' or 'sqlite'
+    """
+    backend = config.get('backend', 'memory')
+    if backend == 'memory':
+        return MemoryQueue(config.get('max_pending', 10000))
+    if backend == 'sqlite':
+        return SqliteQueue(config['path'], config.get('max_pending', 10000), config.get('lease', 60))
+    raise ValueError(f'Unknown queue backend {backend!r}')
@@ -0,0 +1,101 @@
+import math
+import time
+import jwt
+from flask import g, request
+from settings import RATE_LIMITS
+from src.cache import create_cache
+from src.helpers import construct_response
+from src.metrics import registry
+from src.tokens import decode_token
+
+rate_limited = registry.counter('http_rate_limited_total', 'Requests refused by the rate limiter', ['endpoint', 'scope'])
+
+class RateLimiter:
+    """
+    Per-client request limits by endpoint, each a number of requests per
+    sliding window of `period` seconds. The window is approximated from two
+    fixed-window counters: the current one plus the previous one weighted by
+    how much of it still overlaps the window. Counters only need an atomic
+    increment, so the limits hold across workers with a shared cache backend.
+    A client is the remote address ('ip' scope) or the token identity
+    ('user' scope, anonymous requests fall back to the address).
+    """
+    def __init__(self, backend, limits):
+        self.backend = backend
+        self.limits = limits
+
+    def rules(self, endpoint):
+        if endpoint is None:
+            return []
+        return self.limits.get(endpoint, self.limits.get('default')) or []
+
+    @staticmethod
+    def identity(scope, request):
+        if scope == 'user':
+            auth_header = request.headers.get('Authorization', '')
+            parts = auth_header.split()
+            if len(parts) == 2:
+                try:
+                    return f"user:{decode_token(parts[1])['identity']}"
+                except (jwt.InvalidTokenError, KeyError):
+                    pass
+        return f'ip:{request.remote_addr}'
+
+    def hit(self, key, requests, period):
+        """
+        Count a request against `key`. Returns whether it is within the limit,
+        the requests left and the seconds until one more would be allowed.
+        """
+        now = time.time()
+        window, elapsed = divmod(now, period)
+        current = self.backend.incr(f'ratelimit:{key}:{period}:{int(window)}', period * 2)
+        previous = self.backend.counter(f'ratelimit:{key}:{period}:{int(window) - 1}')
+        weight = 1 - elapsed / period
+        estimate = previous * weight + current
+        if current > requests or not previous:
+            # Only the next window frees requests
+            wait = period - elapsed
+        else:
+            # The previous window slides out until the estimate is back under the limit
+            wait = max(0, estimate - requests) / previous * period
+        return estimate <= requests, max(0, math.floor(requests - estimate)), wait
+
+    def check(self, request):
+        """
+        Count `request` against the limits of its endpoint. Returns whether it
+        may proceed and the headers describing the tightest limit.
+        """
+        if request.method == 'OPTIONS':
+            return True, {}
+        allowed, headers, tightest = True, {}, None
+        for requests, period, scope in self.rules(request.endpoint):
+            within, remaining, wait = self.hit(f'{request.endpoint}:{self.identity(scope, request)}', requests, period)
+            if tightest is None or remaining < tightest:
+                tightest = remaining
+                headers = {
+                    'X-RateLimit-Limit': str(requests),
+                    'X-RateLimit-Remaining': str(remaining),
+                    'X-RateLimit-Reset': str(math.ceil(wait))
+                }
+            if not within:
+                rate_limited.inc(endpoint=request.endpoint, scope=scope)
+                allowed = False
+                headers['Retry-After'] = str(max(1, math.ceil(wait)))
+        return allowed, headers
+
+    def init_app(self, app, limits=RATE_LIMITS):
+        self.limits = limits or {}
+        app.before_request(limit_request)
+        app.after_request(add_rate_limit_headers)
+
+rate_limiter = RateLimiter(create_cache(), RATE_LIMITS)
+
+## Request Hooks ##
+def limit_request():
+    allowed, g.rate_limit_headers = rate_limiter.check(request)
+    if not allowed:
+        return construct_response('Too many requests, try again shortly', 429, headers=g.rate_limit_headers)
+
+def add_rate_limit_headers(response):
+    response.headers.update(g.get('rate_limit_headers', {}))
+    return response
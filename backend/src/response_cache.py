@@ -0,0 +1,142 @@
+import time
+import uuid
+import threading
+from functools import wraps
+from flask import request, make_response, Response
+from werkzeug.http import unquote_etag
+from settings import RESPONSE_CACHE_TTL, REPLICA_STICKY_SECONDS
+from src.cache import create_cache
+from src.routing import reads_from_replica
+from src.metrics import registry
+
+VALIDATOR_HEADERS = ('ETag', 'Last-Modified', 'Cache-Control')
+
+coalesced_requests = registry.counter('response_cache_coalesced_total', 'GET requests answered with the response of an identical concurrent request')
+
+class ResponseCache:
+    """
+    Cache of serialized GET responses keyed on route plus query arguments.
+
+    Every entry depends on a set of tags (e.g. 'requirement:organization:3').
+    Each tag has a random version stored in the backend and baked into the
+    entry key, so invalidating a tag gives it a new version and makes exactly
+    the entries depending on it unreachable. Works on any get/set backend;
+    orphaned entries age out through the TTL and LRU.
+    """
+    def __init__(self, backend, ttl):
+        self.backend = backend
+        self.ttl = ttl
+
+    def _version(self, tag):
+        version = self.backend.get('tag:' + tag)
+        if version is None:
+            # A lost version must never resurrect entries keyed on an older one
+            version = self.invalidate(tag, at=0)
+        return version
+
+    def _key(self, tags):
+        versions = ','.join(self._version(tag) for tag in tags)
+        return f'response:{request.method}:{request.full_path}:{versions}'
+
+    def get(self, tags):
+        return self.backend.get(self._key(tags))
+
+    def set(self, tags, response):
+        self.backend.set(self._key(tags), (response.get_data(), dict(response.headers)), self.ttl)
+
+    def invalidate(self, *tags, at=None):
+        # Versions start with the invalidation time, see invalidated_within
+        version = f'{time.time() if at is None else at:.3f}-{uuid.uuid4().hex}'
+        for tag in tags:
+            self.backend.set('tag:' + tag, version)
+        return version
+
+    def invalidated_within(self, tags, seconds):
+        threshold = time.time() - seconds
+        return any(float(self._version(tag).split('-', 1)[0]) > threshold for tag in tags)
+
+response_cache = ResponseCache(create_cache(), RESPONSE_CACHE_TTL)
+
+class SingleFlight:
+    """
+    Runs one call per key at a time within the process: callers arriving
+    while a call for their key is running wait for it and get its result
+    instead of repeating the work. A follower that waited longer than
+    `timeout` gets None, as when the leader failed.
+    """
+    def __init__(self, timeout=30):
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """
+        Returns the result of `fn` and whether this caller ran it
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'done': threading.Event(), 'result': None}
+        if not leader:
+            call['done'].wait(self.timeout)
+            return call['result'], False
+        try:
+            call['result'] = fn()
+            return call['result'], True
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
+
+in_flight = SingleFlight()
+
+def _cached(entry):
+    body, headers = entry
+    etag = headers.get('ETag')
+    if etag and request.if_none_match.contains_weak(unquote_etag(etag)[0]):
+        return Response(status=304, headers={name: value for name, value in headers.items() if name in VALIDATOR_HEADERS})
+    return Response(body, 200, headers)
+
+def cached_response(tags):
+    """
+    Decorator serving a GET handler from the response cache. `tags` is called
+    with the view arguments and returns the tags the response depends on.
+    Concurrent misses for the same entry are coalesced, so that only one of
+    them runs the handler and the others reuse its response.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            entry_tags = tags(**kwargs)
+            # Whether If-Modified-Since is honoured is up to the handler (see
+            # Validators.check_modified_since), so those requests go past the
+            # cache; If-None-Match takes precedence and is checked on entries
+            by_date = request.if_modified_since and not request.if_none_match
+            entry = None if by_date else response_cache.get(entry_tags)
+            if entry is not None:
+                return _cached(entry)
+
+            def render():
+                response = make_response(fn(*args, **kwargs))
+                # A replica may not have caught up with a write that just
+                # invalidated these tags, its answer must not be cached
+                lagging = reads_from_replica() and response_cache.invalidated_within(entry_tags, REPLICA_STICKY_SECONDS)
+                if response.status_code == 200 and not response.is_streamed and not lagging:
+                    response_cache.set(entry_tags, response)
+                    return response, (response.get_data(), dict(response.headers))
+                return response, None
+
+            # Only what could be cached is shared; conditional requests may
+            # end in a 304 the others cannot use, they run on their own
+            if request.if_none_match or request.if_modified_since:
+                return render()[0]
+            result, leader = in_flight.do(response_cache._key(entry_tags), render)
+            if leader:
+                return result[0]
+            if result is not None and result[1] is not None:
+                coalesced_requests.inc()
+                return _cached(result[1])
+            return render()[0]
+        return wrapper
+    return decorator
@@ -0,0 +1,132 @@
+import time
+import hashlib
+import itertools
+import threading
+from flask import current_app, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event, text
+from settings import REPLICA_HEALTH_CHECK_INTERVAL, REPLICA_STICKY_SECONDS
+from src.cache import create_cache
+from src.database import engine_options, instrument_pool
+from src.helpers import log
+
+class ReplicaRouter:
+    """
+    Round-robin over the healthy read replicas. A background thread pings
+    every replica each REPLICA_HEALTH_CHECK_INTERVAL seconds, and a replica
+    whose connection fails during a request is taken out of rotation until
+    its next successful ping.
+    """
+    def __init__(self):
+        self.engines = []
+        self.healthy = set()
+        self._counter = itertools.count()
+        self._monitor = None
+        self._stop = threading.Event()
+        # Clients that wrote recently, shared across workers with a shared cache backend
+        self.recent_writers = create_cache()
+
+    def init_app(self, app, uris):
+        self.engines = [create_engine(uri, **engine_options(uri)) for uri in uris]
+        for index, engine in enumerate(self.engines):
+            instrument_pool(engine, f'replica-{index}')
+            event.listen(engine, 'handle_error', self._on_error(engine))
+        self.check()
+        if self.engines and self._monitor is None:
+            self._monitor = threading.Thread(target=self._watch, name='replica-health', daemon=True)
+            self._monitor.start()
+
+        app.before_request(route_request)
+        app.after_request(remember_writer)
+
+    def _on_error(self, engine):
+        def handle_error(context):
+            if context.is_disconnect:
+                self.healthy.discard(engine)
+        return handle_error
+
+    def check(self):
+        for engine in self.engines:
+            try:
+                with engine.connect() as connection:
+                    connection.execute(text('SELECT 1'))
+                self.healthy.add(engine)
+            except Exception as e:
+                log(e)
+                self.healthy.discard(engine)
+
+    def _watch(self):
+        while not self._stop.wait(REPLICA_HEALTH_CHECK_INTERVAL):
+            self.check()
+
+    def pick(self):
+        """
+        The next healthy replica engine, or None to fall back to the primary
+        """
+        healthy = [engine for engine in self.engines if engine in self.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self._counter) % len(healthy)]
+
+replicas = ReplicaRouter()
+
+class RoutingSession(Session):
+    """
+    Session sending the reads of read-only requests to a replica. Flushes,
+    DML statements and every statement after the first write of the
+    session go to the primary.
+    """
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and self.info.get('use_replica') and not self.info.get('wrote')
+                and not self._flushing and not getattr(clause, 'is_dml', False)):
+            engine = replicas.pick()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _mark_written(session, flush_context):
+    session.info['wrote'] = True
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _mark_statement_written(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info['wrote'] = True
+
+def reads_from_replica():
+    info = current_app.extensions['sqlalchemy'].session.info
+    return bool(replicas.engines and info.get('use_replica') and not info.get('wrote'))
+
+def read_only(fn):
+    """
+    Mark a non-GET view as safe to serve from a read replica
+    """
+    fn.read_only = True
+    return fn
+
+def use_primary(fn):
+    """
+    Mark a GET view as reading from the primary, for reads that must see
+    writes made outside the client's own requests
+    """
+    fn.use_primary = True
+    return fn
+
+def client_key():
+    auth_header = request.headers.get('Authorization')
+    identity = auth_header or request.remote_addr or ''
+    return 'writer:' + hashlib.sha256(identity.encode()).hexdigest()
+
+def route_request():
+    if not replicas.engines:
+        return
+    session = current_app.extensions['sqlalchemy'].session
+    view = current_app.view_functions.get(request.endpoint)
+    read_only_request = (request.method in ('GET', 'HEAD', 'OPTIONS') or getattr(view, 'read_only', False)) and not getattr(view, 'use_primary', False)
+    # Clients that wrote within the sticky window read their own writes from the primary
+    session.info['use_replica'] = read_only_request and replicas.recent_writers.get(client_key()) is None
+
+def remember_writer(response):
+    if replicas.engines and current_app.extensions['sqlalchemy'].session.info.get('wrote'):
+        replicas.recent_writers.set(client_key(), time.time(), REPLICA_STICKY_SECONDS)
+    return response
@@ -1,4 +1,4 @@
-from marshmallow import Schema, fields, validate
+from marshmallow import Schema, fields, validate, EXCLUDE
 
 class RegisterRequestSchema(Schema):
     name = fields.Str(required=True, validate=validate.Length(min=3))
@@ -32,11 +32,33 @@ class RequirementSchema(Schema):
     status_id = fields.Int(required=True)
     type_id = fields.Int(required=True)
     organization_id = fields.Int(required=True)
+    fulfilled_quantity = fields.Int(dump_only=True)
+    percent_complete = fields.Int(dump_only=True)
     created_at = fields.DateTime(dump_only=True)
     updated_at = fields.DateTime(dump_only=True)
 
 requirement_schema = RequirementSchema()
 requirements_schema = RequirementSchema(many=True)
 
+class RequirementImportSchema(RequirementSchema):
+    class Meta:
+        # Lets exported files be imported back as they are
+        unknown = EXCLUDE
 
+    id = fields.Int() # Rows with an id update that requirement
+    deadline = fields.DateTime(allow_none=True)
 
+requirement_import_schema = RequirementImportSchema()
+
+class DonationSchema(Schema):
+    id = fields.Int(dump_only=True)
+    organization_id = fields.Int(required=True)
+    requirement_id = fields.Int(allow_none=True)
+    type_id = fields.Int(required=True)
+    status_id = fields.Int(required=True)
+    description = fields.Str(required=True, validate=validate.Length(max=255))
+    quantity = fields.Int(required=True, validate=validate.Range(min=1))
+    created_at = fields.DateTime(dump_only=True)
+    updated_at = fields.DateTime(dump_only=True)
+
+donation_schema = DonationSchema()
@@ -0,0 +1,239 @@
+import re
+import math
+import threading
+import weakref
+from collections import defaultdict, Counter
+from sqlalchemy import func, literal_column, or_
+from src.models import db, Organization, Requirement, model_saved, model_deleted, models_bulk_saved
+
+SEARCH_LANGUAGE = 'english'
+
+# Searchable text columns of each model with their weight, highest first.
+# The Postgres `search_vector` columns (see migration 7c41d9e2a8f3) use the
+# same columns with weights A and B.
+SEARCH_FIELDS = {
+    Requirement: (('title', 1.0), ('description', 0.4)),
+    Organization: (('name', 1.0), ('description', 0.4)),
+}
+
+## Text Analysis ##
+STOPWORDS = frozenset((
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in', 'is', 'it',
+    'of', 'on', 'or', 'that', 'the', 'to', 'was', 'were', 'with'
+))
+TOKEN_RE = re.compile(r'\w+')
+
+def stem(word):
+    """
+    Light suffix stripping so that e.g. blanket / blankets and donate /
+    donating share a term, not a full Porter stemmer
+    """
+    for suffix in ('ing', 'ies', 'es', 'ed', 's'):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            word = word[:-len(suffix)]
+            return word + 'y' if suffix == 'ies' else word
+    return word
+
+def analyze(text):
+    return [stem(token) for token in TOKEN_RE.findall((text or '').lower()) if token not in STOPWORDS]
+
+def within_edits(a, b, max_edits):
+    """
+    Whether the Levenshtein distance between a and b is at most max_edits
+    """
+    if abs(len(a) - len(b)) > max_edits:
+        return False
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > max_edits:
+            return False
+        previous = current
+    return previous[-1] <= max_edits
+
+## In-process Index ##
+class InvertedIndex:
+    """
+    BM25 ranked inverted index of one model, for databases without full text
+    search (SQLite in tests and local setups). Documents are added, replaced
+    and removed one at a time, so keeping it current costs one analysis of the
+    changed row per write. Query terms missing from the vocabulary are
+    matched to terms within one or two edits, or that they prefix, at a
+    reduced score.
+    """
+    K1 = 1.2
+    B = 0.75
+    FUZZY_PENALTY = 0.5
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.postings = defaultdict(dict) # term -> {doc id: weighted term frequency}
+        self.documents = {} # doc id -> (length, terms)
+        self.total_length = 0
+        self._lock = threading.Lock()
+
+    def add(self, row):
+        frequencies = Counter()
+        length = 0
+        for field, weight in self.fields:
+            terms = analyze(getattr(row, field))
+            length += len(terms)
+            for term in terms:
+                frequencies[term] += weight
+        with self._lock:
+            self._remove(row.id)
+            for term, frequency in frequencies.items():
+                self.postings[term][row.id] = frequency
+            self.documents[row.id] = (length, tuple(frequencies))
+            self.total_length += length
+
+    def remove(self, id):
+        with self._lock:
+            self._remove(id)
+
+    def _remove(self, id):
+        document = self.documents.pop(id, None)
+        if document is None:
+            return
+        length, terms = document
+        self.total_length -= length
+        for term in terms:
+            postings = self.postings[term]
+            postings.pop(id, None)
+            if not postings:
+                del self.postings[term]
+
+    def _expand(self, term):
+        """
+        Vocabulary terms a query term matches, with the weight of the match
+        """
+        if term in self.postings:
+            return [(term, 1.0)]
+        max_edits = 1 if len(term) <= 5 else 2
+        return [
+            (candidate, self.FUZZY_PENALTY) for candidate in self.postings
+            if candidate.startswith(term) or within_edits(term, candidate, max_edits)
+        ]
+
+    def search(self, text):
+        """
+        Ids of the matching documents with their score, best first
+        """
+        with self._lock:
+            count = len(self.documents)
+            if not count:
+                return []
+            average_length = self.total_length / count or 1
+            scores = defaultdict(float)
+            for term in set(analyze(text)):
+                for candidate, boost in self._expand(term):
+                    postings = self.postings[candidate]
+                    idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                    for id, frequency in postings.items():
+                        length = self.documents[id][0]
+                        norm = frequency + self.K1 * (1 - self.B + self.B * length / average_length)
+                        scores[id] += boost * idf * frequency * (self.K1 + 1) / norm
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+class IndexRegistry:
+    """
+    In-process indexes per engine and model, built from the table on first
+    use and then kept current from the model signals
+    """
+    def __init__(self):
+        self._indexes = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def get(self, model, build=True):
+        engine = db.engine
+        with self._lock:
+            indexes = self._indexes.setdefault(engine, {})
+            index = indexes.get(model)
+            if index is not None or not build:
+                return index
+            index = indexes[model] = InvertedIndex(SEARCH_FIELDS[model])
+            # Build while holding the lock so concurrent first searches do not
+            # both scan the table; writes racing with the build are re-added
+            # by their signal once it is registered.
+            for row in db.session.execute(db.select(model).execution_options(yield_per=1000)).scalars():
+                index.add(row)
+            return index
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+search_indexes = IndexRegistry()
+
+def uses_full_text_search():
+    return db.engine.dialect.name == 'postgresql'
+
+## Index Maintenance ##
+def _live_index(model):
+    # Only indexes already built need updating, the others read the table when built
+    if model not in SEARCH_FIELDS or uses_full_text_search():
+        return None
+    return search_indexes.get(model, build=False)
+
+@model_saved.connect
+def _index_saved(model, instance):
+    index = _live_index(model)
+    if index is not None:
+        index.add(instance)
+
+@model_deleted.connect
+def _unindex_deleted(model, instance):
+    index = _live_index(model)
+    if index is not None:
+        index.remove(instance.id)
+
+@models_bulk_saved.connect
+def _index_bulk_saved(model, ids):
+    index = _live_index(model)
+    if index is not None and ids:
+        for row in model.query.filter(model.id.in_(ids)):
+            index.add(row)
+
+## Search ##
+def search(model, text, query, offset, limit):
+    """
+    Rows of `query` (a filtered Query of `model`) matching `text`, best
+    first. Returns the rows in [offset, offset + limit) and whether more
+    follow.
+    """
+    if uses_full_text_search():
+        rows = _search_postgres(model, text, query, offset, limit + 1)
+    else:
+        rows = _search_index(model, text, query, offset, limit + 1)
+    return rows[:limit], len(rows) > limit
+
+def _search_postgres(model, text, query, offset, limit):
+    """
+    Match against the GIN indexed `search_vector` column, or by trigram
+    similarity of the title / name (above pg_trgm.similarity_threshold) to
+    survive typos, ranked by cover density plus similarity
+    """
+    name = getattr(model, SEARCH_FIELDS[model][0][0])
+    vector = literal_column(f'{model.__tablename__}.search_vector')
+    ts_query = func.websearch_to_tsquery(SEARCH_LANGUAGE, text)
+    rank = func.ts_rank_cd(vector, ts_query) + func.similarity(name, text)
+    return (
+        query
+        .filter(or_(vector.op('@@')(ts_query), name.op('%')(text)))
+        .order_by(rank.desc(), model.id)
+        .offset(offset)
+        .limit(limit)
+        .all()
+    )
+
+def _search_index(model, text, query, offset, limit):
+    ranked = search_indexes.get(model).search(text)
+    if not ranked:
+        return []
+    order = {id: position for position, (id, _) in enumerate(ranked)}
+    # Filters are applied by the database, matches are few in the setups this serves
+    rows = query.filter(model.id.in_(order)).all()
+    rows.sort(key=lambda row: order[row.id])
+    return rows[offset:offset + limit]
@@ -0,0 +1,80 @@
+import json
+from marshmallow import fields
+from src.schemas import organization_schema, requirement_schema, requirement_import_schema
+
+try:
+    import orjson
+except ImportError: # orjson is optional
+    orjson = None
+
+def encode_json(data, default=None, sort_keys=False):
+    """
+    Encode to compact JSON bytes, with orjson when it is installed. Both
+    paths produce the same bytes. `default` converts values JSON has no type
+    for, datetimes included, so that they are encoded the same either way.
+    """
+    if orjson is not None:
+        option = (orjson.OPT_SORT_KEYS if sort_keys else 0) | (orjson.OPT_PASSTHROUGH_DATETIME if default else 0)
+        return orjson.dumps(data, default=default, option=option)
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False, default=default, sort_keys=sort_keys).encode()
+
+def _converter(field):
+    """
+    Source of an expression converting `value` exactly as the field's
+    _serialize would, or None if the field needs the generic path
+    """
+    serialize = type(field)._serialize
+    if serialize is fields.String._serialize:
+        return 'str(value)'
+    if isinstance(field, fields.Integer) and serialize is fields.Number._serialize and not field.as_string:
+        return 'int(value)'
+    if type(field) is fields.DateTime and field.format in (None, 'iso'):
+        return 'value.isoformat()'
+    return None
+
+class CompiledSerializer:
+    """
+    Serializer generated once from a marshmallow schema, producing the same
+    output as schema.dump for objects without going through marshmallow's
+    per-field machinery. Fields of unsupported types still call
+    field.serialize, so the output never differs. Schemas with dump hooks
+    are not supported.
+    """
+    def __init__(self, schema):
+        if schema._hooks.get('pre_dump') or schema._hooks.get('post_dump'):
+            raise ValueError(f'{type(schema).__name__} has dump hooks and cannot be compiled')
+        self.schema = schema
+        self.source, self.dump_one = self._compile(schema)
+
+    @staticmethod
+    def _compile(schema):
+        namespace = {'fields_': {}}
+        lines = ['def dump_one(obj):', '    data = {}']
+        for name, field in schema.dump_fields.items():
+            key = field.data_key or name
+            attribute = field.attribute or name
+            converter = _converter(field)
+            if converter is None or not attribute.isidentifier():
+                namespace['fields_'][name] = field
+                lines.append(f'    data[{key!r}] = fields_[{name!r}].serialize({name!r}, obj)')
+            else:
+                lines.append(f'    value = obj.{attribute}')
+                lines.append(f'    data[{key!r}] = None if value is None else {converter}')
+        lines.append('    return data')
+        source = '\n'.join(lines)
+        exec(compile(source, f'<compiled {type(schema).__name__}>', 'exec'), namespace)
+        return source, namespace['dump_one']
+
+    def dump(self, obj, many=None):
+        many = self.schema.many if many is None else many
+        if many:
+            dump_one = self.dump_one
+            return [dump_one(item) for item in obj]
+        return self.dump_one(obj)
+
+    def dumps(self, obj, many=None):
+        return encode_json(self.dump(obj, many))
+
+organization_serializer = CompiledSerializer(organization_schema)
+requirement_serializer = CompiledSerializer(requirement_schema)
+requirement_import_serializer = CompiledSerializer(requirement_import_schema)
@@ -0,0 +1,242 @@
+import threading
+from datetime import datetime, timedelta
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event, case, func, select, delete, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from settings import STATS_REFRESH_INTERVAL, STATS_REFRESH_BATCH_SIZE
+from src.models import (
+    db, Organization, Requirement, Donation, Type, Status, lookups, changed_values,
+    OrganizationRequirementStats, OrganizationDonationStats, StaleOrganizationStats
+)
+from src.response_cache import response_cache
+from src.helpers import log
+
+## Staleness Tracking ##
+def mark_stale(connection, organization_ids):
+    """
+    Queue organizations for an aggregates refresh, in the transaction of the
+    write that changed them. Every mark bumps the version, so a refresh that
+    read an older version leaves the newer mark queued.
+    """
+    organization_ids = sorted({id for id in organization_ids if id is not None}) # fixed lock order
+    if not organization_ids:
+        return
+    insert = (postgresql if connection.dialect.name == 'postgresql' else sqlite).insert
+    now = datetime.utcnow()
+    statement = insert(StaleOrganizationStats).values([
+        {'organization_id': id, 'version': 1, 'marked_at': now} for id in organization_ids
+    ])
+    connection.execute(statement.on_conflict_do_update(
+        index_elements=[StaleOrganizationStats.organization_id],
+        set_={'version': StaleOrganizationStats.version + 1, 'marked_at': statement.excluded.marked_at}
+    ))
+
+def _requirement_organizations(connection, requirement_ids):
+    if not requirement_ids:
+        return []
+    return connection.execute(select(Requirement.organization_id).where(Requirement.id.in_(requirement_ids))).scalars().all()
+
+@event.listens_for(Requirement, 'after_insert')
+@event.listens_for(Requirement, 'after_update')
+@event.listens_for(Requirement, 'after_delete')
+def _requirement_changed(mapper, connection, target):
+    mark_stale(connection, changed_values(target, 'organization_id'))
+
+@event.listens_for(Donation, 'after_insert')
+@event.listens_for(Donation, 'after_update')
+@event.listens_for(Donation, 'after_delete')
+def _donation_changed(mapper, connection, target):
+    # A donation also moves the progress, hence the open count, of its requirement
+    organization_ids = changed_values(target, 'organization_id')
+    organization_ids.update(_requirement_organizations(connection, changed_values(target, 'requirement_id')))
+    mark_stale(connection, organization_ids)
+
+## Refresh ##
+def _requirement_aggregates(organization_ids):
+    return (
+        select(
+            Requirement.organization_id, Requirement.type_id, Requirement.status_id,
+            func.count(Requirement.id),
+            func.sum(case((Requirement.percent_complete < 100, 1), else_=0)),
+            func.sum(Requirement.quantity),
+            func.sum(Requirement.fulfilled_quantity)
+        )
+        .where(Requirement.organization_id.in_(organization_ids))
+        .group_by(Requirement.organization_id, Requirement.type_id, Requirement.status_id)
+    )
+
+def _donation_aggregates(organization_ids):
+    day = func.date(Donation.created_at)
+    return (
+        select(
+            Donation.organization_id, day, Donation.type_id, Donation.status_id,
+            func.count(Donation.id),
+            func.sum(Donation.quantity)
+        )
+        .where(Donation.organization_id.in_(organization_ids))
+        .group_by(Donation.organization_id, day, Donation.type_id, Donation.status_id)
+    )
+
+def refresh_stats(batch_size=STATS_REFRESH_BATCH_SIZE):
+    """
+    Recompute the aggregates of up to `batch_size` stale organizations,
+    oldest marks first, in one transaction. Only the summary rows of those
+    organizations are rewritten, with two grouped INSERT ... SELECT. On
+    Postgres the marks are claimed with SKIP LOCKED, so several workers can
+    refresh at once. Returns the number of organizations refreshed.
+    """
+    try:
+        claimed = db.session.execute(
+            select(StaleOrganizationStats.organization_id, StaleOrganizationStats.version)
+            .order_by(StaleOrganizationStats.marked_at)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        ).all()
+        if not claimed:
+            db.session.rollback()
+            return 0
+        organization_ids = [organization_id for organization_id, _ in claimed]
+
+        for model, aggregates in (
+            (OrganizationRequirementStats, _requirement_aggregates),
+            (OrganizationDonationStats, _donation_aggregates)
+        ):
+            db.session.execute(delete(model).where(model.organization_id.in_(organization_ids)))
+            columns = [column.name for column in model.__table__.columns]
+            db.session.execute(model.__table__.insert().from_select(columns, aggregates(organization_ids)))
+
+        # Marks bumped while refreshing stay queued for the next run
+        db.session.execute(delete(StaleOrganizationStats).where(
+            tuple_(StaleOrganizationStats.organization_id, StaleOrganizationStats.version).in_(claimed)
+        ))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    response_cache.invalidate(*(f'organization:{id}:stats' for id in organization_ids))
+    return len(organization_ids)
+
+def refresh_all_stats(rebuild=False, batch_size=STATS_REFRESH_BATCH_SIZE):
+    """
+    Refresh until nothing is stale, after marking every organization stale
+    when rebuilding (e.g. after the summary tables were created)
+    """
+    if rebuild:
+        organization_ids = db.session.scalars(select(Organization.id)).all()
+        for start in range(0, len(organization_ids), batch_size):
+            mark_stale(db.session.connection(), organization_ids[start:start + batch_size])
+            db.session.commit()
+    refreshed = 0
+    while True:
+        count = refresh_stats(batch_size)
+        if not count:
+            return refreshed
+        refreshed += count
+
+class StatsRefresher:
+    """
+    Background thread refreshing stale aggregates every STATS_REFRESH_INTERVAL
+    seconds. It starts with the first request the app serves, so that it
+    runs in each worker process after a pre-fork server has forked, and not
+    in processes that only import the app (CLI commands, scripts).
+    """
+    def __init__(self):
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def init_app(self, app, interval=STATS_REFRESH_INTERVAL):
+        if not interval:
+            return
+
+        def start():
+            if self._thread is None:
+                with self._lock:
+                    if self._thread is None:
+                        self._thread = threading.Thread(target=self._run, args=(app, interval), name='stats-refresh', daemon=True)
+                        self._thread.start()
+        app.before_request(start)
+
+    def _run(self, app, interval):
+        while not self._stop.wait(interval):
+            try:
+                with app.app_context():
+                    refresh_all_stats()
+            except Exception as e:
+                log(e)
+
+stats_refresher = StatsRefresher()
+
+@click.command('refresh-stats')
+@click.option('--rebuild', is_flag=True, help='Recompute every organization, not only the stale ones.')
+@with_appcontext
+def refresh_stats_command(rebuild):
+    """Refresh the organization dashboard aggregates."""
+    click.echo(f'{refresh_all_stats(rebuild)} organizations refreshed')
+
+## Reads ##
+def _breakdown(model, totals):
+    return [
+        {'id': id, 'name': lookups.name(model, id), **values}
+        for id, values in sorted(totals.items())
+    ]
+
+def _add(totals, values):
+    for name, value in values.items():
+        totals[name] = totals.get(name, 0) + value
+
+def organization_stats(organization_id, days):
+    """
+    Dashboard aggregates of an organization read from the summary tables:
+    requirement and donation totals by type and status, and donation volume
+    per day over the last `days` days
+    """
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    requirement_rows = OrganizationRequirementStats.query.filter_by(organization_id=organization_id).all()
+    donation_rows = (
+        db.session.query(
+            OrganizationDonationStats.day, OrganizationDonationStats.type_id, OrganizationDonationStats.status_id,
+            OrganizationDonationStats.donation_count, OrganizationDonationStats.quantity
+        )
+        .filter(OrganizationDonationStats.organization_id == organization_id)
+        .all()
+    )
+    stale = db.session.get(StaleOrganizationStats, organization_id) is not None
+
+    requirements = {'count': 0, 'open': 0, 'quantity': 0, 'fulfilled_quantity': 0}
+    requirements_by_type, requirements_by_status = {}, {}
+    for row in requirement_rows:
+        values = {
+            'count': row.requirement_count, 'open': row.open_count,
+            'quantity': row.quantity, 'fulfilled_quantity': row.fulfilled_quantity
+        }
+        _add(requirements, values)
+        _add(requirements_by_type.setdefault(row.type_id, {}), values)
+        _add(requirements_by_status.setdefault(row.status_id, {}), values)
+
+    donations = {'count': 0, 'quantity': 0}
+    donations_by_type, donations_by_status, donations_by_day = {}, {}, {}
+    for day, type_id, status_id, count, quantity in donation_rows:
+        values = {'count': count, 'quantity': quantity}
+        _add(donations, values)
+        _add(donations_by_type.setdefault(type_id, {}), values)
+        _add(donations_by_status.setdefault(status_id, {}), values)
+        if day >= since:
+            _add(donations_by_day.setdefault(day, {}), values)
+
+    return {
+        'organization_id': organization_id,
+        'stale': stale,
+        'requirements': {
+            **requirements,
+            'by_type': _breakdown(Type, requirements_by_type),
+            'by_status': _breakdown(Status, requirements_by_status)
+        },
+        'donations': {
+            **donations,
+            'by_type': _breakdown(Type, donations_by_type),
+            'by_status': _breakdown(Status, donations_by_status),
+            'by_day': [{'day': day.isoformat(), **values} for day, values in sorted(donations_by_day.items())]
+        }
+    }
@@ -0,0 +1,99 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import jwt
+from settings import SECRET_KEY, JWT_KEYS, JWT_ACTIVE_KEY, JWT_KEYS_FILE, TOKEN_CACHE_SIZE
+from src.cache import MemoryCache
+
+class KeyRing:
+    """
+    HS256 signing keys addressed by `kid`. Tokens are signed with the active
+    key and verified with whichever key their header names, so keys can be
+    rotated by adding a new one, switching the active key and removing the
+    old one once its tokens have expired. When a keys file is configured it
+    is re-read on change, so rotation does not need a restart. Tokens
+    without a `kid` are verified with SECRET_KEY.
+    """
+    def __init__(self, keys, active, path=None, check_interval=5):
+        self.keys = dict(keys)
+        self.active = active
+        self.path = path
+        self.check_interval = check_interval
+        self._mtime = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def on_change(self, listener):
+        self._listeners.append(listener)
+
+    def refresh(self, force=False):
+        if not self.path or (not force and time.monotonic() - self._checked_at < self.check_interval):
+            return
+        with self._lock:
+            self._checked_at = time.monotonic()
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except FileNotFoundError:
+                return
+            if mtime == self._mtime:
+                return
+            with open(self.path) as keys_file:
+                config = json.load(keys_file)
+            removed = set(self.keys) - set(config['keys'])
+            self.keys, self.active, self._mtime = config['keys'], config.get('active'), mtime
+        if removed:
+            for listener in self._listeners:
+                listener(removed)
+
+    def signing_key(self):
+        self.refresh()
+        if self.active is None:
+            return None, SECRET_KEY
+        return self.active, self.keys[self.active]
+
+    def verification_key(self, kid):
+        if kid is None:
+            return SECRET_KEY
+        self.refresh()
+        if kid not in self.keys:
+            # The key may have been added since the last periodic check
+            self.refresh(force=True)
+        if kid not in self.keys:
+            raise jwt.InvalidTokenError(f'Unknown key id {kid!r}')
+        return self.keys[kid]
+
+keyring = KeyRing(JWT_KEYS, JWT_ACTIVE_KEY, JWT_KEYS_FILE)
+
+# Key id and claims of verified tokens keyed by token digest, each entry expiring with its token
+verified_tokens = MemoryCache(TOKEN_CACHE_SIZE)
+keyring.on_change(lambda removed: verified_tokens.clear())
+
+def encode_token(payload):
+    kid, secret = keyring.signing_key()
+    headers = {'kid': kid} if kid else None
+    return jwt.encode(payload, secret, algorithm='HS256', headers=headers)
+
+def decode_token(token):
+    """
+    Verify a token and return its claims, skipping the signature check for
+    tokens verified before. Raises the same jwt errors as jwt.decode.
+    """
+    digest = hashlib.sha256(token.encode()).hexdigest()
+    cached = verified_tokens.get(digest)
+    if cached is not None:
+        kid, claims = cached
+        # A key removed since must revoke its tokens, those fall through to
+        # the full check below and fail there as on a cache miss
+        keyring.refresh()
+        if kid is None or kid in keyring.keys:
+            return claims
+
+    kid = jwt.get_unverified_header(token).get('kid')
+    claims = jwt.decode(token, keyring.verification_key(kid), algorithms=['HS256'], options={'require': ['exp']})
+    ttl = claims['exp'] - time.time()
+    if ttl > 0:
+        verified_tokens.set(digest, (kid, claims), ttl)
+    return claims
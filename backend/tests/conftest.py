@@ -0,0 +1,34 @@
+import pytest
+from app import create_app
+from benchmarks.common import seed
+from src.models import db, lookups
+from src.response_cache import response_cache
+
+@pytest.fixture
+def app(tmp_path):
+    # A file database, background workers write from their own connections
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path}/test.db',
+        'STATS_REFRESH_INTERVAL': 0,
+        'RATE_LIMITS': {}
+    })
+    response_cache.backend.clear()
+    lookups.backend.clear()
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def seeded(app):
+    """
+    Fill the database with a few rows of each table, `seeded(requirements=...)` for more
+    """
+    def fill(users=3, organizations=5, requirements=20, donations=0):
+        seed(users=users, organizations=organizations, requirements=requirements, donations=donations)
+        db.session.expunge_all()
+    return fill
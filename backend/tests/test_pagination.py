@@ -0,0 +1,26 @@
+import pytest
+from src.pagination import DEFAULT_LIMIT, MAX_LIMIT
+
+LISTINGS = ['/api/v1/organization/', '/api/v1/requirement/', '/api/v1/search/?q=winter']
+
+@pytest.fixture(autouse=True)
+def rows(seeded):
+    seeded(organizations=30, requirements=150)
+
+@pytest.mark.parametrize('url', LISTINGS + ['/api/v1/requirement/match?type_id=1&quantity=5'])
+@pytest.mark.parametrize('limit', ['0', '-1', 'x'])
+def test_invalid_limit_rejected(client, url, limit):
+    separator = '&' if '?' in url else '?'
+    response = client.get(f'{url}{separator}limit={limit}')
+    assert response.status_code == 400
+    assert 'limit' in response.get_json()['message']
+
+@pytest.mark.parametrize('query, expected', [('', DEFAULT_LIMIT), ('limit=1', 1), ('limit=1000', MAX_LIMIT)])
+def test_limit(client, query, expected):
+    response = client.get(f'/api/v1/requirement/?{query}')
+    assert response.status_code == 200
+    assert len(response.get_json()['data']) == expected
+
+def test_search_page_must_be_positive(client):
+    response = client.get('/api/v1/search/?q=winter&page=0')
+    assert response.status_code == 400
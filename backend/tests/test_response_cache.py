@@ -0,0 +1,27 @@
+import pytest
+
+@pytest.fixture
+def requirement_url(seeded):
+    seeded()
+    return '/api/v1/requirement/1'
+
+def test_if_modified_since_after_cache_warmed(client, requirement_url):
+    response = client.get(requirement_url)
+    assert response.status_code == 200
+    last_modified = response.headers['Last-Modified']
+    # The response above is now cached, repeat until served from the cache
+    for _ in range(2):
+        response = client.get(requirement_url, headers={'If-Modified-Since': last_modified})
+        assert response.status_code == 304
+
+def test_if_modified_since_before_change(client, requirement_url):
+    client.get(requirement_url)
+    response = client.get(requirement_url, headers={'If-Modified-Since': 'Mon, 01 Jan 2001 00:00:00 GMT'})
+    assert response.status_code == 200
+    assert response.get_json()['data']['id'] == 1
+
+def test_if_none_match_served_from_cache(client, requirement_url):
+    etag = client.get(requirement_url).headers['ETag']
+    response = client.get(requirement_url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
@@ -0,0 +1,38 @@
+from contextlib import contextmanager
+import pytest
+from sqlalchemy import event
+from src.models import db, lookups, Type, Status, Organization, Requirement, Donation
+
+@contextmanager
+def count_queries():
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+
+def queries_to_serialize(model, count):
+    db.session.expunge_all()
+    items = model.query.order_by(model.id).limit(count).all()
+    with count_queries() as statements:
+        serialized = model.serialize_many(items)
+    assert len(serialized) == len(items) == count
+    return len(statements)
+
+@pytest.fixture(autouse=True)
+def rows(seeded):
+    seeded(users=20, organizations=40, requirements=200, donations=200)
+    # Served from the lookup cache after the first use
+    lookups.table(Type), lookups.table(Status)
+
+@pytest.mark.parametrize('model', [Organization, Requirement, Donation])
+def test_query_count_does_not_grow_with_rows(model):
+    assert queries_to_serialize(model, 5) == queries_to_serialize(model, 40) == 1
+
+def test_serialize_many_matches_serialize():
+    items = Requirement.query.order_by(Requirement.id).limit(20).all()
+    batched = Requirement.serialize_many(items)
+    db.session.expunge_all()
+    assert batched == [db.session.get(Requirement, item['id']).serialize() for item in batched]
@@ -0,0 +1,62 @@
+import json
+from datetime import datetime
+from decimal import Decimal
+import pytest
+from flask import jsonify
+from src import serializers
+from src.models import db, Organization, Requirement
+from src.schemas import organizations_schema, requirements_schema, RequirementImportSchema
+from src.serializers import organization_serializer, requirement_serializer, requirement_import_serializer, encode_json
+from src.helpers import construct_response
+
+@pytest.fixture
+def rows(seeded):
+    seeded(organizations=5, requirements=20)
+    # Unset optional columns, serialized as nulls
+    db.session.add(Organization(name='bare', description='no contact details', created_by=1))
+    db.session.add(Requirement(organization_id=1, type_id=1, status_id=1, title='t', description='d', quantity=1))
+    db.session.commit()
+    return Organization.query.all(), Requirement.query.all()
+
+def test_compiled_serializers_match_marshmallow(rows):
+    organizations, requirements = rows
+    cases = [
+        (organizations, organizations_schema, organization_serializer),
+        (requirements, requirements_schema, requirement_serializer),
+        (requirements, RequirementImportSchema(many=True), requirement_import_serializer),
+    ]
+    for items, schema, serializer in cases:
+        expected = schema.dump(items)
+        assert serializer.dump(items, many=True) == expected
+        assert [serializer.dump_one(item) for item in items] == expected
+        assert serializer.dump(items[0], many=False) == expected[0]
+
+def test_nulls_and_datetimes(rows):
+    organizations, requirements = rows
+    bare = requirement_import_serializer.dump_one(requirements[-1])
+    assert bare['deadline'] is None
+    assert requirement_import_serializer.dump_one(requirements[0])['deadline'] == requirements[0].deadline.isoformat()
+    assert organization_serializer.dump_one(organizations[-1])['website'] is None
+    assert requirement_serializer.dump_one(requirements[0])['organization_id'] == requirements[0].organization_id
+
+def test_orjson_and_json_encode_the_same(rows, monkeypatch):
+    pytest.importorskip('orjson')
+    data = requirement_serializer.dump(rows[1], many=True) + [{'name': 'café ☕', 'empty': None, 'ratio': 0.25}]
+    with_orjson = encode_json(data), encode_json(data, sort_keys=True)
+    monkeypatch.setattr(serializers, 'orjson', None)
+    assert (encode_json(data), encode_json(data, sort_keys=True)) == with_orjson
+    assert json.loads(with_orjson[0]) == data
+
+@pytest.mark.parametrize('encoder', ['orjson', 'json'])
+def test_construct_response_matches_jsonify(app, monkeypatch, encoder):
+    if encoder == 'orjson':
+        pytest.importorskip('orjson')
+    else:
+        monkeypatch.setattr(serializers, 'orjson', None)
+    data = {'when': datetime(2024, 1, 2, 3, 4, 5), 'amount': Decimal('1.50'), 'id': 3, 'items': [None, 'a']}
+    with app.test_request_context():
+        response, status, headers = construct_response('ok', 201, data, next_cursor=None)
+        expected = jsonify({'message': 'ok', 'data': data, 'next_cursor': None})
+    assert status == 201 and headers['Cache-Control'] == 'no-store'
+    assert response.mimetype == 'application/json'
+    assert response.get_data() == expected.get_data()
@@ -0,0 +1,50 @@
+import os
+import json
+import jwt
+import pytest
+from src.tokens import keyring, verified_tokens, decode_token
+from src.helpers import generate_access_token
+
+@pytest.fixture
+def keys_file(tmp_path, monkeypatch):
+    path = tmp_path / 'keys.json'
+    def write(keys, active, mtime):
+        path.write_text(json.dumps({'keys': keys, 'active': active}))
+        os.utime(path, (mtime, mtime))
+
+    write({'old': 'old-secret', 'new': 'new-secret'}, 'old', 1000)
+    for name, value in (('path', str(path)), ('keys', {}), ('active', None), ('check_interval', 0), ('_mtime', None), ('_checked_at', 0)):
+        monkeypatch.setattr(keyring, name, value)
+    keyring.refresh(force=True)
+    verified_tokens.clear()
+    yield write
+    verified_tokens.clear()
+
+def test_removed_key_revokes_cached_token(keys_file):
+    token = generate_access_token(1, is_organization=True)
+    assert jwt.get_unverified_header(token)['kid'] == 'old'
+    assert decode_token(token)['identity'] == 1
+    assert decode_token(token)['identity'] == 1 # from the cache
+
+    keys_file({'new': 'new-secret'}, 'new', 2000)
+    with pytest.raises(jwt.InvalidTokenError):
+        decode_token(token)
+
+def test_removed_key_answers_401(keys_file, client, seeded):
+    seeded()
+    token = generate_access_token(1, is_organization=True)
+    headers = {'Authorization': f'Bearer {token}', 'Content-Type': 'application/x-ndjson'}
+    for _ in range(2):
+        assert client.post('/api/v1/requirement/bulk', data=b'', headers=headers).status_code == 200
+
+    keys_file({'new': 'new-secret'}, 'new', 2000)
+    response = client.post('/api/v1/requirement/bulk', data=b'', headers=headers)
+    assert response.status_code == 401
+    assert response.get_json()['message'] == 'Invalid token'
+
+def test_tokens_of_remaining_keys_stay_valid(keys_file):
+    keys_file({'old': 'old-secret', 'new': 'new-secret'}, 'new', 2000)
+    token = generate_access_token(1)
+    keys_file({'new': 'new-secret'}, 'new', 3000)
+    assert decode_token(token)['identity'] == 1
+    assert decode_token(token)['identity'] == 1